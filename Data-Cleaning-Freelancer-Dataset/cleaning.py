@@ -1,4 +1,10 @@
-import pandas as pd
+import argparse
+import os
+import sys
+
+# pandas, numpy and pyarrow are imported by the functions using them, so --help and the CLI start fast
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Skill-Extraction', 'src'))
+from instrumentation import add_arguments, count, instrument, timed, timer
 
 def clean_job_data(csv_file):
     """
@@ -11,10 +17,13 @@ def clean_job_data(csv_file):
     Args:
         csv_file: Path to the CSV file
     """
+    import pandas as pd
     
     # Read the CSV file
     print(f"Reading CSV file: {csv_file}")
-    df = pd.read_csv(csv_file)
+    with timer('clean.read'):
+        df = pd.read_csv(csv_file)
+    count('clean.rows', len(df))
     
     # Display initial information
     print(f"\nInitial data shape: {df.shape}")
@@ -41,8 +50,9 @@ def clean_job_data(csv_file):
         return None
     
     # Count rows to be removed
-    industry_filter = df[industry_col].astype(str).str.lower().isin(['other', 'error'])
-    rate_type_filter = df[rate_type_col].astype(str).str.lower() == 'hourly'
+    with timer('clean.filter'):
+        industry_filter = df[industry_col].astype(str).str.lower().isin(['other', 'error'])
+        rate_type_filter = df[rate_type_col].astype(str).str.lower() == 'hourly'
     
     rows_with_other_error = industry_filter.sum()
     rows_with_hourly = rate_type_filter.sum()
@@ -56,6 +66,9 @@ def clean_job_data(csv_file):
     # 1. Industry is 'other' or 'error' (case-insensitive)
     # 2. Rate Type is 'hourly' (case-insensitive)
     df_cleaned = df[~industry_filter & ~rate_type_filter]
+    count('clean.rows_kept', len(df_cleaned))
+    count('clean.rows_industry_removed', int(industry_filter.sum()))
+    count('clean.rows_hourly_removed', int(rate_type_filter.sum()))
     
     # Display cleaning results
     rows_removed = len(df) - len(df_cleaned)
@@ -66,20 +79,207 @@ def clean_job_data(csv_file):
     
     # Save to TSV file
     output_file = csv_file.replace('.csv', '_cleaned.tsv')
-    df_cleaned.to_csv(output_file, sep='\t', index=False)
+    with timer('clean.write'):
+        df_cleaned.to_csv(output_file, sep='\t', index=False)
     
     print(f"\n✓ Cleaned data saved to: {output_file}")
     
     return df_cleaned
 
 
-# Main execution
-if __name__ == "__main__":
+def filter_masks(chunk, industry_col, rate_type_col):
+    """
+    Removal masks of one chunk, the lower casing is done once per category instead of once per row
+    """
+    import numpy as np
+    masks = []
+    for col, values in [(industry_col, ['other', 'error']), (rate_type_col, ['hourly'])]:
+        categorical = chunk[col].cat
+        matches = categorical.categories.astype(str).str.lower().isin(values)
+        # code -1 is a missing value, 'nan' never matches
+        masks.append(np.append(matches, False)[categorical.codes.to_numpy()])
+    return masks
+
+
+def open_csv_reader(csv_file, columns, categorical_cols, block_size):
+    """
+    Stream the CSV with the pyarrow reader, the categorical columns as dictionaries and every other column as text
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pv
+    from pandas._libs.parsers import STR_NA_VALUES
+    column_types = {col: pa.string() for col in columns}
+    column_types.update({col: pa.dictionary(pa.int32(), pa.string()) for col in categorical_cols})
+    return pv.open_csv(
+        csv_file,
+        read_options=pv.ReadOptions(column_names=list(columns), skip_rows=1, block_size=block_size),
+        parse_options=pv.ParseOptions(newlines_in_values=True),
+        convert_options=pv.ConvertOptions(column_types=column_types, null_values=sorted(STR_NA_VALUES),
+                                          strings_can_be_null=True, quoted_strings_can_be_null=True),
+    )
+
+
+def numeric_types(csv_file, columns, categorical_cols, block_size):
+    """
+    Type pandas.read_csv gives every numeric column of the whole file: int64 when all values are integers, float64
+    when all are numbers or integers are missing. Text columns are left out
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    candidates = {col: [pa.int64(), pa.float64()] for col in columns if col not in categorical_cols}
+    for batch in open_csv_reader(csv_file, columns, categorical_cols, block_size):
+        for col, types in candidates.items():
+            array = batch.column(col)
+            for column_type in list(types):
+                if column_type == pa.int64() and array.null_count > 0:
+                    types.remove(column_type)
+                    continue
+                try:
+                    pc.cast(array, column_type)
+                except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                    types.remove(column_type)
+    return {col: types[0] for col, types in candidates.items() if types}
+
+
+def clean_job_data_chunked(csv_file, block_size=64 << 20, parquet_file=None):
+    """
+    Clean job descriptions data like clean_job_data without loading the whole CSV.
+    
+    The CSV is streamed with the pyarrow reader block_size bytes at a time. Industry and Rate Type are read as
+    categoricals, every other column as text, removal statistics are accumulated per chunk and the kept rows are
+    appended to the TSV file, and to parquet_file when given. A first pass over the CSV finds the numeric columns,
+    which are converted like pandas.read_csv does, and missing text is NaN, so the TSV, the summary printout and
+    the preview are the same as clean_job_data's.
+    
+    Args:
+        csv_file: Path to the CSV file
+        block_size: Bytes of CSV parsed per chunk
+        parquet_file: Optional path of a Parquet copy of the cleaned data
+    
+    Returns:
+        The first cleaned rows, as a preview
+    """
+    import numpy as np
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    
+    print(f"Reading CSV file: {csv_file}")
+    columns = pd.read_csv(csv_file, nrows=0).columns
+    categorical_cols = [columns[i] for i in (3, 15) if i < len(columns)]
+    with timer('clean.infer_types'):
+        column_types = numeric_types(csv_file, columns, categorical_cols, block_size)
+    text_cols = [col for col in columns if col not in categorical_cols and col not in column_types]
+    reader = open_csv_reader(csv_file, columns, categorical_cols, block_size)
+    
+    output_file = csv_file.replace('.csv', '_cleaned.tsv')
+    write_output = len(categorical_cols) == 2
+    total_rows = 0
+    kept_rows = 0
+    rows_with_other_error = 0
+    rows_with_hourly = 0
+    rows_with_both = 0
+    unique_values = {col: {} for col in categorical_cols}
+    preview = None
+    tsv_writer = open(output_file, 'w', newline='', encoding='utf-8') if write_output else None
+    parquet_writer = None
+    try:
+        for batch in timed(reader, 'clean.read'):
+            batch = pa.RecordBatch.from_arrays(
+                [pc.cast(batch.column(col), column_types[col]) if col in column_types else batch.column(col)
+                 for col in columns], names=list(columns))
+            chunk = batch.to_pandas()
+            # pyarrow gives None for missing text, pandas.read_csv NaN
+            chunk[text_cols] = chunk[text_cols].where(chunk[text_cols].notna(), np.nan)
+            total_rows += len(chunk)
+            count('clean.rows', len(chunk))
+            for col in categorical_cols:
+                for value in chunk[col].unique():
+                    unique_values[col].setdefault(np.nan if pd.isna(value) else value, None)
+            if not write_output:
+                continue
+            
+            with timer('clean.filter'):
+                industry_filter, rate_type_filter = filter_masks(chunk, *categorical_cols)
+            count('clean.rows_industry_removed', int(industry_filter.sum()))
+            count('clean.rows_hourly_removed', int(rate_type_filter.sum()))
+            rows_with_other_error += int(industry_filter.sum())
+            rows_with_hourly += int(rate_type_filter.sum())
+            rows_with_both += int((industry_filter & rate_type_filter).sum())
+            keep = ~industry_filter & ~rate_type_filter
+            kept_rows += int(keep.sum())
+            count('clean.rows_kept', int(keep.sum()))
+            
+            chunk_cleaned = chunk[keep]
+            with timer('clean.write'):
+                chunk_cleaned.to_csv(tsv_writer, sep='\t', index=False, header=preview is None)
+            if preview is None:
+                preview = chunk_cleaned.head()
+            elif len(preview) < 5:
+                preview = pd.concat([preview, chunk_cleaned.head(5 - len(preview))])
+            if parquet_file is not None:
+                if parquet_writer is None:
+                    parquet_writer = pq.ParquetWriter(parquet_file, batch.schema)
+                with timer('clean.write_parquet'):
+                    parquet_writer.write_batch(batch.filter(pa.array(keep)))
+    finally:
+        if tsv_writer is not None:
+            tsv_writer.close()
+        if parquet_writer is not None:
+            parquet_writer.close()
+    
+    # Display initial information
+    print(f"\nInitial data shape: {(total_rows, len(columns))}")
+    print(f"Total rows before cleaning: {total_rows}")
+    print(f"\nColumn names:")
+    for i, col in enumerate(columns):
+        print(f"  Column {chr(65+i)} (index {i}): {col}")
+    
+    for index, letter, name in [(3, 'D', 'Industry'), (15, 'P', 'Rate Type')]:
+        if index < len(columns):
+            print(f"\nColumn {letter} ({name}): '{columns[index]}'")
+            print(f"Unique values: {np.array(list(unique_values[columns[index]]), dtype=object)}")
+        else:
+            print(f"\nError: CSV doesn't have enough columns for Column {letter}")
+            return None
+    
+    print(f"\nRows with Industry = 'other' or 'error': {rows_with_other_error}")
+    print(f"Rows with Rate Type = 'hourly': {rows_with_hourly}")
+    print(f"Rows with both conditions: {rows_with_both}")
+    
+    # Display cleaning results
+    print(f"\nTotal rows removed: {total_rows - kept_rows}")
+    print(f"Total rows after cleaning: {kept_rows}")
+    print(f"Cleaned data shape: {(kept_rows, len(columns))}")
+    print(f"Percentage retained: {(kept_rows/total_rows*100):.2f}%")
+    
+    print(f"\n✓ Cleaned data saved to: {output_file}")
+    
+    return preview
+
+
+def build_parser(parser=None):
+    if parser is None:
+        parser = argparse.ArgumentParser()
     # Your CSV file
-    csv_file = "Manual Data Clean _ Pivot Table_ Gantt Chart - freelancerresult.csv"
+    parser.add_argument("csv_file", nargs='?', default="Manual Data Clean _ Pivot Table_ Gantt Chart - freelancerresult.csv")
+    parser.add_argument("--chunked", action='store_true', help="stream the CSV instead of loading it in memory")
+    parser.add_argument("--block_size", type=int, default=64 << 20, help="bytes of CSV parsed per chunk")
+    parser.add_argument("--parquet", default=None, help="also write the cleaned data to this Parquet file")
+    add_arguments(parser)
+    return parser
+
+
+def main(args):
+    csv_file = args.csv_file
     
     try:
-        cleaned_df = clean_job_data(csv_file)
+        with instrument('clean', args.metrics_file, args.profile, args.profile_file):
+            if args.chunked:
+                cleaned_df = clean_job_data_chunked(csv_file, args.block_size, args.parquet)
+            else:
+                cleaned_df = clean_job_data(csv_file)
         
         if cleaned_df is not None:
             print("\n" + "="*50)
@@ -94,4 +294,9 @@ if __name__ == "__main__":
     except Exception as e:
         print(f"\nError occurred: {e}")
         import traceback
-        traceback.print_exc()
\ No newline at end of file
+        traceback.print_exc()
+
+
+# Main execution
+if __name__ == "__main__":
+    main(build_parser().parse_args())
@@ -0,0 +1,408 @@
+"""
+Benchmark of every pipeline stage on synthetic corpora scaled from data/test.jsonl. \
+Date:
+    2026/10/18
+
+The corpora keep the sentences of data/test.jsonl, add random SKILL/KNOWLEDGE spans and long sentences made of
+several joined sentences, and come with prompt, prediction (malformed ones included), processed prediction, IOB
+and freelancer CSV files. Every stage runs offline in its own process, which reports its wall time, rows/sec and
+peak RSS. The results are compared with a JSON baseline and the run fails when a stage is slower, or uses more
+memory, than the baseline by more than the tolerance.
+
+The cold start of skill_extraction.py, the --help of every subcommand and an evaluation of 10 rows, is timed on
+the first scale as well, skip it with --skip_cold_start.
+
+Usage:
+    python benchmark.py --scales 1,10 --update_baseline   # record the baseline
+    python benchmark.py --scales 1,10                      # compare with it
+"""
+import contextlib
+import csv
+import importlib.util
+import io
+import itertools
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+
+SRC_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+BASE_FILE = os.path.join(SRC_DIRECTORY, '..', 'data', 'test.jsonl')
+CLEANING_SCRIPT = os.path.join(SRC_DIRECTORY, '..', '..', 'Data-Cleaning-Freelancer-Dataset', 'cleaning.py')
+CLI_SCRIPT = os.path.join(SRC_DIRECTORY, 'skill_extraction.py')
+CLI_COMMANDS = ['prepare', 'convert', 'combine', 'evaluate', 'clean']
+LABELS = ['SKILL', 'KNOWLEDGE']
+STAGES = ['convert', 'gliner_utils', 'prepare', 'prepare_streaming', 'combine', 'combine_streaming',
+          'evaluate_nervaluate', 'evaluate_native', 'clean', 'clean_chunked']
+
+
+def load_module(path, name):
+    """
+    Import a script by path, with its directory on sys.path for its sibling imports.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def set_token_offsets(record):
+    """
+    Fill in the character offsets of the tokens, which are all 0 in data/test.jsonl, the end being inclusive.
+    """
+    position = 0
+    for token in record['tokens']:
+        start = record['text'].find(token['text'], position)
+        if start < 0:
+            # a token changed by html unescaping, keep counting from the current position
+            start = position
+        token['start'], token['end'] = start, start + len(token['text']) - 1
+        position = start + len(token['text'])
+    return record
+
+
+def add_spans(record, rng):
+    """
+    Annotate a record with random non overlapping SKILL/KNOWLEDGE spans of 1 to 4 tokens.
+    """
+    tokens = record['tokens']
+    spans = []
+    position = 0
+    while len(tokens) > 0 and rng.random() < 0.6:
+        token_start = position + rng.randrange(0, max(1, len(tokens) // 3))
+        token_end = token_start + rng.randrange(0, 4)
+        if token_end >= len(tokens):
+            break
+        spans.append({'start': tokens[token_start]['start'], 'end': tokens[token_end]['end'], 'label': rng.choice(LABELS),
+                      'token_start': token_start, 'token_end': token_end})
+        position = token_end + 2
+    return {'text': record['text'], 'tokens': tokens, 'spans': spans}
+
+
+def join_records(records):
+    """
+    Join records into one long sentence, with the token and span offsets shifted.
+    """
+    texts, tokens, spans = [], [], []
+    offset = 0
+    for record in records:
+        token_offset = len(tokens)
+        for token in record['tokens']:
+            tokens.append({**token, 'id': token['id'] + token_offset, 'start': token['start'] + offset,
+                           'end': token['end'] + offset, 'ws': True})
+        for span in record['spans']:
+            spans.append({**span, 'start': span['start'] + offset, 'end': span['end'] + offset,
+                          'token_start': span['token_start'] + token_offset,
+                          'token_end': span['token_end'] + token_offset})
+        texts.append(record['text'])
+        offset += len(record['text']) + 1
+    return {'text': ' '.join(texts), 'tokens': tokens, 'spans': spans}
+
+
+def corrupt_prediction(output, prompt_input, rng):
+    """
+    A prediction string for one prompt, mostly correct, sometimes malformed the ways the LLM gets it wrong.
+    """
+    prediction = json.loads(output)
+    draw = rng.random()
+    if draw < 0.03:
+        # cut by max_new_tokens
+        return output[:max(1, len(output) // 2)]
+    if draw < 0.04:
+        return "I'm sorry, I cannot extract skills from this sentence."
+    if draw < 0.05:
+        return repr(prediction)
+    if draw < 0.06:
+        return json.dumps({label: [skill['skill_span'] for skill in skills] for label, skills in prediction.items()})
+    if draw < 0.12:
+        for skills in prediction.values():
+            for skill in skills:
+                skill['skill_span'] = skill['skill_span'].upper()
+                skill['context'] = skill['context'][1:]
+    elif draw < 0.17:
+        words = prompt_input[3:-3].split(' ')
+        start = rng.randrange(len(words))
+        prediction.setdefault('SKILL', []).append({'skill_span': ' '.join(words[start:start + 2])})
+    return json.dumps(prediction, ensure_ascii=False)
+
+
+def perturb_spans(spans, tokens, rng):
+    """
+    Processed prediction spans: some missed, shifted, relabelled or spurious.
+    """
+    predicted = []
+    for span in spans:
+        draw = rng.random()
+        if draw < 0.1:
+            continue
+        span = dict(span)
+        if draw < 0.2:
+            span['end'] += 1
+        elif draw < 0.25:
+            span['label'] = 'KNOWLEDGE' if span['label'] == 'SKILL' else 'SKILL'
+        predicted.append(span)
+    if tokens and rng.random() < 0.05:
+        token = rng.choice(tokens)
+        predicted.append({'start': token['start'], 'end': token['end'], 'label': rng.choice(LABELS)})
+    return predicted
+
+
+def iob_tags(record, label):
+    tags = ['O'] * len(record['tokens'])
+    for span in record['spans']:
+        if span['label'] == label:
+            tags[span['token_start']] = 'B'
+            for i in range(span['token_start'] + 1, span['token_end'] + 1):
+                tags[i] = 'I'
+    return tags
+
+
+def write_jsonl(records, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def generate_corpus(directory, scale, seed=0):
+    """
+    Write the synthetic files of one scale into directory, once.
+    """
+    if os.path.exists(os.path.join(directory, 'done')):
+        return
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    with open(BASE_FILE, encoding='utf-8') as f:
+        base_records = [set_token_offsets(json.loads(line)) for line in f if line.strip()]
+
+    records = []
+    for _ in range(scale):
+        annotated = [add_spans(record, rng) for record in base_records]
+        records.extend(annotated)
+        # one long sentence of 10 to 40 sentences per 50 sentences
+        for _ in range(len(annotated) // 50):
+            start = rng.randrange(len(annotated))
+            records.append(join_records(annotated[start:start + rng.randrange(10, 41)]))
+    write_jsonl(records, os.path.join(directory, 'corpus.jsonl'))
+    write_jsonl([{'tokens': [token['text'] for token in record['tokens']], 'tags_skill': iob_tags(record, 'SKILL'),
+                  'tags_knowledge': iob_tags(record, 'KNOWLEDGE')} for record in records],
+                os.path.join(directory, 'iob.jsonl'))
+    write_jsonl([{'text': record['text'], 'spans': perturb_spans(record['spans'], record['tokens'], rng)}
+                 for record in records], os.path.join(directory, 'processed_predictions.jsonl'))
+
+    prepare_data = load_module(os.path.join(SRC_DIRECTORY, 'preprocessing', 'prepare_data.py'), 'prepare_data')
+    random.seed(seed)
+    with contextlib.redirect_stderr(io.StringIO()):
+        prepare_data.data_preparation(None, os.path.join(directory, 'corpus.jsonl'), os.path.join(directory, 'prompts.json'),
+                                      json.dumps(LABELS), streaming=True).label_and_context_list_data()
+    with open(os.path.join(directory, 'prompts.json'), encoding='utf-8') as f:
+        prompts = json.load(f)
+    write_jsonl([{'prompt': prompt['input'], 'label': prompt['output'],
+                  'predict': corrupt_prediction(prompt['output'], prompt['input'], rng)} for prompt in prompts],
+                os.path.join(directory, 'generated_predictions.jsonl'))
+
+    texts = [record['text'] for record in base_records]
+    with open(os.path.join(directory, 'jobs.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Title', 'Link', 'Description', 'Industry', 'Country', 'Budget', 'Currency', 'Bids', 'Posted',
+                         'Client', 'Rating', 'Reviews', 'Skills', 'Duration', 'Level', 'Rate Type', 'Rate'])
+        for i in range(len(base_records) * scale):
+            writer.writerow([f'Job {i}', f'https://example.com/{i}', rng.choice(texts),
+                             rng.choice(['IT', 'Design', 'Other', 'error', 'Writing', 'Marketing']), 'PH',
+                             rng.randrange(10, 5000), 'USD', rng.randrange(0, 80), '2024-01-01', f'client {i % 97}',
+                             round(rng.random() * 5, 1), rng.randrange(0, 300), 'python, sql', '1 month', 'Intermediate',
+                             rng.choice(['Hourly', 'Fixed', 'fixed']), rng.randrange(5, 100)])
+    with open(os.path.join(directory, 'done'), 'w') as f:
+        f.write(str(len(records)))
+
+
+def count_lines(path):
+    with open(path, encoding='utf-8') as f:
+        return sum(1 for _ in f)
+
+
+def run_stage(stage, directory):
+    """
+    Run one stage on the files of directory, returns the number of rows processed. Called in a fresh process.
+    """
+    path = lambda file: os.path.join(directory, file)
+    output_directory = path('output')
+    os.makedirs(output_directory, exist_ok=True)
+    if stage in ('convert', 'gliner_utils'):
+        with open(path('iob.jsonl'), encoding='utf-8') as f:
+            examples = [json.loads(line) for line in f]
+        batches = [{column: [example[column] for example in examples[start:start + 1000]] for column in examples[0]}
+                   for start in range(0, len(examples), 1000)]
+        if stage == 'convert':
+            convert = load_module(os.path.join(SRC_DIRECTORY, 'preprocessing', 'convert_iob_tags_to_offset_tags.py'),
+                                  'convert_iob_tags_to_offset_tags')
+            for batch in batches:
+                convert.convert_iob_batch(batch, LABELS)
+        else:
+            utils = load_module(os.path.join(SRC_DIRECTORY, 'gliner', 'utils.py'), 'gliner_utils')
+            for batch in batches:
+                columns = utils.formatting_prompts_batch(batch)
+                for _ in utils.convert_to_gliner_dataset(columns):
+                    pass
+        return len(examples)
+    if stage in ('prepare', 'prepare_streaming'):
+        prepare_data = load_module(os.path.join(SRC_DIRECTORY, 'preprocessing', 'prepare_data.py'), 'prepare_data')
+        prepare_data.data_preparation(None, path('corpus.jsonl'), os.path.join(output_directory, f'{stage}.json'),
+                                      json.dumps(LABELS), streaming=stage == 'prepare_streaming').label_and_context_list_data()
+        return count_lines(path('corpus.jsonl'))
+    if stage in ('combine', 'combine_streaming'):
+        combine = load_module(os.path.join(SRC_DIRECTORY, 'postprocessing', 'combine_prediction_results.py'),
+                              'combine_prediction_results')
+        streaming = stage == 'combine_streaming'
+        combine.Evaluation(None, path('corpus.jsonl'), path('prompts.json'), path('generated_predictions.jsonl'),
+                           os.path.join(output_directory, f'{stage}.jsonl'), 'white_space',
+                           batch_size=256 if streaming else None, streaming=streaming).parse_label_and_context_list()
+        return count_lines(path('generated_predictions.jsonl'))
+    if stage in ('evaluate_nervaluate', 'evaluate_native'):
+        evaluate = load_module(os.path.join(SRC_DIRECTORY, 'evaluation', 'evaluate_token_based_results.py'),
+                               'evaluate_token_based_results')
+        evaluate.build_eval_pipeline_nervaluate(path('processed_predictions.jsonl'), path('corpus.jsonl'), LABELS,
+                                                backend=stage.split('_')[1])
+        return count_lines(path('corpus.jsonl'))
+    if stage in ('clean', 'clean_chunked'):
+        cleaning = load_module(CLEANING_SCRIPT, 'cleaning')
+        if stage == 'clean':
+            cleaning.clean_job_data(path('jobs.csv'))
+        else:
+            cleaning.clean_job_data_chunked(path('jobs.csv'), parquet_file=os.path.join(output_directory, 'jobs.parquet'))
+        return count_lines(path('jobs.csv')) - 1
+    raise ValueError(f'Unknown stage {stage}')
+
+
+def measure_stage(stage, directory, verbose=False):
+    """
+    Run a stage in a child process and return its wall time, rows, rows/sec and peak RSS.
+    """
+    command = [sys.executable, os.path.abspath(__file__), '--run_stage', stage, '--work_directory', directory]
+    result = subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=None if verbose else subprocess.DEVNULL,
+                            text=True)
+    # the measurement is the last line, the stage itself may print
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure_cold_start(arguments):
+    """
+    Wall time and peak RSS of one skill_extraction.py run, from the start of the interpreter to its exit.
+    """
+    start_time = time.perf_counter()
+    process = subprocess.Popen([sys.executable, CLI_SCRIPT] + arguments, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    # the resource usage of this child only, getrusage(RUSAGE_CHILDREN) would mix all of them
+    _, status, rusage = os.wait4(process.pid, 0)
+    seconds = time.perf_counter() - start_time
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise subprocess.CalledProcessError(os.waitstatus_to_exitcode(status), arguments)
+    return {'seconds': seconds, 'rows': 0, 'rows_per_sec': 0, 'peak_rss_mb': rusage.ru_maxrss / 1024}
+
+
+def cold_start_runs(directory):
+    """
+    The --help of every subcommand, and an evaluation of 10 rows, the smallest useful shard.
+    """
+    runs = {f'cold_start_{command}': [command, '--help'] for command in CLI_COMMANDS}
+    small_directory = os.path.join(directory, 'small')
+    os.makedirs(small_directory, exist_ok=True)
+    for file in ('corpus.jsonl', 'processed_predictions.jsonl'):
+        with open(os.path.join(directory, file), encoding='utf-8') as f, \
+                open(os.path.join(small_directory, file), 'w', encoding='utf-8') as small:
+            small.writelines(itertools.islice(f, 10))
+    runs['cold_start_evaluate_10_rows'] = ['evaluate', '--evaluator', 'native',
+                                           '--prediction_file', os.path.join(small_directory, 'processed_predictions.jsonl'),
+                                           '--label_file', os.path.join(small_directory, 'corpus.jsonl')]
+    return runs
+
+
+def compare(results, baseline, tolerance, memory_tolerance):
+    """
+    Return the regressions of results against baseline, as printable lines.
+    """
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        reference = baseline[key]
+        if result['seconds'] > reference['seconds'] * (1 + tolerance):
+            regressions.append(f"{key}: {result['seconds']:.2f}s vs {reference['seconds']:.2f}s")
+        if result['peak_rss_mb'] > reference['peak_rss_mb'] * (1 + memory_tolerance):
+            regressions.append(f"{key}: {result['peak_rss_mb']:.0f} MB vs {reference['peak_rss_mb']:.0f} MB peak RSS")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--scales", required=False, default='1,10', type=str, help="comma separated, e.g. 1,10,100")
+    parser.add_argument("--stages", required=False, default=','.join(STAGES), type=str)
+    parser.add_argument("--work_directory", required=False, default='benchmark_data', type=str)
+    parser.add_argument("--baseline_file", required=False, default='benchmark_baseline.json', type=str)
+    parser.add_argument("--results_file", required=False, default=None, type=str)
+    parser.add_argument("--update_baseline", required=False, default=False, action='store_true')
+    parser.add_argument("--tolerance", required=False, default=0.2, type=float,
+                        help="allowed relative increase of the wall time")
+    parser.add_argument("--memory_tolerance", required=False, default=0.2, type=float,
+                        help="allowed relative increase of the peak RSS")
+    parser.add_argument("--repeat", required=False, default=1, type=int, help="runs per stage, the fastest is kept")
+    parser.add_argument("--verbose", required=False, default=False, action='store_true')
+    parser.add_argument("--skip_cold_start", required=False, default=False, action='store_true',
+                        help="do not time the startup of the skill_extraction.py subcommands")
+    parser.add_argument("--run_stage", required=False, default=None, type=str,
+                        help="internal, run one stage in this process and print its measurement")
+    args = parser.parse_args()
+
+    if args.run_stage is not None:
+        start_time = time.perf_counter()
+        with contextlib.redirect_stdout(sys.stderr):
+            rows = run_stage(args.run_stage, args.work_directory)
+        seconds = time.perf_counter() - start_time
+        # ru_maxrss is in kilobytes on Linux
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(json.dumps({'seconds': seconds, 'rows': rows, 'rows_per_sec': rows / seconds, 'peak_rss_mb': peak_rss_mb}))
+        sys.exit(0)
+
+    results = {}
+    for scale in [int(scale) for scale in args.scales.split(',')]:
+        directory = os.path.join(args.work_directory, f'{scale}x')
+        generate_corpus(directory, scale)
+        for stage in args.stages.split(','):
+            measurements = [measure_stage(stage, directory, args.verbose) for _ in range(args.repeat)]
+            result = min(measurements, key=lambda measurement: measurement['seconds'])
+            results[f'{stage}@{scale}x'] = result
+            print(f"{stage}@{scale}x: {result['seconds']:.2f}s, {result['rows']} rows, "
+                  f"{result['rows_per_sec']:.0f} rows/sec, {result['peak_rss_mb']:.0f} MB peak RSS")
+        if not args.skip_cold_start and scale == int(args.scales.split(',')[0]):
+            for name, arguments in cold_start_runs(directory).items():
+                result = min((measure_cold_start(arguments) for _ in range(args.repeat)),
+                             key=lambda measurement: measurement['seconds'])
+                results[name] = result
+                print(f"{name}: {result['seconds']:.2f}s, {result['peak_rss_mb']:.0f} MB peak RSS")
+
+    if args.results_file is not None:
+        with open(args.results_file, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.update_baseline or not os.path.exists(args.baseline_file):
+        baseline = {}
+        if os.path.exists(args.baseline_file):
+            with open(args.baseline_file) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline_file, 'w') as f:
+            json.dump(baseline, f, indent=2)
+        print(f'Baseline saved to {args.baseline_file}.')
+        sys.exit(0)
+
+    with open(args.baseline_file) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance, args.memory_tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    sys.exit(1 if regressions else 0)
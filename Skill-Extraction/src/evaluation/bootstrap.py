@@ -0,0 +1,134 @@
+"""
+Bootstrap confidence intervals of the span precision, recall and F1, and of their paired differences. \
+Date:
+    2026/10/18
+
+The outcomes of every document are counted once with SpanEvaluator.document_counts. A resample of the documents is
+a row of an index matrix, turned into the number of times every document is drawn, so the counts of all resamples
+are one matrix product of these weights with the per document counts. Two prediction files of the same documents
+share the resamples, which makes the differences of their scores paired.
+"""
+import numpy as np
+
+from span_evaluator import SCHEMAS, METRICS, SpanEvaluator
+
+# largest index matrix drawn at once, in elements
+MAX_CHUNK_ELEMENTS = 1 << 22
+
+
+def score_counts(document_counts, schema):
+    """
+    Reduce (n_documents, n_tags, len(SCHEMAS), len(METRICS)) counts to the (matched, actual, possible) counts of one
+    schema, as float64 of shape (n_documents, n_tags, 3). Partial matches count half, as in nervaluate.
+    """
+    counts = document_counts[:, :, SCHEMAS.index(schema), :].astype(np.float64)
+    correct, incorrect, partial, missed, spurious = (counts[:, :, METRICS.index(metric)] for metric in METRICS)
+    matched = correct + 0.5 * partial if schema in ('partial', 'ent_type') else correct
+    actual = correct + incorrect + partial + spurious
+    possible = correct + incorrect + partial + missed
+    return np.stack([matched, actual, possible], axis=-1)
+
+
+def precision_recall_f1(totals):
+    """
+    Scores of (..., 3) (matched, actual, possible) totals, 0 where nervaluate's would divide by 0.
+    """
+    matched, actual, possible = totals[..., 0], totals[..., 1], totals[..., 2]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(actual > 0, matched / actual, 0.0)
+        recall = np.where(possible > 0, matched / possible, 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    return {'precision': precision, 'recall': recall, 'f1': f1}
+
+
+def bootstrap_totals(counts, n_resamples, seed=0):
+    """
+    Totals of every resample of the documents, for every (n_documents, ...) counts array of the same documents.
+
+    Returns
+    -------
+    list of (n_resamples, ...) arrays, one per counts array
+    """
+    n_documents = counts[0].shape[0]
+    if n_documents == 0:
+        raise ValueError("Cannot resample 0 documents")
+    shapes = [count.shape[1:] for count in counts]
+    columns = np.concatenate([count.reshape(n_documents, -1) for count in counts], axis=1)
+    rng = np.random.default_rng(seed)
+    chunk_size = max(1, MAX_CHUNK_ELEMENTS // max(n_documents, 1))
+    totals = np.empty((n_resamples, columns.shape[1]))
+    for start in range(0, n_resamples, chunk_size):
+        n_rows = min(chunk_size, n_resamples - start)
+        indices = rng.integers(0, n_documents, size=(n_rows, n_documents), dtype=np.int32)
+        # times each document is drawn in each resample
+        cells = (indices + n_documents * np.arange(n_rows, dtype=np.int32)[:, np.newaxis]).ravel()
+        weights = np.bincount(cells, minlength=n_rows * n_documents).reshape(n_rows, n_documents)
+        totals[start:start + n_rows] = weights.astype(np.float64) @ columns
+    split = np.cumsum([int(np.prod(shape)) for shape in shapes])[:-1]
+    return [total.reshape((n_resamples,) + shape) for total, shape in zip(np.split(totals, split, axis=1), shapes)]
+
+
+class BootstrapEvaluator:
+    def __init__(self, tags=['SKILL', 'KNOWLEDGE'], schema='strict', n_resamples=10000, confidence=0.95,
+                 seed=0) -> None:
+        """
+        Percentile bootstrap of the document level resamples of a test set.
+
+        Parameters
+        ----------
+        tags: labels to evaluate
+        schema: nervaluate schema the scores are computed with
+        n_resamples: number of resamples of the documents
+        confidence: coverage of the intervals
+        seed: seed of the resamples, the same seed gives the same intervals
+        """
+        self.tags = tags
+        self.schema = schema
+        self.n_resamples = n_resamples
+        self.confidence = confidence
+        self.seed = seed
+
+    def interval(self, estimate, samples):
+        low, high = np.quantile(samples, [(1 - self.confidence) / 2, (1 + self.confidence) / 2])
+        return {'estimate': float(estimate), 'low': float(low), 'high': float(high), 'std': float(np.std(samples))}
+
+    def evaluate(self, true, preds):
+        """
+        Parameters
+        ----------
+        true: spans of every document
+        preds: list of the spans of every document of one or more systems, the differences are with preds[0]
+
+        Returns
+        -------
+        {'scores': [scores of every system], 'differences': [scores of system i minus system 0 for i >= 1]}, with
+        an interval of the precision, recall and F1 overall and per tag. Differences also have the share of
+        resamples where system i scores higher.
+        """
+        if len(true) == 0:
+            raise ValueError("No documents to evaluate")
+        if len(preds) == 0:
+            raise ValueError("No predictions to evaluate")
+        span_evaluator = SpanEvaluator(tags=self.tags)
+        counts = []
+        for pred in preds:
+            per_tag = score_counts(span_evaluator.document_counts(true, pred), self.schema)
+            # the overall counts are the sums over the tags
+            counts.append(np.concatenate([per_tag.sum(axis=1, keepdims=True), per_tag], axis=1))
+        names = ['overall'] + list(self.tags)
+        estimates = [precision_recall_f1(count.sum(axis=0)) for count in counts]
+        samples = [precision_recall_f1(total) for total in bootstrap_totals(counts, self.n_resamples, self.seed)]
+
+        scores = [{name: {metric: self.interval(estimate[metric][i], sample[metric][:, i]) for metric in estimate}
+                   for i, name in enumerate(names)} for estimate, sample in zip(estimates, samples)]
+        differences = []
+        for estimate, sample in zip(estimates[1:], samples[1:]):
+            difference = {}
+            for i, name in enumerate(names):
+                difference[name] = {}
+                for metric in estimate:
+                    delta = sample[metric][:, i] - samples[0][metric][:, i]
+                    difference[name][metric] = self.interval(estimate[metric][i] - estimates[0][metric][i], delta)
+                    difference[name][metric]['share_higher'] = float(np.mean(delta > 0))
+            differences.append(difference)
+        return {'scores': scores, 'differences': differences}
@@ -7,53 +7,123 @@ Date:
 """
 
 import json
-import pandas as pd
+import os
+import sys
 
 from argparse import ArgumentParser
 
-from nervaluate import Evaluator
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import add_arguments, count, instrument, timer
+from span_table import is_columnar, read_spans
 
 
 class evaluator:
-    def __init__(self, tags=['SKILL', 'KNOWLEDGE'], loader='default') -> None:
+    def __init__(self, tags=['SKILL', 'KNOWLEDGE'], loader='default', backend='nervaluate') -> None:
         self.tags = tags
         self.loader = loader
+        self.backend = backend
 
     def _metric(self, token_label_list, predicted_token_label_list):
+        if self.backend == 'native':
+            from span_evaluator import SpanEvaluator
+            # the native evaluator only computes the metrics, not the per entity indices
+            self.pred = predicted_token_label_list
+            results, evaluation_agg_entities_type = SpanEvaluator(tags=self.tags).evaluate(
+                token_label_list, predicted_token_label_list)
+            return results, evaluation_agg_entities_type, None, None
+        from nervaluate import Evaluator
         evaluator = Evaluator(token_label_list, predicted_token_label_list, tags=self.tags, loader=self.loader)
         self.pred = evaluator.pred
         results, evaluation_agg_entities_type, evaluation_indices, evaluation_agg_indices = evaluator.evaluate()
         return results, evaluation_agg_entities_type, evaluation_indices, evaluation_agg_indices
 
 
-def build_eval_pipeline_nervaluate(prediction_file, label_file, tags=['SKILL', 'KNOWLEDGE']):
-    evaluator_ = evaluator(tags=tags)
-    results_df = pd.read_json(prediction_file, lines=True)
-    results_df['spans'] = results_df['spans'].apply(lambda x: x if not x is None else [])
+def load_spans(file):
+    """
+    Load the span list of every record of a JSONL file, or of a .parquet/.arrow file where only the spans are read.
+    """
+    if is_columnar(file):
+        return read_spans(file)
+    import pandas as pd
+    data_df = pd.read_json(file, lines=True)
+    return data_df['spans'].apply(lambda x: x if not x is None else []).reset_index(drop=True).values
 
-    label_df = pd.read_json(label_file, lines=True)
-    label_df['spans'] = label_df['spans'].apply(lambda x: x if not x is None else [])
-    label_df = label_df.reset_index(drop=True)
-    token_label_list = label_df['spans'].values
 
-    predicted_token_label_list = results_df['spans'].values
+def build_eval_pipeline_nervaluate(prediction_file, label_file, tags=['SKILL', 'KNOWLEDGE'], backend='nervaluate'):
+    evaluator_ = evaluator(tags=tags, backend=backend)
+    with timer('evaluate.load_labels'):
+        token_label_list = load_spans(label_file)
+
+    with timer('evaluate.load_predictions'):
+        predicted_token_label_list = load_spans(prediction_file)
+    count('evaluate.rows', len(predicted_token_label_list))
+    count('evaluate.label_spans', sum(len(spans) for spans in token_label_list))
+    count('evaluate.predicted_spans', sum(len(spans) for spans in predicted_token_label_list))
 
     print(f'Total data: {len(predicted_token_label_list)}')
 
     print(f'Total label data: {len(token_label_list)}')
 
-    results, evaluation_agg_entities_type, evaluation_indices, evaluation_agg_indices = evaluator_._metric(
-        token_label_list, predicted_token_label_list)
+    with timer(f'evaluate.{backend}'):
+        results, evaluation_agg_entities_type, evaluation_indices, evaluation_agg_indices = evaluator_._metric(
+            token_label_list, predicted_token_label_list)
 
     return results['strict'], {entity: entity_metric['strict'] for entity, entity_metric in evaluation_agg_entities_type.items()}
 
 
-if __name__ == "__main__":
-    parser = ArgumentParser()
+def build_bootstrap(prediction_file, label_file, compare_file=None, tags=['SKILL', 'KNOWLEDGE'], n_resamples=10000,
+                    confidence=0.95, seed=0):
+    """
+    Bootstrap intervals of the strict scores of prediction_file, and of compare_file minus prediction_file on the
+    same resamples when compare_file is given.
+    """
+    from bootstrap import BootstrapEvaluator
+    with timer('evaluate.load_labels'):
+        token_label_list = load_spans(label_file)
+    prediction_files = [prediction_file] + ([compare_file] if compare_file is not None else [])
+    with timer('evaluate.load_predictions'):
+        predicted_token_label_lists = [load_spans(file) for file in prediction_files]
+    with timer('evaluate.bootstrap'):
+        bootstrap = BootstrapEvaluator(tags=tags, n_resamples=n_resamples, confidence=confidence, seed=seed).evaluate(
+            token_label_list, predicted_token_label_lists)
+    output = {'n_resamples': n_resamples, 'confidence': confidence,
+              'scores': dict(zip(prediction_files, bootstrap['scores']))}
+    if compare_file is not None:
+        output['difference'] = bootstrap['differences'][0]
+    return output
+
+
+def build_parser(parser=None):
+    if parser is None:
+        parser = ArgumentParser()
     parser.add_argument("--prediction_file", required=True, type=str)
     parser.add_argument("--label_file", required=True, type=str)
-    args = parser.parse_args()
-    results, evaluation_agg_entities_type = build_eval_pipeline_nervaluate(
-        args.prediction_file, args.label_file, tags=['SKILL', 'KNOWLEDGE'])
+    parser.add_argument("--evaluator", required=False, default='nervaluate', choices=['nervaluate', 'native'], type=str)
+    parser.add_argument("--bootstrap", required=False, default=0, type=int,
+                        help="number of resamples of the confidence intervals, 0 to skip them")
+    parser.add_argument("--compare_file", required=False, default=None, type=str,
+                        help="second prediction file, the intervals of its score differences are computed too")
+    parser.add_argument("--confidence", required=False, default=0.95, type=float)
+    parser.add_argument("--seed", required=False, default=0, type=int)
+    add_arguments(parser)
+    return parser
+
+
+def main(args):
+    with instrument('evaluate', args.metrics_file, args.profile, args.profile_file):
+        results, evaluation_agg_entities_type = build_eval_pipeline_nervaluate(
+            args.prediction_file, args.label_file, tags=['SKILL', 'KNOWLEDGE'], backend=args.evaluator)
+        if args.bootstrap > 0:
+            bootstrap = build_bootstrap(args.prediction_file, args.label_file, args.compare_file,
+                                        tags=['SKILL', 'KNOWLEDGE'], n_resamples=args.bootstrap,
+                                        confidence=args.confidence, seed=args.seed)
+        elif args.compare_file is not None:
+            raise ValueError('--compare_file needs --bootstrap')
     print(f'results score:\n{json.dumps(results, indent=2)}')
     print(f'results_per_tag score:\n{json.dumps(evaluation_agg_entities_type, indent=2)}')
+    if args.bootstrap > 0:
+        print(f'bootstrap score:\n{json.dumps(bootstrap, indent=2)}')
+
+
+if __name__ == "__main__":
+    main(build_parser().parse_args())
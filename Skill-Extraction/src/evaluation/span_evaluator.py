@@ -0,0 +1,244 @@
+"""
+NumPy implementation of the nervaluate strict, exact, partial and type evaluation schemas. \
+Date:
+    2026/10/18
+"""
+import collections
+
+import numpy as np
+
+SCHEMAS = ['strict', 'ent_type', 'partial', 'exact']
+METRICS = ['correct', 'incorrect', 'partial', 'missed', 'spurious']
+
+# outcome of one entity under every schema, as an index into METRICS per schema
+CORRECT = (0, 0, 0, 0)
+SAME_OFFSETS_WRONG_TYPE = (1, 1, 0, 0)
+OVERLAP_SAME_TYPE = (1, 0, 2, 1)
+OVERLAP_WRONG_TYPE = (1, 1, 2, 1)
+MISSED = (3, 3, 3, 3)
+SPURIOUS = (4, 4, 4, 4)
+
+
+def pack_spans(documents, tags):
+    """
+    Pack the spans of every document into (doc_id, start, end, label) arrays, keeping only the spans of the tags.
+
+    Returns
+    -------
+    int64 array of shape (n_spans, 4), spans of a document stay in their original order
+    """
+    label_ids = {tag: i for i, tag in enumerate(tags)}
+    rows = [(doc_id, span['start'], span['end'], label_ids[span['label']])
+            for doc_id, spans in enumerate(documents) for span in spans if span['label'] in label_ids]
+    return np.array(rows, dtype=np.int64).reshape(-1, 4)
+
+
+def count_document(true_spans, pred_spans, outcome_counts):
+    """
+    Count the outcomes of one document exactly the way nervaluate's compute_metrics does.
+
+    Spans are (start, end, label_id) tuples, outcome_counts maps (label_id, outcome) to a count.
+    """
+    true_spans = sorted(true_spans, key=lambda span: span[0])
+    pred_spans = sorted(pred_spans, key=lambda span: span[1])
+    true_set = set(true_spans)
+    overlapped = set()
+    for pred in pred_spans:
+        # Scenario I: exact match
+        if pred in true_set:
+            overlapped.add(pred)
+            outcome_counts[pred[2], CORRECT] += 1
+            continue
+        found_overlap = False
+        for true in true_spans:
+            if pred[1] < true[0]:
+                break
+            # Scenario IV: offsets match, but the entity type is wrong
+            if true[0] == pred[0] and true[1] == pred[1] and true[2] != pred[2]:
+                outcome_counts[true[2], SAME_OFFSETS_WRONG_TYPE] += 1
+                overlapped.add(true)
+                found_overlap = True
+                break
+            # Scenario V and VI: an overlap counts once per true entity
+            if max(true[0], pred[0]) <= min(true[1], pred[1]) and true not in overlapped:
+                overlapped.add(true)
+                outcome_counts[true[2], OVERLAP_SAME_TYPE if true[2] == pred[2] else OVERLAP_WRONG_TYPE] += 1
+                found_overlap = True
+        # Scenario II: spurious
+        if not found_overlap:
+            outcome_counts[pred[2], SPURIOUS] += 1
+    # Scenario III: missed
+    for true in true_spans:
+        if true not in overlapped:
+            outcome_counts[true[2], MISSED] += 1
+
+
+def match_overlaps(true_spans, pred_spans):
+    """
+    Count the gold spans of the same document overlapping every prediction, with sorted keys and binary search.
+
+    Spans must have 0 <= start <= end. Returns the number of overlapping gold spans per prediction and, where that
+    number is 1, the row of the overlapping gold span in true_spans (-1 elsewhere).
+    """
+    if len(true_spans) == 0:
+        return np.zeros(len(pred_spans), dtype=np.int64), np.full(len(pred_spans), -1, dtype=np.int64)
+    # (doc_id, offset) keys order spans by document first
+    offset = max(true_spans[:, 1:3].max(), pred_spans[:, 1:3].max(initial=0)) + 1
+    order = np.lexsort((true_spans[:, 1], true_spans[:, 0]))
+    start_keys = true_spans[order, 0] * offset + true_spans[order, 1]
+    end_keys = true_spans[order, 0] * offset + true_spans[order, 2]
+    pred_start_keys = pred_spans[:, 0] * offset + pred_spans[:, 1]
+    pred_end_keys = pred_spans[:, 0] * offset + pred_spans[:, 2]
+
+    # gold spans starting at or before the prediction end, minus those already ended before the prediction start
+    started = np.searchsorted(start_keys, pred_end_keys, side='right')
+    ended = np.searchsorted(np.sort(end_keys), pred_start_keys, side='left')
+    overlap_counts = started - ended
+
+    # with a single overlap it is the span with the largest end among the started ones
+    running_max = np.maximum.accumulate(end_keys)
+    argmax = np.maximum.accumulate(np.where(end_keys == running_max, np.arange(len(end_keys)), 0))
+    overlapped = np.where(overlap_counts == 1, order[argmax[np.maximum(started - 1, 0)]], -1)
+    return overlap_counts, overlapped
+
+
+def compute_scores(counts, partial_or_type):
+    correct, incorrect, partial, missed, spurious = (int(count) for count in counts)
+    results = {'correct': correct, 'incorrect': incorrect, 'partial': partial, 'missed': missed,
+               'spurious': spurious}
+    results['possible'] = possible = correct + incorrect + partial + missed
+    results['actual'] = actual = correct + incorrect + partial + spurious
+    if partial_or_type:
+        precision = (correct + 0.5 * partial) / actual if actual > 0 else 0
+        recall = (correct + 0.5 * partial) / possible if possible > 0 else 0
+    else:
+        precision = correct / actual if actual > 0 else 0
+        recall = correct / possible if possible > 0 else 0
+    results['precision'] = precision
+    results['recall'] = recall
+    results['f1'] = 2 * (precision * recall) / (precision + recall) if (precision + recall) > 0 else 0
+    return results
+
+
+def format_results(counts, n_documents):
+    """
+    Turn (len(SCHEMAS), len(METRICS)) counts into nervaluate's nested result dict, in nervaluate's key order.
+    """
+    if n_documents == 0:
+        return {schema: compute_scores(counts[i], False) for i, schema in enumerate(SCHEMAS)}
+    schema_order = ['ent_type', 'partial', 'strict', 'exact']
+    return {schema: compute_scores(counts[SCHEMAS.index(schema)], schema in ('partial', 'ent_type'))
+            for schema in schema_order}
+
+
+class SpanEvaluator:
+    def __init__(self, tags=['SKILL', 'KNOWLEDGE']) -> None:
+        """
+        Drop-in replacement for nervaluate.Evaluator(...).evaluate() on span dicts, with numerically identical results.
+
+        Exact matches and one to one overlaps are counted with sort, search and set operations over all documents at
+        once. Only documents where spans overlap many to many, which nervaluate resolves in processing order, are
+        counted one by one.
+
+        Parameters
+        ----------
+        tags: labels to evaluate
+        """
+        self.tags = tags
+
+    def evaluate(self, true, pred):
+        """
+        Returns
+        -------
+        (results, results_per_tag) shaped like the first two values of nervaluate's Evaluator.evaluate()
+        """
+        counts = self.count_outcomes(true, pred, by_document=False)[0]
+        results = format_results(counts.sum(axis=0), len(true))
+        results_per_tag = {tag: format_results(counts[i], len(true)) for i, tag in enumerate(self.tags)}
+        return results, results_per_tag
+
+    def document_counts(self, true, pred):
+        """
+        Outcome counts of every document, their sum over the documents is what evaluate() scores.
+
+        Returns
+        -------
+        int64 array of shape (n_documents, len(tags), len(SCHEMAS), len(METRICS))
+        """
+        return self.count_outcomes(true, pred, by_document=True)
+
+    def count_outcomes(self, true, pred, by_document):
+        """
+        Count the outcomes of every span per tag, schema and metric, per document or of all documents in one row.
+        """
+        if len(true) != len(pred):
+            raise ValueError("Number of predicted documents does not equal true")
+        true_spans = pack_spans(true, self.tags)
+        pred_spans = pack_spans(pred, self.tags)
+        n_rows = len(true) if by_document else 1
+        counts = np.zeros((n_rows, len(self.tags), len(SCHEMAS), len(METRICS)), dtype=np.int64)
+
+        # documents with negative or reversed spans are left to the reference counting
+        degenerate = np.unique(np.concatenate([spans[(spans[:, 2] < spans[:, 1]) | (spans[:, 1] < 0), 0]
+                                               for spans in (true_spans, pred_spans)]))
+        complex_true = true_spans[np.isin(true_spans[:, 0], degenerate)]
+        complex_pred = pred_spans[np.isin(pred_spans[:, 0], degenerate)]
+        true_spans = true_spans[~np.isin(true_spans[:, 0], degenerate)]
+        pred_spans = pred_spans[~np.isin(pred_spans[:, 0], degenerate)]
+
+        # exact matches, by id of the unique (doc_id, start, end, label) rows
+        _, span_ids = np.unique(np.concatenate([true_spans, pred_spans]), axis=0, return_inverse=True)
+        span_ids = span_ids.reshape(-1)
+        true_ids, pred_ids = span_ids[:len(true_spans)], span_ids[len(true_spans):]
+        pred_exact = np.isin(pred_ids, true_ids)
+        true_exact = np.isin(true_ids, pred_ids)
+
+        overlap_counts, overlapped = match_overlaps(true_spans, pred_spans)
+        overlap_counts[pred_exact] = 0
+        overlapped[pred_exact] = -1
+        times_overlapped = np.bincount(overlapped[overlapped >= 0], minlength=len(true_spans))
+
+        # nervaluate's outcome depends on the processing order as soon as spans overlap more than one to one
+        duplicated_true = np.bincount(true_ids)[true_ids] > 1 if len(true_ids) else np.zeros(0, dtype=bool)
+        complex_documents = np.unique(np.concatenate([
+            pred_spans[overlap_counts > 1, 0],
+            true_spans[(times_overlapped > 1) | ((times_overlapped > 0) & true_exact) | duplicated_true, 0],
+        ]))
+        true_simple = ~np.isin(true_spans[:, 0], complex_documents)
+        pred_simple = ~np.isin(pred_spans[:, 0], complex_documents)
+
+        # every remaining prediction is correct, spurious or overlaps exactly one gold span
+        single = pred_simple & (overlap_counts == 1)
+        matched = true_spans[overlapped[single]]
+        same_offsets = (matched[:, 1] == pred_spans[single, 1]) & (matched[:, 2] == pred_spans[single, 2])
+        same_type = matched[:, 3] == pred_spans[single, 3]
+        spurious = pred_simple & ~pred_exact & (overlap_counts == 0)
+        missed = true_simple & ~true_exact & (times_overlapped == 0)
+        for spans, outcome in [(pred_spans[pred_simple & pred_exact], CORRECT),
+                               (pred_spans[spurious], SPURIOUS),
+                               (true_spans[missed], MISSED),
+                               (matched[same_offsets], SAME_OFFSETS_WRONG_TYPE),
+                               (matched[~same_offsets & same_type], OVERLAP_SAME_TYPE),
+                               (matched[~same_offsets & ~same_type], OVERLAP_WRONG_TYPE)]:
+            # one (document, tag) cell per span, all documents in row 0 unless counted by document
+            cells = (spans[:, 0] if by_document else 0) * len(self.tags) + spans[:, 3]
+            label_counts = np.bincount(cells, minlength=n_rows * len(self.tags)).reshape(n_rows, len(self.tags))
+            for schema, metric in enumerate(outcome):
+                counts[:, :, schema, metric] += label_counts
+
+        true_by_document = self.group_by_document(np.concatenate([complex_true, true_spans[~true_simple]]))
+        pred_by_document = self.group_by_document(np.concatenate([complex_pred, pred_spans[~pred_simple]]))
+        for doc_id in np.union1d(degenerate, complex_documents).tolist():
+            outcome_counts = collections.Counter()
+            count_document(true_by_document.get(doc_id, []), pred_by_document.get(doc_id, []), outcome_counts)
+            for (label_id, outcome), count in outcome_counts.items():
+                for schema, metric in enumerate(outcome):
+                    counts[doc_id if by_document else 0, label_id, schema, metric] += count
+        return counts
+
+    @staticmethod
+    def group_by_document(spans):
+        documents = {}
+        for doc_id, start, end, label_id in spans.tolist():
+            documents.setdefault(doc_id, []).append((start, end, label_id))
+        return documents
@@ -0,0 +1,366 @@
+"""
+HTTP skill extraction service batching concurrent requests for a GLiNER model or an LLM completion endpoint. \
+Date:
+    2026/10/18
+
+Requests wait in a bounded queue. A batch worker takes the first one, then collects more until max_batch_size
+requests are in the batch or max_wait_ms have passed, and sends the whole batch to the backend. When the queue is
+full new requests get a 503 with Retry-After, instead of waiting in an unbounded backlog. A request with more texts
+than the queue holds gets a 413, it could never be accepted.
+
+Both backends return the records of combine_prediction_results.py: the white space tokens of the text and the
+spans with their token offsets. The LLM generations are parsed with parse_prediction and located in the text by
+the same span locator as find_best_match. GLiNER already predicts character offsets. With --api completions a batch
+is one request, with the prompts in the llama3 template the adapter was trained with (see prediction_client.py),
+with --api chat, e.g. for llamafactory-cli api, it is one request per text.
+
+Endpoints:
+    POST /extract   {"text": "..."} or {"texts": ["...", ...]}
+    GET  /metrics   queue depth, batch sizes and p50/p99 latencies in the Prometheus text format
+    GET  /stats     the same as JSON
+    GET  /health
+
+Usage:
+    python extraction_service.py --backend gliner --model_path gliner_onnx --gliner_backend onnx
+    python extraction_service.py --backend llm --base_url http://localhost:8000/v1 --api completions
+"""
+import asyncio
+import collections
+import concurrent.futures
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+from aiohttp import web
+
+SRC_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(SRC_DIRECTORY, 'postprocessing'))
+sys.path.append(os.path.join(SRC_DIRECTORY, 'preprocessing'))
+from combine_prediction_results import Evaluation, load_nlp
+from instrumentation import METRICS, add_arguments, count, instrument, timer
+from prediction_client import PredictionClient, build_content
+from prediction_parser import parse_prediction
+from prepare_data import INSTRUCTION_PROMPT
+
+BACKENDS = ['gliner', 'llm']
+PREFIX = 'skill_extraction_service'
+
+
+class GLiNERBackend:
+    def __init__(self, model_path, gliner_backend='torch', device=None, labels=None, threshold=None,
+                 onnx_model_file=None, intra_op_threads=None, inter_op_threads=None) -> None:
+        """
+        GLiNER model run in a worker thread, one batch at a time, so the event loop keeps accepting requests.
+
+        Parameters
+        ----------
+        model_path: checkpoint directory, or output directory of onnx_export.py for the onnx backend
+        gliner_backend: torch or onnx, see batch_inference.load_model
+        labels, threshold: the ones saved with an ONNX export by default, LABELS and 0.5 otherwise
+        """
+        sys.path.append(os.path.join(SRC_DIRECTORY, 'gliner'))
+        from batch_inference import LABELS, load_model, read_inference_config
+
+        inference_config = read_inference_config(model_path)
+        self.labels = labels if labels is not None else inference_config.get('labels', LABELS)
+        self.threshold = threshold if threshold is not None else inference_config.get('threshold', 0.5)
+        self.model, _ = load_model(model_path, gliner_backend, device, onnx_model_file, intra_op_threads,
+                                   inter_op_threads)
+        self.nlp = load_nlp('white_space', tokenizer_only=True)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def extract_batch(self, texts):
+        entities = self.model.batch_predict_entities(texts, self.labels, threshold=self.threshold,
+                                                     batch_size=len(texts))
+        records = []
+        for text, doc, text_entities in zip(texts, self.nlp.pipe(texts), entities):
+            record = Evaluation.build_json_doc(text, doc, {})
+            for entity in text_entities:
+                span = {'start': entity['start'], 'end': entity['end'] - 1, 'label': entity['label'].upper(),
+                        'score': entity['score']}
+                # GLiNER splits punctuation off words, e.g. <ORGANIZATION>, its spans can end inside a white space
+                # token, the token offsets are those of the tokens the span touches
+                tokens = doc.char_span(entity['start'], entity['end'], alignment_mode='expand')
+                if tokens is not None and len(tokens) > 0:
+                    span.update({'token_start': tokens[0].i, 'token_end': tokens[-1].i})
+                else:
+                    count('service.char_span_misses')
+                record['spans'].append(span)
+            records.append(record)
+        return records
+
+    async def extract(self, texts):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.extract_batch, texts)
+
+    async def close(self):
+        self.executor.shutdown()
+
+
+class LLMBackend:
+    def __init__(self, client) -> None:
+        """
+        Prompts built like prepare_data.py, sent to an OpenAI compatible endpoint with the retries of
+        PredictionClient, one request per batch with the completions api.
+
+        Parameters
+        ----------
+        client: PredictionClient of the endpoint
+        """
+        self.client = client
+        self.session = None
+        self.nlp = load_nlp('white_space', tokenizer_only=True)
+
+    async def extract(self, texts):
+        import aiohttp
+        if self.session is None:
+            self.session = aiohttp.ClientSession(headers={'Authorization': f'Bearer {self.client.api_key}'},
+                                                 timeout=aiohttp.ClientTimeout(total=self.client.timeout))
+        # the instruction the model was tuned with, without the random choice of prepare_data.py
+        contents = [build_content({'instruction': INSTRUCTION_PROMPT[0], 'input': f'** {text} **'}) for text in texts]
+        generations = await self.client.predict_many(self.session, contents)
+        records = []
+        for text, doc, generation in zip(texts, self.nlp.pipe(texts), generations):
+            prediction, category = parse_prediction(generation)
+            count(f'parse_prediction.{category}')
+            records.append(Evaluation.build_json_doc(text, doc, prediction))
+        return records
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+
+def percentiles(values, quantiles=(50, 99)):
+    if not values:
+        return {quantile: 0.0 for quantile in quantiles}
+    return dict(zip(quantiles, (float(value) for value in np.percentile(values, quantiles))))
+
+
+class MicroBatcher:
+    def __init__(self, backend, max_batch_size=32, max_wait_ms=10, max_queue_size=256, workers=1,
+                 window=10000) -> None:
+        """
+        Bounded request queue drained in micro batches.
+
+        Parameters
+        ----------
+        backend: GLiNERBackend or LLMBackend
+        max_batch_size: largest number of texts sent to the backend at once
+        max_wait_ms: longest time the first request of a batch waits for more
+        max_queue_size: number of requests waiting above which new ones are rejected
+        workers: number of batches in flight, 1 for a local model, more for a remote endpoint
+        window: number of latest requests and batches the percentiles are computed on
+        """
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue(maxsize=max_queue_size)
+        self.item_added = asyncio.Event()
+        self.workers = workers
+        self.tasks = []
+        self.batches_in_flight = 0
+        self.latencies = collections.deque(maxlen=window)
+        self.backend_latencies = collections.deque(maxlen=window)
+        self.batch_sizes = collections.deque(maxlen=window)
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self.work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.backend.close()
+
+    async def submit(self, text):
+        """
+        Queue one text and wait for its record, raises asyncio.QueueFull when the queue is full.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((text, future, time.perf_counter()))
+        self.item_added.set()
+        count('service.requests')
+        return await future
+
+    async def next_batch(self):
+        batch = [await self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            # waiting on an event never loses a queued item, unlike a cancelled queue.get
+            self.item_added.clear()
+            try:
+                await asyncio.wait_for(self.item_added.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def work(self):
+        while True:
+            batch = await self.next_batch()
+            # requests whose client went away are not predicted
+            batch = [item for item in batch if not item[1].done()]
+            if not batch:
+                continue
+            self.batches_in_flight += 1
+            start_time = time.perf_counter()
+            try:
+                with timer('service.backend'):
+                    records = await self.backend.extract([text for text, _, _ in batch])
+            except Exception as error:
+                count('service.backend_errors')
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            finally:
+                self.batches_in_flight -= 1
+            end_time = time.perf_counter()
+            self.backend_latencies.append(end_time - start_time)
+            self.batch_sizes.append(len(batch))
+            count('service.batches')
+            for (_, future, enqueued_at), record in zip(batch, records):
+                self.latencies.append(end_time - enqueued_at)
+                if not future.done():
+                    future.set_result(record)
+
+    def stats(self):
+        latency = percentiles(self.latencies)
+        backend_latency = percentiles(self.backend_latencies)
+        return {
+            'queue_depth': self.queue.qsize(),
+            'queue_capacity': self.queue.maxsize,
+            'batches_in_flight': self.batches_in_flight,
+            'requests_total': METRICS.counters['service.requests'],
+            'rejected_total': METRICS.counters['service.rejected'],
+            'batches_total': METRICS.counters['service.batches'],
+            'backend_errors_total': METRICS.counters['service.backend_errors'],
+            'batch_size_mean': float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0,
+            'latency_p50_seconds': latency[50],
+            'latency_p99_seconds': latency[99],
+            'backend_latency_p50_seconds': backend_latency[50],
+            'backend_latency_p99_seconds': backend_latency[99],
+        }
+
+
+def to_prometheus(stats):
+    """
+    Render stats in the Prometheus text exposition format, the percentiles as summaries over the latest requests.
+    """
+    lines = []
+    for name in ('queue_depth', 'queue_capacity', 'batches_in_flight', 'batch_size_mean'):
+        lines += [f'# TYPE {PREFIX}_{name} gauge', f'{PREFIX}_{name} {stats[name]}']
+    for name in ('requests_total', 'rejected_total', 'batches_total', 'backend_errors_total'):
+        lines += [f'# TYPE {PREFIX}_{name} counter', f'{PREFIX}_{name} {stats[name]}']
+    for name in ('latency', 'backend_latency'):
+        lines.append(f'# TYPE {PREFIX}_{name}_seconds summary')
+        for quantile in (50, 99):
+            lines.append(f'{PREFIX}_{name}_seconds{{quantile="{quantile / 100}"}} {stats[f"{name}_p{quantile}_seconds"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def build_app(batcher):
+    async def extract(request):
+        try:
+            body = await request.json()
+        except ValueError:
+            raise web.HTTPBadRequest(text='the body is not JSON')
+        texts = body.get('texts', [body.get('text')]) if isinstance(body, dict) else None
+        if not texts or not all(isinstance(text, str) for text in texts):
+            raise web.HTTPBadRequest(text='expected {"text": str} or {"texts": [str, ...]}')
+        if len(texts) > batcher.queue.maxsize:
+            count('service.rejected', len(texts))
+            raise web.HTTPRequestEntityTooLarge(batcher.queue.maxsize, len(texts),
+                                                text=f'at most {batcher.queue.maxsize} texts per request')
+        if len(texts) > batcher.queue.maxsize - batcher.queue.qsize():
+            count('service.rejected', len(texts))
+            raise web.HTTPServiceUnavailable(text='queue full', headers={'Retry-After': '1'})
+        try:
+            records = await asyncio.gather(*(batcher.submit(text) for text in texts))
+        except asyncio.QueueFull:
+            count('service.rejected', len(texts))
+            raise web.HTTPServiceUnavailable(text='queue full', headers={'Retry-After': '1'})
+        return web.json_response({'records': records} if 'texts' in body else records[0])
+
+    async def metrics(request):
+        return web.Response(text=to_prometheus(batcher.stats()), content_type='text/plain')
+
+    async def stats(request):
+        return web.json_response(batcher.stats())
+
+    async def health(request):
+        return web.json_response({'status': 'ok'})
+
+    async def on_startup(app):
+        batcher.start()
+
+    async def on_cleanup(app):
+        await batcher.stop()
+
+    app = web.Application()
+    app.add_routes([web.post('/extract', extract), web.get('/metrics', metrics), web.get('/stats', stats),
+                    web.get('/health', health)])
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+def build_parser(parser=None):
+    if parser is None:
+        parser = ArgumentParser()
+    parser.add_argument("--backend", required=False, default='gliner', choices=BACKENDS, type=str)
+    parser.add_argument("--host", required=False, default='127.0.0.1', type=str)
+    parser.add_argument("--port", required=False, default=8080, type=int)
+    parser.add_argument("--max_batch_size", required=False, default=32, type=int)
+    parser.add_argument("--max_wait_ms", required=False, default=10, type=float)
+    parser.add_argument("--max_queue_size", required=False, default=256, type=int)
+    parser.add_argument("--workers", required=False, default=None, type=int,
+                        help="batches in flight, 1 for gliner and 4 for llm by default")
+    # gliner backend
+    parser.add_argument("--model_path", required=False, default=None, type=str)
+    parser.add_argument("--gliner_backend", required=False, default='torch', choices=['torch', 'onnx'], type=str)
+    parser.add_argument("--device", required=False, default=None, type=str)
+    parser.add_argument("--threshold", required=False, default=None, type=float)
+    parser.add_argument("--onnx_model_file", required=False, default=None, type=str)
+    parser.add_argument("--intra_op_threads", required=False, default=None, type=int)
+    parser.add_argument("--inter_op_threads", required=False, default=None, type=int)
+    # llm backend
+    parser.add_argument("--base_url", required=False, default='http://localhost:8000/v1', type=str)
+    parser.add_argument("--model", required=False, default='skill-extraction', type=str)
+    parser.add_argument("--api", required=False, default='chat', choices=['chat', 'completions'], type=str)
+    parser.add_argument("--api_key", required=False, default=None, type=str)
+    parser.add_argument("--max_retries", required=False, default=2, type=int)
+    parser.add_argument("--timeout", required=False, default=120, type=float)
+    parser.add_argument("--max_tokens", required=False, default=1000, type=int)
+    parser.add_argument("--temperature", required=False, default=0.01, type=float)
+    parser.add_argument("--top_p", required=False, default=0.95, type=float)
+    add_arguments(parser)
+    return parser
+
+
+def main(args):
+    with instrument('service', args.metrics_file, args.profile, args.profile_file):
+        if args.backend == 'gliner':
+            if args.model_path is None:
+                raise ValueError('the gliner backend needs --model_path')
+            backend = GLiNERBackend(args.model_path, args.gliner_backend, args.device, None, args.threshold,
+                                    args.onnx_model_file, args.intra_op_threads, args.inter_op_threads)
+        else:
+            client = PredictionClient(args.base_url, args.model, args.api, args.api_key, max_retries=args.max_retries,
+                                      timeout=args.timeout, max_tokens=args.max_tokens, temperature=args.temperature,
+                                      top_p=args.top_p)
+            backend = LLMBackend(client)
+        workers = args.workers if args.workers is not None else (1 if args.backend == 'gliner' else 4)
+        batcher = MicroBatcher(backend, args.max_batch_size, args.max_wait_ms, args.max_queue_size, workers)
+        web.run_app(build_app(batcher), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main(build_parser().parse_args())
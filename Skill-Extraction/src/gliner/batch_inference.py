@@ -0,0 +1,217 @@
+"""
+Length bucketed batch inference with a tuned GLiNER model. \
+Date:
+    2026/10/18
+
+The torch backend runs the checkpoint in PyTorch, the onnx backend runs a directory written by onnx_export.py
+through ONNX Runtime on CPU, with the threshold and thread counts saved with the export unless given here.
+"""
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+import torch
+from gliner import GLiNER
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from span_table import is_columnar, read_records, write_records
+
+LABELS = ['Skill', 'Knowledge']
+BACKENDS = ['torch', 'onnx']
+# written next to the ONNX graphs by onnx_export.py
+INFERENCE_CONFIG = 'inference_config.json'
+
+
+def read_inference_config(model_path):
+    """
+    Threshold, labels, ONNX file and thread counts saved with an export, empty for a plain checkpoint.
+    """
+    config_file = os.path.join(model_path, INFERENCE_CONFIG)
+    if not os.path.exists(config_file):
+        return {}
+    with open(config_file) as f:
+        return json.load(f)
+
+
+def session_options(intra_op_threads=None, inter_op_threads=None):
+    """
+    ONNX Runtime options with all graph optimizations, the operators run in parallel with more than one inter op
+    thread.
+    """
+    import onnxruntime as ort
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if intra_op_threads is not None:
+        options.intra_op_num_threads = intra_op_threads
+    if inter_op_threads is not None:
+        options.inter_op_num_threads = inter_op_threads
+        if inter_op_threads > 1:
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+    return options
+
+
+def load_model(model_path, backend='torch', device=None, onnx_model_file=None, intra_op_threads=None,
+               inter_op_threads=None):
+    """
+    Load a GLiNER checkpoint in PyTorch, or an ONNX export in ONNX Runtime.
+
+    Parameters
+    ----------
+    model_path: checkpoint directory, or output directory of onnx_export.py for the onnx backend
+    backend: torch or onnx
+    device: torch device, cuda when available by default, the onnx backend runs on cpu
+    onnx_model_file: ONNX graph of model_path, the one chosen at export by default
+    intra_op_threads, inter_op_threads: thread counts, the ones tuned by onnx_export.py validate by default
+
+    Returns
+    -------
+    (model, device)
+    """
+    if backend == 'torch':
+        if device is None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        if intra_op_threads is not None:
+            torch.set_num_threads(intra_op_threads)
+        model = GLiNER.from_pretrained(model_path, load_tokenizer=True, local_files_only=True)
+        model.to(torch.device(device))
+        model.eval()
+        return model, device
+    if backend != 'onnx':
+        raise ValueError(f'Unknown backend {backend}, expected one of {BACKENDS}')
+    inference_config = read_inference_config(model_path)
+    if onnx_model_file is None:
+        onnx_model_file = inference_config.get('onnx_model_file', 'model.onnx')
+        if not inference_config.get('validated', True):
+            print(f'{model_path} was not validated against PyTorch, run onnx_export.py validate first', file=sys.stderr)
+    if intra_op_threads is None:
+        intra_op_threads = inference_config.get('intra_op_threads')
+    if inter_op_threads is None:
+        inter_op_threads = inference_config.get('inter_op_threads')
+    model = GLiNER.from_pretrained(model_path, load_tokenizer=True, local_files_only=True, load_onnx_model=True,
+                                   onnx_model_file=onnx_model_file,
+                                   session_options=session_options(intra_op_threads, inter_op_threads))
+    return model, 'cpu'
+
+
+def read_sentences(input_file, text_field='text'):
+    """
+    Stream the sentences of a .jsonl file, a .tsv file with a header row or a .parquet/.arrow file, one at a time.
+    """
+    if is_columnar(input_file):
+        for record in read_records(input_file, [text_field]):
+            yield record[text_field]
+        return
+    with open(input_file, encoding='utf-8', newline='') as f:
+        if input_file.endswith('.tsv'):
+            for row in csv.DictReader(f, delimiter='\t'):
+                yield row[text_field]
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)[text_field]
+
+
+def build_batches(sentences, max_tokens, max_batch_size):
+    """
+    Group sentences of similar length so every batch, padded to its longest sentence, stays within max_tokens.
+
+    Returns
+    -------
+    list of batches of sentence indices, from the shortest sentences to the longest
+    """
+    lengths = [len(sentence.split()) for sentence in sentences]
+    order = sorted(range(len(sentences)), key=lambda i: lengths[i])
+    batches = []
+    batch = []
+    for i in order:
+        # sentences come by increasing length so the new one sets the padded length of the batch
+        if batch and (len(batch) >= max_batch_size or (len(batch) + 1) * max(lengths[i], 1) > max_tokens):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def to_spans(entities):
+    """
+    Convert GLiNER entities to the span schema of the label files, with an inclusive end offset.
+    """
+    return [{'start': entity['start'], 'end': entity['end'] - 1, 'label': entity['label'].upper(),
+             'score': entity['score']} for entity in entities]
+
+
+def predict_chunk(model, sentences, labels, threshold, max_tokens, max_batch_size):
+    predictions = [None] * len(sentences)
+    for batch in build_batches(sentences, max_tokens, max_batch_size):
+        # one forward pass per batch, the batch already fits the token budget
+        entities = model.batch_predict_entities([sentences[i] for i in batch], labels, threshold=threshold,
+                                                batch_size=len(batch))
+        for i, sentence_entities in zip(batch, entities):
+            predictions[i] = sentence_entities
+    return predictions
+
+
+def run_inference(model_path, input_file, output_file, labels=None, threshold=None, text_field='text',
+                  max_tokens=8192, max_batch_size=64, chunk_size=10000, device=None, backend='torch',
+                  onnx_model_file=None, intra_op_threads=None, inter_op_threads=None):
+    """
+    Predict the skill spans of every sentence of input_file and write them, in input order, to output_file.
+
+    Sentences are read chunk_size at a time, sorted by length inside the chunk and batched under a token budget,
+    so short sentences are not padded to the length of long ones. The labels and threshold saved with an ONNX
+    export are used unless given, LABELS and 0.5 otherwise.
+    """
+    inference_config = read_inference_config(model_path)
+    if labels is None:
+        labels = inference_config.get('labels', LABELS)
+    if threshold is None:
+        threshold = inference_config.get('threshold', 0.5)
+    model, device = load_model(model_path, backend, device, onnx_model_file, intra_op_threads, inter_op_threads)
+
+    sentences = read_sentences(input_file, text_field)
+    n_sentences = 0
+
+    def generate_records():
+        nonlocal n_sentences
+        with torch.no_grad():
+            for chunk in iter(lambda: list(itertools.islice(sentences, chunk_size)), []):
+                predictions = predict_chunk(model, chunk, labels, threshold, max_tokens, max_batch_size)
+                for sentence, entities in zip(chunk, predictions):
+                    yield {'text': sentence, 'spans': to_spans(entities)}
+                n_sentences += len(chunk)
+
+    start_time = time.perf_counter()
+    write_records(generate_records(), output_file)
+    elapsed = time.perf_counter() - start_time
+    print(f'{n_sentences} sentences in {elapsed:.2f}s on {device} with {backend} '
+          f'({n_sentences / max(elapsed, 1e-9):.1f} sentences/sec)')
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--model_path", required=True, type=str)
+    parser.add_argument("--input_file", required=True, type=str)
+    parser.add_argument("--output_file", required=True, type=str)
+    parser.add_argument("--labels", required=False, default=None, type=str)
+    parser.add_argument("--threshold", required=False, default=None, type=float)
+    parser.add_argument("--text_field", required=False, default='text', type=str)
+    parser.add_argument("--max_tokens", required=False, default=8192, type=int)
+    parser.add_argument("--max_batch_size", required=False, default=64, type=int)
+    parser.add_argument("--chunk_size", required=False, default=10000, type=int)
+    parser.add_argument("--device", required=False, default=None, type=str)
+    parser.add_argument("--backend", required=False, default='torch', choices=BACKENDS, type=str)
+    parser.add_argument("--onnx_model_file", required=False, default=None, type=str,
+                        help="model.onnx or model_int8.onnx of an export, the one chosen at export by default")
+    parser.add_argument("--intra_op_threads", required=False, default=None, type=int)
+    parser.add_argument("--inter_op_threads", required=False, default=None, type=int)
+    args = parser.parse_args()
+    run_inference(args.model_path, args.input_file, args.output_file,
+                  json.loads(args.labels) if args.labels else None, args.threshold, args.text_field, args.max_tokens,
+                  args.max_batch_size, args.chunk_size, args.device, args.backend, args.onnx_model_file,
+                  args.intra_op_threads, args.inter_op_threads)
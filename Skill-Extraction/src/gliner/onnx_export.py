@@ -0,0 +1,307 @@
+"""
+Export the tuned GLiNER checkpoint to ONNX, optionally with int8 weights, and check the export against PyTorch. \
+Date:
+    2026/10/18
+
+export saves the checkpoint with its tokenizer and config, model.onnx and, with --quantize, model_int8.onnx (int8
+weights, activations quantized at run time) into one directory, with the selected threshold and labels in
+inference_config.json. batch_inference.py --backend onnx runs that directory. Until it is validated an export serves
+model.onnx and is marked as not validated.
+
+validate predicts the validation sentences with the PyTorch checkpoint and with every ONNX graph of the export. It
+reports how many of the PyTorch spans every graph reproduces, the strict scores against the gold spans, the single
+sentence latency and the batched throughput. The fastest graph reproducing at least --min_agreement of the PyTorch
+spans becomes the served one, its intra and inter op thread counts are tuned on a sample of the sentences, and both
+are saved in inference_config.json. The int8 graph is only served when it passes, its agreement depends on how many
+scores of the checkpoint lie close to the threshold.
+
+Usage:
+    python onnx_export.py export --model_path results/checkpoint-400 --output_dir gliner_onnx --threshold 0.82 \
+        --quantize
+    python onnx_export.py validate --model_path results/checkpoint-400 --output_dir gliner_onnx \
+        --report_file gliner_onnx/validation_report.json
+"""
+import json
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+import torch
+from gliner import GLiNER
+
+from batch_inference import INFERENCE_CONFIG, LABELS, load_model, predict_chunk, read_inference_config, read_sentences
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'evaluation'))
+from span_evaluator import SpanEvaluator
+
+ONNX_MODEL_FILE = 'model.onnx'
+QUANTIZED_MODEL_FILE = 'model_int8.onnx'
+# any sentence does, the axes of the graph are dynamic
+EXPORT_TEXT = 'Experience with Python and SQL, and good communication skills.'
+
+
+class ExportWrapper(torch.nn.Module):
+    def __init__(self, model, span_level) -> None:
+        """
+        Fix the inputs of the GLiNER model to the ones its ONNX Runtime wrappers feed, passed by name since the
+        position of the arguments of forward changes between GLiNER versions.
+        """
+        super().__init__()
+        self.model = model
+        self.span_level = span_level
+
+    def forward(self, input_ids, attention_mask, words_mask, text_lengths, span_idx=None, span_mask=None):
+        inputs = {'input_ids': input_ids, 'attention_mask': attention_mask, 'words_mask': words_mask,
+                  'text_lengths': text_lengths}
+        if self.span_level:
+            inputs.update({'span_idx': span_idx, 'span_mask': span_mask})
+        return self.model(**inputs).logits
+
+
+def export_onnx(model_path, output_dir, threshold, labels=LABELS, quantize=False, opset_version=14):
+    """
+    Write the checkpoint and its ONNX graphs to output_dir, the int8 graph is the one served when quantize is set.
+    """
+    model = GLiNER.from_pretrained(model_path, load_tokenizer=True, local_files_only=True)
+    model.to(torch.device('cpu'))
+    model.eval()
+    # the config and tokenizer files are loaded from the same directory as the graph
+    model.save_pretrained(output_dir)
+
+    inputs, _ = model.prepare_model_inputs([EXPORT_TEXT], labels)
+    span_level = model.config.span_mode != 'token_level'
+    input_names = ['input_ids', 'attention_mask', 'words_mask', 'text_lengths']
+    dynamic_axes = {
+        'input_ids': {0: 'batch_size', 1: 'sequence_length'},
+        'attention_mask': {0: 'batch_size', 1: 'sequence_length'},
+        'words_mask': {0: 'batch_size', 1: 'sequence_length'},
+        'text_lengths': {0: 'batch_size', 1: 'value'},
+    }
+    if span_level:
+        input_names += ['span_idx', 'span_mask']
+        dynamic_axes.update({
+            'span_idx': {0: 'batch_size', 1: 'num_spans', 2: 'idx'},
+            'span_mask': {0: 'batch_size', 1: 'num_spans'},
+            'logits': {0: 'batch_size', 1: 'sequence_length', 2: 'num_spans', 3: 'num_classes'},
+        })
+    else:
+        dynamic_axes['logits'] = {0: 'position', 1: 'batch_size', 2: 'sequence_length', 3: 'num_classes'}
+
+    onnx_file = os.path.join(output_dir, ONNX_MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(ExportWrapper(model.model, span_level), tuple(inputs[name] for name in input_names),
+                          f=onnx_file, input_names=input_names, output_names=['logits'], dynamic_axes=dynamic_axes,
+                          opset_version=opset_version)
+    print(f'ONNX graph saved to {onnx_file}.')
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(onnx_file, os.path.join(output_dir, QUANTIZED_MODEL_FILE), weight_type=QuantType.QInt8)
+        print(f'Quantized graph saved to {os.path.join(output_dir, QUANTIZED_MODEL_FILE)}.')
+
+    inference_config = {
+        'source_model': model_path,
+        'threshold': threshold,
+        'labels': labels,
+        'onnx_model_file': ONNX_MODEL_FILE,
+        'onnx_model_files': [ONNX_MODEL_FILE] + ([QUANTIZED_MODEL_FILE] if quantize else []),
+        'intra_op_threads': None,
+        'inter_op_threads': None,
+        'validated': False,
+    }
+    with open(os.path.join(output_dir, INFERENCE_CONFIG), 'w') as f:
+        json.dump(inference_config, f, indent=2)
+
+
+def load_validation(dataset='jjzha/skillspan', split='validation', input_file=None, text_field='text'):
+    """
+    Sentences and gold spans of a split, as gliner_raytune.ipynb builds them, or the sentences of input_file without
+    gold spans.
+    """
+    if input_file is not None:
+        return list(read_sentences(input_file, text_field)), None
+    from datasets import load_dataset
+    from utils import combine_entities, formatting_prompts_batch
+    data = load_dataset(dataset)[split]
+    data = data.map(formatting_prompts_batch, batched=True).map(combine_entities, batched=False)
+    return data['sentence'], data['knowledge_and_skill']
+
+
+def predict_timed(model, sentences, labels, threshold, max_tokens, max_batch_size):
+    with torch.no_grad():
+        # the first batch pays for the lazy initializations
+        predict_chunk(model, sentences[:8], labels, threshold, max_tokens, max_batch_size)
+        start_time = time.perf_counter()
+        predictions = predict_chunk(model, sentences, labels, threshold, max_tokens, max_batch_size)
+    return predictions, time.perf_counter() - start_time
+
+
+def measure_latency(model, sentences, labels, threshold):
+    """
+    Milliseconds per sentence predicted alone, as an online request would be.
+    """
+    latencies = []
+    with torch.no_grad():
+        for sentence in sentences:
+            start_time = time.perf_counter()
+            model.batch_predict_entities([sentence], labels, threshold=threshold, batch_size=1)
+            latencies.append((time.perf_counter() - start_time) * 1000)
+    return {'p50_ms': float(np.percentile(latencies, 50)), 'p95_ms': float(np.percentile(latencies, 95)),
+            'mean_ms': float(np.mean(latencies))}
+
+
+def span_agreement(reference, predictions):
+    """
+    Spans of the reference predictions found again, with the same offsets and label, and the largest score
+    difference of those spans.
+    """
+    n_reference = n_predicted = n_common = n_identical = 0
+    max_score_difference = 0.0
+    for reference_entities, entities in zip(reference, predictions):
+        reference_spans = {(entity['start'], entity['end'], entity['label']): entity['score']
+                           for entity in reference_entities}
+        spans = {(entity['start'], entity['end'], entity['label']): entity['score'] for entity in entities}
+        common = reference_spans.keys() & spans.keys()
+        n_reference += len(reference_spans)
+        n_predicted += len(spans)
+        n_common += len(common)
+        n_identical += reference_spans.keys() == spans.keys()
+        for span in common:
+            max_score_difference = max(max_score_difference, abs(reference_spans[span] - spans[span]))
+    precision = n_common / n_predicted if n_predicted > 0 else 1.0
+    recall = n_common / n_reference if n_reference > 0 else 1.0
+    return {'precision': precision, 'recall': recall,
+            'f1': 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0,
+            'identical_sentences': n_identical / max(len(reference), 1),
+            'max_score_difference': max_score_difference}
+
+
+def thread_candidates():
+    """
+    Powers of two intra op threads up to the number of CPUs with sequential operators, and half the CPUs per
+    operator with two operators in parallel.
+    """
+    n_cpus = os.cpu_count() or 1
+    intra_op_threads = sorted({n_cpus} | {2 ** i for i in range(n_cpus.bit_length()) if 2 ** i < n_cpus})
+    candidates = [(intra, 1) for intra in intra_op_threads]
+    if n_cpus >= 4:
+        candidates.append((n_cpus // 2, 2))
+    return candidates
+
+
+def tune_threads(output_dir, onnx_model_file, sentences, labels, threshold, max_tokens, max_batch_size):
+    """
+    Throughput of the graph for every candidate (intra op, inter op) thread count, returns the fastest pair and the
+    sentences/sec of every pair.
+    """
+    throughputs = {}
+    for intra_op_threads, inter_op_threads in thread_candidates():
+        model, _ = load_model(output_dir, 'onnx', onnx_model_file=onnx_model_file, intra_op_threads=intra_op_threads,
+                              inter_op_threads=inter_op_threads)
+        _, elapsed = predict_timed(model, sentences, labels, threshold, max_tokens, max_batch_size)
+        throughputs[f'{intra_op_threads}x{inter_op_threads}'] = len(sentences) / elapsed
+        print(f'{intra_op_threads} intra op, {inter_op_threads} inter op threads: '
+              f'{len(sentences) / elapsed:.1f} sentences/sec')
+    best = max(throughputs, key=throughputs.get)
+    intra_op_threads, inter_op_threads = (int(n) for n in best.split('x'))
+    return intra_op_threads, inter_op_threads, throughputs
+
+
+def validate(model_path, output_dir, sentences, gold=None, max_tokens=8192, max_batch_size=64, latency_sentences=200,
+             tune_sentences=256, min_agreement=0.95):
+    """
+    Compare the PyTorch checkpoint and every ONNX graph of an export on the same sentences, on CPU, and serve the
+    fastest graph agreeing with PyTorch.
+
+    Returns
+    -------
+    (report, passed), passed is False when no graph agrees with the PyTorch spans at min_agreement F1
+    """
+    inference_config = read_inference_config(output_dir)
+    labels, threshold = inference_config['labels'], inference_config['threshold']
+    report = {'sentences': len(sentences), 'threshold': threshold, 'min_agreement': min_agreement, 'backends': {}}
+    evaluator = SpanEvaluator(tags=labels)
+    reference = None
+    # every backend runs with the default threads of its runtime, the served graph is tuned afterwards
+    runs = [('torch', model_path, None)] + [('onnx', output_dir, file) for file in inference_config['onnx_model_files']]
+    for backend, path, onnx_model_file in runs:
+        model, _ = load_model(path, backend, 'cpu', onnx_model_file, intra_op_threads=None, inter_op_threads=None)
+        predictions, elapsed = predict_timed(model, sentences, labels, threshold, max_tokens, max_batch_size)
+        name = backend if onnx_model_file is None else onnx_model_file
+        result = {'sentences_per_sec': len(sentences) / elapsed,
+                  'latency': measure_latency(model, sentences[:latency_sentences], labels, threshold)}
+        if reference is None:
+            reference = predictions
+        else:
+            result['agreement'] = span_agreement(reference, predictions)
+            result['speedup'] = result['sentences_per_sec'] / report['backends']['torch']['sentences_per_sec']
+        if gold is not None:
+            result['strict'] = evaluator.evaluate(gold, predictions)[0]['strict']
+        report['backends'][name] = result
+        print(f"{name}: {result['sentences_per_sec']:.1f} sentences/sec, "
+              f"p50 latency {result['latency']['p50_ms']:.1f} ms"
+              + (f", span agreement F1 {result['agreement']['f1']:.4f}" if 'agreement' in result else '')
+              + (f", strict F1 {result['strict']['f1']:.4f}" if 'strict' in result else ''))
+        del model
+
+    passing = [file for file in inference_config['onnx_model_files']
+               if report['backends'][file]['agreement']['f1'] >= min_agreement]
+    if not passing:
+        report['served'] = None
+        inference_config.update({'onnx_model_file': ONNX_MODEL_FILE, 'validated': False})
+    else:
+        served = max(passing, key=lambda file: report['backends'][file]['sentences_per_sec'])
+        intra_op_threads, inter_op_threads, throughputs = tune_threads(
+            output_dir, served, sentences[:tune_sentences], labels, threshold, max_tokens, max_batch_size)
+        report.update({'served': served, 'intra_op_threads': intra_op_threads, 'inter_op_threads': inter_op_threads,
+                       'thread_throughputs': throughputs})
+        inference_config.update({'onnx_model_file': served, 'intra_op_threads': intra_op_threads,
+                                 'inter_op_threads': inter_op_threads, 'validated': True,
+                                 'agreement_f1': report['backends'][served]['agreement']['f1']})
+    with open(os.path.join(output_dir, INFERENCE_CONFIG), 'w') as f:
+        json.dump(inference_config, f, indent=2)
+    return report, bool(passing)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("command", choices=['export', 'validate'])
+    parser.add_argument("--model_path", required=True, type=str, help="tuned checkpoint, e.g. checkpoint-400")
+    parser.add_argument("--output_dir", required=True, type=str)
+    parser.add_argument("--threshold", required=False, default=None, type=float,
+                        help="confidence threshold selected on the validation set, for export")
+    parser.add_argument("--labels", required=False, default=json.dumps(LABELS), type=str)
+    parser.add_argument("--quantize", required=False, default=False, action='store_true')
+    parser.add_argument("--opset_version", required=False, default=14, type=int)
+    parser.add_argument("--dataset", required=False, default='jjzha/skillspan', type=str)
+    parser.add_argument("--split", required=False, default='validation', type=str)
+    parser.add_argument("--input_file", required=False, default=None, type=str,
+                        help="sentences to validate on instead of the dataset split, without gold spans")
+    parser.add_argument("--text_field", required=False, default='text', type=str)
+    parser.add_argument("--max_tokens", required=False, default=8192, type=int)
+    parser.add_argument("--max_batch_size", required=False, default=64, type=int)
+    parser.add_argument("--latency_sentences", required=False, default=200, type=int)
+    parser.add_argument("--tune_sentences", required=False, default=256, type=int)
+    parser.add_argument("--min_agreement", required=False, default=0.95, type=float)
+    parser.add_argument("--report_file", required=False, default=None, type=str)
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        if args.threshold is None:
+            parser.error('export needs --threshold')
+        export_onnx(args.model_path, args.output_dir, args.threshold, json.loads(args.labels), args.quantize,
+                    args.opset_version)
+    else:
+        sentences, gold = load_validation(args.dataset, args.split, args.input_file, args.text_field)
+        report, passed = validate(args.model_path, args.output_dir, sentences, gold, args.max_tokens,
+                                  args.max_batch_size, args.latency_sentences, args.tune_sentences, args.min_agreement)
+        if args.report_file is not None:
+            with open(args.report_file, 'w') as f:
+                json.dump(report, f, indent=2)
+        if not passed:
+            print(f'No graph agrees with the PyTorch spans at {args.min_agreement} F1, the export stays not validated.')
+            sys.exit(1)
+        print(f"{report['served']} is served with {report['intra_op_threads']} intra op and "
+              f"{report['inter_op_threads']} inter op threads.")
@@ -0,0 +1,173 @@
+"""
+Precision, recall and F1 of every GLiNER confidence threshold from one prediction pass. \
+Date:
+    2026/10/18
+
+The model predicts once at the lowest threshold, the predictions are matched against the gold spans once and every
+threshold of the curve is counted from the sorted scores. Documents with nested or overlapping spans, where
+nervaluate's outcome of a prediction depends on the other predictions kept, are counted per threshold.
+
+Usage:
+    from threshold_sweep import threshold_sweep
+    curve, best_threshold = threshold_sweep(y, pred_gli, tags=['Skill', 'Knowledge'])
+"""
+import collections
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'evaluation'))
+from span_evaluator import count_document
+
+# strict metric indices of span_evaluator.METRICS counted in the actual and possible spans
+STRICT_ACTUAL = (0, 1, 2, 4)
+STRICT_POSSIBLE = (0, 1, 2, 3)
+
+
+def default_thresholds():
+    return [i / 100 for i in range(5, 100, 1)]
+
+
+def overlaps(true, ent):
+    # overlap of the inclusive offset ranges, as nervaluate's find_overlap
+    return max(true['start'], ent['start']) <= min(true['end'], ent['end'])
+
+
+def is_one_to_one(true_ents, pred_ents):
+    """
+    Whether every prediction overlaps at most one gold span and every gold span at most one prediction. It then holds
+    for the predictions above any threshold too, and every prediction has the same outcome at every threshold.
+    """
+    times_overlapped = collections.Counter()
+    for ent in pred_ents:
+        hits = [i for i, true in enumerate(true_ents) if overlaps(true, ent)]
+        if len(hits) > 1:
+            return False
+        times_overlapped.update(hits)
+    return all(n == 1 for n in times_overlapped.values())
+
+
+def count_document_curve(true_ents, pred_ents, tags, thresholds):
+    """
+    Strict correct, actual and possible counts of one document at every threshold, counted by nervaluate's rules on
+    the predictions above the threshold.
+
+    Returns
+    -------
+    int64 array of shape (len(tags), 3, len(thresholds))
+    """
+    label_ids = {tag: i for i, tag in enumerate(tags)}
+    true_spans = [(ent['start'], ent['end'], label_ids[ent['label']]) for ent in true_ents]
+    pred_spans = [(ent['start'], ent['end'], label_ids[ent['label']]) for ent in pred_ents]
+    scores = np.array([ent['score'] for ent in pred_ents], dtype=np.float64)
+    kept_from = np.searchsorted(np.sort(scores), thresholds, side='right')
+    counts = np.zeros((len(tags), 3, len(thresholds)), dtype=np.int64)
+    # thresholds between the same two scores keep the same predictions
+    for first in np.unique(kept_from):
+        columns = kept_from == first
+        # in their original order, nervaluate's sort by end keeps it for ties
+        kept = [span for span, score in zip(pred_spans, scores) if score > thresholds[columns][0]]
+        outcome_counts = collections.Counter()
+        count_document(true_spans, kept, outcome_counts)
+        for (label_id, outcome), n in outcome_counts.items():
+            strict = outcome[0]
+            counted = np.array([strict == 0, strict in STRICT_ACTUAL, strict in STRICT_POSSIBLE], dtype=np.int64)
+            counts[label_id][:, columns] += n * counted[:, None]
+    return counts
+
+
+def score_predictions(y_true, y_pred, tags, thresholds):
+    """
+    Flatten the scored predictions once: score, whether the prediction matches a gold span exactly and the tag the
+    prediction is counted under.
+
+    Like nervaluate's strict schema, a prediction overlapping a gold span is counted under the gold span's tag,
+    every other prediction under its own tag. This holds in documents where predictions and gold spans overlap one
+    to one. In the others, e.g. KNOWLEDGE nested in SKILL, nervaluate counts an incorrect per overlapped gold span
+    and a spurious for a second prediction on the same gold span, so their counts are taken from count_document at
+    every threshold instead.
+
+    Returns
+    -------
+    (scores, matched, pred_tags, gold_tags, document_counts), document_counts sums count_document_curve over the
+    documents where the overlaps are not one to one
+    """
+    scores, matched, pred_tags = [], [], []
+    gold_tags = []
+    document_counts = np.zeros((len(tags), 3, len(thresholds)), dtype=np.int64)
+    for true_ents, pred_ents in zip(y_true, y_pred):
+        true_ents = [ent for ent in true_ents if ent['label'] in tags]
+        pred_ents = [ent for ent in pred_ents if ent['label'] in tags]
+        if not is_one_to_one(true_ents, pred_ents):
+            document_counts += count_document_curve(true_ents, pred_ents, tags, thresholds)
+            continue
+        gold = {(ent['start'], ent['end'], ent['label']) for ent in true_ents}
+        gold_tags.extend(ent['label'] for ent in true_ents)
+        for ent in pred_ents:
+            is_match = (ent['start'], ent['end'], ent['label']) in gold
+            tag = ent['label']
+            if not is_match:
+                for true in true_ents:
+                    if overlaps(true, ent):
+                        tag = true['label']
+                        break
+            scores.append(ent['score'])
+            matched.append(is_match)
+            pred_tags.append(tag)
+    return np.array(scores, dtype=np.float64), np.array(matched, dtype=bool), np.array(pred_tags, dtype=object), \
+        np.array(gold_tags, dtype=object), document_counts
+
+
+def sweep_curve(scores, matched, n_gold, thresholds, document_counts):
+    """
+    Strict precision, recall and F1 of the predictions with a score above every threshold, from sorted scores, plus
+    the correct, actual and possible counts per threshold of the documents counted one by one.
+    """
+    sorted_scores = np.sort(scores)
+    sorted_matched_scores = np.sort(scores[matched])
+    # predictions kept are those with score > threshold
+    actual = len(sorted_scores) - np.searchsorted(sorted_scores, thresholds, side='right')
+    correct = len(sorted_matched_scores) - np.searchsorted(sorted_matched_scores, thresholds, side='right')
+    correct = correct + document_counts[0]
+    actual = actual + document_counts[1]
+    possible = n_gold + document_counts[2]
+    precision = np.divide(correct, actual, out=np.zeros(len(thresholds)), where=actual > 0)
+    recall = np.divide(correct, possible, out=np.zeros(len(thresholds)), where=possible > 0)
+    f1 = np.divide(2 * precision * recall, precision + recall, out=np.zeros(len(thresholds)),
+                   where=(precision + recall) > 0)
+    return pd.DataFrame({'threshold': thresholds, 'correct': correct, 'actual': actual, 'possible': possible,
+                         'precision': precision, 'recall': recall, 'f1': f1})
+
+
+def threshold_sweep(y_true, y_pred, tags=['Skill', 'Knowledge'], thresholds=None):
+    """
+    Precision/recall/F1 curve of a confidence threshold over predictions made once at the lowest threshold.
+
+    Replaces evaluating a filtered copy of the predictions per threshold: the predictions are matched against the
+    gold spans once, sorted by score and every threshold is counted with a binary search. Documents where
+    predictions and gold spans do not overlap one to one are counted per threshold with count_document, so the
+    scores equal nervaluate's strict scores.
+
+    Returns
+    -------
+    (curve, best_threshold), curve has one row per tag ('overall' and every tag) and threshold, best_threshold is
+    the first threshold with the highest overall F1
+    """
+    if thresholds is None:
+        thresholds = default_thresholds()
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    scores, matched, pred_tags, gold_tags, document_counts = score_predictions(y_true, y_pred, tags, thresholds)
+
+    curves = [sweep_curve(scores, matched, len(gold_tags), thresholds, document_counts.sum(axis=0))
+              .assign(tag='overall')]
+    for i, tag in enumerate(tags):
+        mask = pred_tags == tag
+        curves.append(sweep_curve(scores[mask], matched[mask], int((gold_tags == tag).sum()), thresholds,
+                                  document_counts[i]).assign(tag=tag))
+    curve = pd.concat(curves, ignore_index=True)
+
+    overall = curves[0]
+    best_threshold = float(overall['threshold'].iloc[int(np.argmax(overall['f1'].values))])
+    return curve, best_threshold
@@ -1,86 +1,125 @@
 
 
-def proc_ex(ex, tag_field = "tags_knowledge"):
-    label = tag_field.split("_")[1]
+TAG_FIELDS = ["tags_knowledge", "tags_skill"]
+
+
+def token_offsets(tokens):
+    """
+    Character offsets of the tokens in the sentence joined by single spaces, from a cumulative length array.
+
+    Returns
+    -------
+    (sentence, ends), ends[i] is the length of the sentence up to and including token i
+    """
+    ends = []
+    length = 0
+    for token in tokens:
+        # leading empty tokens do not add a space
+        length = length + 1 + len(token) if length > 0 else len(token)
+        ends.append(length)
+    first = next((i for i, token in enumerate(tokens) if token != ""), len(tokens))
+    return " ".join(tokens[first:]), ends
+
+
+def decode_tags(tokens, tags, label, ends):
+    """
+    Decode the IOB tags of one label into token spans and character offset entities.
+    """
     spans = []
-    start_pos = None
-    entity_name = None
-    sentence = ""
     results = []
+    entity_name = None
+    start_pos = None
+    start = end = None
+    parts = []
     prev_tag = "O"
 
-    for i, (token, tag) in enumerate(zip(ex['tokens'], ex[tag_field])):
-        if sentence == "":
-            sentence = token
-        else:
-            sentence += " " + token
-        
+    for i, (token, tag) in enumerate(zip(tokens, tags)):
         if tag == "O":  # 'O' tag
             if entity_name is not None:
-                results.append({"label": entity_name, "start": start, "end": end, 'text': text})
+                results.append({"label": entity_name, "start": start, "end": end, 'text': " ".join(parts)})
                 spans.append((start_pos, i - 1))
                 entity_name = None
                 start_pos = None
-                
+
+            prev_tag = tag
+        elif tag.startswith('B'):
+            if entity_name is not None:
+                spans.append((start_pos, i - 1))
+                results.append({"label": entity_name, "start": start, "end": end, 'text': " ".join(parts)})
+
+            entity_name = label.capitalize()
+            start_pos = i
+            start = ends[i] - len(token)
+            end = ends[i]
+            parts = [token]
+            prev_tag = tag
+        elif tag.startswith('I'):
+            if prev_tag == "O":
+                # one error case, an I tag after an O tag only continues an entity that is never written
+                start = ends[i] - (1 + len(token)) - len(tokens[i - 1])
+                parts = [tokens[i - 1]]
+            end = ends[i]
+            parts.append(token)
             prev_tag = tag
-        else:
-            tag_name = tag
-            if tag_name.startswith('B'):
-                if entity_name is not None:
-                    spans.append((start_pos, i - 1))
-                    results.append({"label": entity_name, "start": start, "end": end, 'text': text})
-                    
-                entity_name = label.capitalize()
-                start_pos = i
-
-                start = len(sentence) - len(token)
-                end = len(sentence)
-                text = token
-
-                prev_tag = tag
-                
-            elif tag_name.startswith('I'):
-                if prev_tag == "O":
-                    # one error case 
-                    prev_token = ex['tokens'][i-1]
-                    start = len(sentence) - (1 +len(token)) - len(prev_token)
-                    text = prev_token
-                    ner_start = i - 1
-                    
-                end = len(sentence)
-                text += " " + token
-                
-                prev_tag = tag
-                continue
 
     # Handle the last entity if the sentence ends with an entity
     if entity_name is not None:
-        spans.append((start_pos, len(ex["tokens"]) - 1))
-        results.append({"label": entity_name, "start": start, "end": end, 'text': text})
+        spans.append((start_pos, len(tokens) - 1))
+        results.append({"label": entity_name, "start": start, "end": end, 'text': " ".join(parts)})
+
+    return spans, results
 
+
+def proc_ex(ex, tag_field = "tags_knowledge"):
+    label = tag_field.split("_")[1]
+    sentence, ends = token_offsets(ex['tokens'])
+    spans, results = decode_tags(ex['tokens'], ex[tag_field], label, ends)
     return {"tokenized_text": ex["tokens"], 'sentence': sentence, f"{label}_ner": spans, label: results}
-    
+
+
+def process_tokens(tokens, tags_by_field):
+    """
+    Build the GLiNER columns of one example, the token offsets are computed once for all tag fields.
+    """
+    sentence, ends = token_offsets(tokens)
+    processed = {"tokenized_text": tokens, 'sentence': sentence}
+    for tag_field, tags in tags_by_field.items():
+        label = tag_field.split("_")[1]
+        processed[f"{label}_ner"], processed[label] = decode_tags(tokens, tags, label, ends)
+    return processed
+
+
 def formatting_prompts_func(ex):
-    d1 = proc_ex(ex, tag_field="tags_knowledge")
-    d2 = proc_ex(ex, tag_field="tags_skill")
-    ex.update(d1)
-    ex.update(d2)
+    ex.update(process_tokens(ex['tokens'], {tag_field: ex[tag_field] for tag_field in TAG_FIELDS}))
     return ex
 
 
+def formatting_prompts_batch(examples):
+    """
+    Batched formatting_prompts_func, for ds.map(formatting_prompts_batch, batched=True, num_proc=N).
+    """
+    columns = {}
+    for i, tokens in enumerate(examples['tokens']):
+        processed = process_tokens(tokens, {tag_field: examples[tag_field][i] for tag_field in TAG_FIELDS})
+        for column, value in processed.items():
+            columns.setdefault(column, []).append(value)
+    return columns
+
+
 def convert_to_gliner_dataset(hg_data):
-    res = []
+    """
+    Yield the GLiNER training examples one by one, use list() where the whole dataset is needed.
+    """
     for tks, skill_ner, knowledge_ner in zip(hg_data['tokenized_text'], hg_data['skill_ner'], hg_data['knowledge_ner']):
         d = {"tokenized_text": tks}
         if len(skill_ner) == 0 and len(knowledge_ner) == 0:
             # The information tag is added when no entities are present, this is done to improve training but this tag will not be used
             d['ner'] = [[0, len(tks), "Information"]]
-            res.append(d)
+            yield d
             continue
         d['ner'] = [[i,j, "Skill"] for i, j in skill_ner]
         d['ner'] += [[i,j, "Knowledge"] for i, j in knowledge_ner]
-        res.append(d)
-    return res
+        yield d
 
 
 def combine_entities(examples):
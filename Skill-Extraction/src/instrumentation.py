@@ -0,0 +1,298 @@
+"""
+Timers, counters and peak memory of the pipeline scripts, reported as JSON or as a Prometheus textfile. \
+Date:
+    2026/10/18
+
+The metrics are process wide, the scripts record them with count() and timer() and their entry point wraps the run
+in instrument(), which samples the resident memory, optionally profiles the run and writes the report:
+
+    with instrument('combine', args.metrics_file, args.profile, args.profile_file):
+        ...
+
+Timers are inclusive, a timer running inside another one is counted in both. Work done in worker processes is
+only reported when the worker sends its snapshot() back to be merge()d.
+"""
+import collections
+import contextlib
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+PROFILERS = ['cprofile', 'pyinstrument']
+
+
+def current_rss_bytes():
+    """
+    Resident memory of this process, from /proc where available.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return peak_rss_bytes(resource.RUSAGE_SELF)
+
+
+def peak_rss_bytes(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = resource.getrusage(who).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+class Metrics:
+    def __init__(self) -> None:
+        """
+        Counters and timers of one process, see the module level count() and timer().
+        """
+        self.counters = collections.Counter()
+        # name: [calls, seconds]
+        self.timers = collections.defaultdict(lambda: [0, 0.0])
+        # peak resident memory sampled while each timer was running
+        self.timer_peaks = collections.Counter()
+        self.open_timers = collections.Counter()
+        self.lock = threading.Lock()
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        with self.lock:
+            self.open_timers[name] += 1
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start_time
+            with self.lock:
+                timer = self.timers[name]
+                timer[0] += 1
+                timer[1] += seconds
+                self.open_timers[name] -= 1
+
+    def timed(self, iterable, name):
+        """
+        Yield from iterable, timing the production of every item under name.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.timer(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def sample_memory(self):
+        rss = current_rss_bytes()
+        with self.lock:
+            for name, n_open in self.open_timers.items():
+                if n_open > 0 and rss > self.timer_peaks[name]:
+                    self.timer_peaks[name] = rss
+        return rss
+
+    def snapshot(self, reset=True):
+        """
+        Counters and timers recorded so far, as plain data that can be sent between processes.
+        """
+        with self.lock:
+            snapshot = {'counters': dict(self.counters), 'timers': {name: list(timer) for name, timer in self.timers.items()}}
+            if reset:
+                self.counters.clear()
+                self.timers.clear()
+        return snapshot
+
+    def merge(self, snapshot):
+        """
+        Add the snapshot of another process, e.g. of a worker, to these metrics.
+        """
+        with self.lock:
+            self.counters.update(snapshot['counters'])
+            for name, (calls, seconds) in snapshot['timers'].items():
+                self.timers[name][0] += calls
+                self.timers[name][1] += seconds
+
+
+METRICS = Metrics()
+
+
+def count(name, n=1):
+    METRICS.count(name, n)
+
+
+def timer(name):
+    return METRICS.timer(name)
+
+
+def timed(iterable, name):
+    return METRICS.timed(iterable, name)
+
+
+class MemorySampler(threading.Thread):
+    def __init__(self, metrics, interval=0.1) -> None:
+        """
+        Background thread sampling the resident memory every interval seconds.
+        """
+        super().__init__(daemon=True)
+        self.metrics = metrics
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while True:
+            self.peak = max(self.peak, self.metrics.sample_memory())
+            if self.stopped.wait(self.interval):
+                return
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.peak = max(self.peak, self.metrics.sample_memory())
+
+
+def build_report(stage, wall_seconds, sampler, metrics=METRICS):
+    timers = {}
+    for name, (calls, seconds) in sorted(metrics.timers.items()):
+        timers[name] = {'calls': calls, 'seconds': seconds}
+        if name in metrics.timer_peaks:
+            timers[name]['peak_rss_bytes'] = metrics.timer_peaks[name]
+    return {
+        'stage': stage,
+        'argv': sys.argv,
+        'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'wall_seconds': wall_seconds,
+        # the sampled peak can miss short spikes, getrusage does not
+        'peak_rss_bytes': max(sampler.peak, peak_rss_bytes(resource.RUSAGE_SELF)),
+        'peak_rss_children_bytes': peak_rss_bytes(resource.RUSAGE_CHILDREN),
+        'counters': dict(sorted(metrics.counters.items())),
+        'timers': timers,
+    }
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def to_prometheus(report, prefix='skill_extraction'):
+    """
+    Render a report in the Prometheus text exposition format, for the node_exporter textfile collector.
+    """
+    stage = escape_label(report['stage'])
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f'# HELP {prefix}_{name} {help_text}')
+        lines.append(f'# TYPE {prefix}_{name} {kind}')
+        for labels, value in samples:
+            label_text = ','.join([f'stage="{stage}"'] + [f'{key}="{escape_label(label)}"' for key, label in labels])
+            lines.append(f'{prefix}_{name}{{{label_text}}} {value}')
+
+    metric('wall_seconds', 'gauge', 'Wall time of the run.', [((), report['wall_seconds'])])
+    metric('peak_rss_bytes', 'gauge', 'Peak resident memory of the run.', [((), report['peak_rss_bytes'])])
+    metric('peak_rss_children_bytes', 'gauge', 'Peak resident memory of the largest child process.',
+           [((), report['peak_rss_children_bytes'])])
+    metric('events_total', 'counter', 'Events counted during the run.',
+           [((('name', name),), value) for name, value in report['counters'].items()])
+    metric('step_seconds_total', 'counter', 'Time spent in each timed step.',
+           [((('step', name),), timer['seconds']) for name, timer in report['timers'].items()])
+    metric('step_calls_total', 'counter', 'Calls of each timed step.',
+           [((('step', name),), timer['calls']) for name, timer in report['timers'].items()])
+    metric('step_peak_rss_bytes', 'gauge', 'Peak resident memory sampled during each timed step.',
+           [((('step', name),), timer['peak_rss_bytes']) for name, timer in report['timers'].items()
+            if 'peak_rss_bytes' in timer])
+    lines.append(f'{prefix}_last_run_timestamp_seconds{{stage="{stage}"}} {time.time()}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_report(report, metrics_file):
+    """
+    Write a report as Prometheus text for .prom files and as JSON otherwise, atomically so a collector never
+    reads half a file.
+    """
+    if metrics_file.endswith('.prom'):
+        content = to_prometheus(report)
+    else:
+        content = json.dumps(report, indent=2)
+    with open(f'{metrics_file}.tmp', 'w') as f:
+        f.write(content)
+    os.replace(f'{metrics_file}.tmp', metrics_file)
+
+
+@contextlib.contextmanager
+def profiled(profile, profile_file):
+    """
+    Run the block under cProfile, dumped as pstats, or pyinstrument, dumped as html for a .html file and as text
+    otherwise.
+    """
+    if profile is None:
+        yield
+        return
+    if profile == 'cprofile':
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(profile_file)
+        return
+    if profile == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise ImportError('--profile pyinstrument needs pyinstrument, pip install pyinstrument')
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(profile_file, 'w') as f:
+                f.write(profiler.output_html() if profile_file.endswith('.html') else profiler.output_text())
+        return
+    raise ValueError(f'Unknown profiler {profile}, expected one of {PROFILERS}')
+
+
+@contextlib.contextmanager
+def instrument(stage, metrics_file=None, profile=None, profile_file=None, sample_interval=0.1):
+    """
+    Measure the run of one pipeline stage and write its report to metrics_file.
+
+    Parameters
+    ----------
+    stage: name of the stage, e.g. combine
+    metrics_file: report file, Prometheus text for .prom files and JSON otherwise, None to only print a summary
+    profile: None, cprofile or pyinstrument
+    profile_file: where the profile is written, {stage}.prof or {stage}.html by default
+    sample_interval: seconds between two samples of the resident memory
+    """
+    if profile is not None and profile_file is None:
+        profile_file = f'{stage}.prof' if profile == 'cprofile' else f'{stage}.html'
+    sampler = MemorySampler(METRICS, sample_interval)
+    sampler.start()
+    start_time = time.perf_counter()
+    try:
+        with profiled(profile, profile_file), timer(stage):
+            yield METRICS
+    finally:
+        sampler.stop()
+        report = build_report(stage, time.perf_counter() - start_time, sampler)
+        if metrics_file is not None:
+            write_report(report, metrics_file)
+        # stderr keeps the stdout of the scripts unchanged
+        print(f"{stage}: {report['wall_seconds']:.2f}s, peak RSS {report['peak_rss_bytes'] / (1 << 20):.0f} MB",
+              file=sys.stderr)
+
+
+def add_arguments(parser):
+    """
+    Add the --metrics_file, --profile and --profile_file options of instrument() to an ArgumentParser.
+    """
+    parser.add_argument("--metrics_file", required=False, default=None, type=str,
+                        help="write timers, counters and peak memory, as Prometheus text for .prom files, JSON otherwise")
+    parser.add_argument("--profile", required=False, default=None, choices=PROFILERS, type=str)
+    parser.add_argument("--profile_file", required=False, default=None, type=str)
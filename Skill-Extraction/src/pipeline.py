@@ -0,0 +1,337 @@
+"""
+Stage runner for data_preparation.sh and training.sh that only recomputes what changed. \
+Date:
+    2026/10/18
+
+Every stage declares its input files, config files, source files and output files. Its fingerprint hashes the
+command, the contents of the inputs and configs and the source code of the scripts it runs. A stage whose
+fingerprint was already computed is skipped and its outputs are restored from the cache when they were changed
+since, every other stage runs as soon as the stages producing its inputs are done, independent stages in parallel.
+
+Usage, from the repository root:
+    python Skill-Extraction/src/pipeline.py data_preparation evaluation
+"""
+import concurrent.futures
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+from argparse import ArgumentParser
+
+SRC_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PIPELINES = ['data_preparation', 'training', 'evaluation']
+DEFAULT_PIPELINES = ['data_preparation', 'evaluation']
+_print_lock = threading.Lock()
+
+
+def log(message):
+    # stages running in parallel print whole lines
+    with _print_lock:
+        print(message, flush=True)
+
+
+class Stage:
+    def __init__(self, name, command, inputs=(), configs=(), sources=(), outputs=(), stdout=None) -> None:
+        """
+        One step of the pipeline.
+
+        Parameters
+        ----------
+        name: unique name of the stage
+        command: argument list of the command
+        inputs: files or directories read by the command, outputs of other stages make this stage depend on them
+        configs: JSON/YAML config files read by the command
+        sources: scripts and modules run by the command, their code is the version of the stage
+        outputs: files or directories written by the command
+        stdout: file the standard output of the command is saved to, it is an output of the stage
+        """
+        self.name = name
+        self.command = [str(argument) for argument in command]
+        self.inputs = list(inputs)
+        self.configs = list(configs)
+        self.sources = list(sources)
+        self.outputs = list(outputs) + ([stdout] if stdout is not None else [])
+        self.stdout = stdout
+
+
+class FileHasher:
+    def __init__(self, cache_file) -> None:
+        """
+        Content hashes of files and directories, remembered across runs by path, size and modification time.
+        """
+        self.cache_file = cache_file
+        self.hashes = {}
+        if os.path.exists(cache_file):
+            with open(cache_file) as f:
+                self.hashes = json.load(f)
+
+    def hash_file(self, path):
+        stat = os.stat(path)
+        key = f'{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}'
+        if key not in self.hashes:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+            self.hashes[key] = digest.hexdigest()
+        return self.hashes[key]
+
+    def hash_path(self, path):
+        """
+        Hash of a file, of every file of a directory with its relative path, or None when the path does not exist.
+        """
+        if os.path.isfile(path):
+            return self.hash_file(path)
+        if not os.path.isdir(path):
+            return None
+        digest = hashlib.sha256()
+        for root, directories, files in os.walk(path):
+            directories.sort()
+            for file in sorted(files):
+                file_path = os.path.join(root, file)
+                digest.update(os.path.relpath(file_path, path).encode('utf-8'))
+                digest.update(self.hash_file(file_path).encode('utf-8'))
+        return digest.hexdigest()
+
+    def save(self):
+        # only keep the hashes of files that still exist as they are
+        live = {}
+        for key, digest in self.hashes.items():
+            path, size, mtime = key.rsplit(':', 2)
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                if f'{stat.st_size}:{stat.st_mtime_ns}' == f'{size}:{mtime}':
+                    live[key] = digest
+        with open(self.cache_file, 'w') as f:
+            json.dump(live, f)
+
+
+def copy_path(source, destination):
+    if os.path.dirname(destination):
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+    if os.path.isdir(source):
+        if os.path.isdir(destination):
+            shutil.rmtree(destination)
+        shutil.copytree(source, destination)
+    else:
+        shutil.copy2(source, destination)
+
+
+class PipelineRunner:
+    def __init__(self, stages, cache_directory='.pipeline_cache', max_workers=3, force=False) -> None:
+        """
+        Run stages in dependency order, skipping the ones whose fingerprint is cached.
+
+        Parameters
+        ----------
+        stages: list of Stage
+        cache_directory: directory of the fingerprints and cached outputs
+        max_workers: number of stages run at the same time
+        force: run every stage even when its fingerprint is cached
+        """
+        self.stages = {stage.name: stage for stage in stages}
+        self.cache_directory = cache_directory
+        self.max_workers = max_workers
+        self.force = force
+        os.makedirs(os.path.join(cache_directory, 'objects'), exist_ok=True)
+        self.hasher = FileHasher(os.path.join(cache_directory, 'file_hashes.json'))
+        self.dependencies = {stage.name: self.find_dependencies(stage) for stage in stages}
+
+    def find_dependencies(self, stage):
+        """
+        Names of the stages writing one of the inputs of stage, or a directory containing it.
+        """
+        dependencies = set()
+        for other in self.stages.values():
+            if other.name == stage.name:
+                continue
+            for output in other.outputs:
+                output = os.path.normpath(output)
+                for path in stage.inputs:
+                    path = os.path.normpath(path)
+                    if path == output or path.startswith(output + os.sep):
+                        dependencies.add(other.name)
+        return dependencies
+
+    def fingerprint(self, stage):
+        digest = hashlib.sha256()
+        digest.update(json.dumps(stage.command).encode('utf-8'))
+        for kind, paths in [('input', stage.inputs), ('config', stage.configs), ('source', stage.sources)]:
+            for path in paths:
+                digest.update(f'{kind}:{path}:{self.hasher.hash_path(path)}'.encode('utf-8'))
+        digest.update(json.dumps(stage.outputs).encode('utf-8'))
+        return digest.hexdigest()
+
+    def object_directory(self, fingerprint):
+        return os.path.join(self.cache_directory, 'objects', fingerprint)
+
+    def restore(self, stage, fingerprint):
+        """
+        Bring back the cached outputs of a fingerprint, returns False when there are none.
+        """
+        manifest_file = os.path.join(self.object_directory(fingerprint), 'manifest.json')
+        if not os.path.exists(manifest_file):
+            return False
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+        for index, output in enumerate(stage.outputs):
+            if self.hasher.hash_path(output) != manifest[output]:
+                copy_path(os.path.join(self.object_directory(fingerprint), str(index)), output)
+        return True
+
+    def store(self, stage, fingerprint):
+        directory = self.object_directory(fingerprint)
+        manifest = {}
+        for index, output in enumerate(stage.outputs):
+            if not os.path.exists(output):
+                raise FileNotFoundError(f'Stage {stage.name} did not write {output}')
+            copy_path(output, os.path.join(directory, str(index)))
+            manifest[output] = self.hasher.hash_path(output)
+        with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+    def run_stage(self, stage):
+        fingerprint = self.fingerprint(stage)
+        if not self.force and self.restore(stage, fingerprint):
+            log(f'[{stage.name}] unchanged, skipped')
+            return False
+        log(f'[{stage.name}] running: {" ".join(stage.command)}')
+        for output in stage.outputs:
+            if os.path.dirname(output):
+                os.makedirs(os.path.dirname(output), exist_ok=True)
+        if stage.stdout is None:
+            subprocess.run(stage.command, check=True)
+        else:
+            with open(stage.stdout, 'w') as f:
+                subprocess.run(stage.command, check=True, stdout=f)
+        self.store(stage, fingerprint)
+        log(f'[{stage.name}] done')
+        return True
+
+    def run(self, names=None):
+        """
+        Run the given stages, all of them by default. The outputs of stages that are not selected are used as
+        they are on disk.
+
+        Returns
+        -------
+        dict of stage name to whether the stage ran
+        """
+        selected = set(self.stages if names is None else names)
+
+        ran = {}
+        running = {}
+        try:
+            with concurrent.futures.ThreadPoolExecutor(self.max_workers) as executor:
+                while len(ran) < len(selected):
+                    for name in sorted(selected):
+                        if name not in ran and name not in running.values() and self.dependencies[name] & selected <= set(ran):
+                            running[executor.submit(self.run_stage, self.stages[name])] = name
+                    done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        name = running.pop(future)
+                        # a failed stage stops the pipeline, the running ones are finished first
+                        ran[name] = future.result()
+        finally:
+            self.hasher.save()
+        return ran
+
+
+def build_stages(data_directory='Skill-Extraction/data', results_directory='saves/Meta-Llama-3-8B-Instruct/lora/results',
+                 adapter_directory='saves/Meta-Llama-3-8B-Instruct/lora/sft', dataset='jjzha/skillspan',
+                 labels='["SKILL", "KNOWLEDGE"]'):
+    """
+    The stages of data_preparation.sh and training.sh, paths are relative to the repository root.
+    """
+    python = sys.executable
+    src = os.path.relpath(SRC_DIRECTORY)
+    preprocessing = os.path.join(src, 'preprocessing')
+    postprocessing = os.path.join(src, 'postprocessing')
+    evaluation = os.path.join(src, 'evaluation')
+    span_table = os.path.join(src, 'span_table.py')
+    instrumentation = os.path.join(src, 'instrumentation.py')
+    data = lambda file: os.path.join(data_directory, file)
+    results = lambda file: os.path.join(results_directory, file)
+    run_exp = "from llamafactory.train.tuner import run_exp; run_exp()"
+
+    stages = {'data_preparation': [], 'training': [], 'evaluation': []}
+    stages['data_preparation'].append(Stage(
+        'convert',
+        [python, os.path.join(preprocessing, 'convert_iob_tags_to_offset_tags.py'),
+         '--output_directory', data_directory + os.sep, '--dataset', dataset],
+        configs=[os.path.join(preprocessing, 'config/convert_iob_tags_to_offset_tags.json')],
+        sources=[os.path.join(preprocessing, 'convert_iob_tags_to_offset_tags.py'), span_table, instrumentation],
+        outputs=[data(f'{split}.jsonl') for split in ['train', 'validation', 'test']]))
+    for split in ['train', 'validation', 'test']:
+        stages['data_preparation'].append(Stage(
+            f'prepare_{split}',
+            [python, os.path.join(preprocessing, 'prepare_data.py'), '--annotation_file', data(f'{split}.jsonl'),
+             '--output_file', data(f'{split}.json'), '--labels', labels],
+            inputs=[data(f'{split}.jsonl')],
+            configs=[os.path.join(preprocessing, 'config/prepare_data.json')],
+            sources=[os.path.join(preprocessing, 'prepare_data.py'), span_table, instrumentation],
+            outputs=[data(f'{split}.json')]))
+
+    stages['training'].append(Stage(
+        'train',
+        [python, '-c', run_exp, os.path.join(src, 'train/config/skill_span_train.yaml')],
+        inputs=[data('train.json'), data('dataset_info.json')],
+        configs=[os.path.join(src, 'train/config/skill_span_train.yaml')],
+        outputs=[adapter_directory]))
+    stages['training'].append(Stage(
+        'predict',
+        [python, '-c', run_exp, os.path.join(src, 'train/config/skill_span_evaluate.yaml')],
+        inputs=[data('test.json'), data('dataset_info.json'), adapter_directory],
+        configs=[os.path.join(src, 'train/config/skill_span_evaluate.yaml')],
+        outputs=[results('generated_predictions.jsonl')]))
+
+    stages['evaluation'].append(Stage(
+        'combine',
+        [python, os.path.join(postprocessing, 'combine_prediction_results.py'), '--base_file', data('test.jsonl'),
+         '--input_file', data('test.json'), '--prediction_file', results('generated_predictions.jsonl'),
+         '--output_file', results('processed_predictions.jsonl'), '--tokenizer', 'white_space'],
+        inputs=[data('test.jsonl'), data('test.json'), results('generated_predictions.jsonl')],
+        configs=[os.path.join(postprocessing, 'config/combine_prediction_results.json')],
+        sources=[os.path.join(postprocessing, file) for file in
+                 ['combine_prediction_results.py', 'prediction_parser.py', 'span_locator.py']]
+        + [span_table, instrumentation],
+        outputs=[results('processed_predictions.jsonl'), results('error_data.csv')]))
+    stages['evaluation'].append(Stage(
+        'evaluate',
+        [python, os.path.join(evaluation, 'evaluate_token_based_results.py'),
+         '--prediction_file', results('processed_predictions.jsonl'), '--label_file', data('test.jsonl')],
+        inputs=[results('processed_predictions.jsonl'), data('test.jsonl')],
+        sources=[os.path.join(evaluation, file) for file in
+                 ['evaluate_token_based_results.py', 'span_evaluator.py']] + [span_table, instrumentation],
+        stdout=results('evaluation.txt')))
+    return stages
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("pipelines", nargs='*', help=f"pipelines to run among {PIPELINES}, default {DEFAULT_PIPELINES}")
+    parser.add_argument("--stages", required=False, default=None, type=str, help="comma separated stage names")
+    parser.add_argument("--cache_directory", required=False, default='.pipeline_cache', type=str)
+    parser.add_argument("--max_workers", required=False, default=3, type=int)
+    parser.add_argument("--force", required=False, default=False, action='store_true')
+    parser.add_argument("--data_directory", required=False, default='Skill-Extraction/data', type=str)
+    parser.add_argument("--results_directory", required=False, default='saves/Meta-Llama-3-8B-Instruct/lora/results', type=str)
+    args = parser.parse_args()
+    if set(args.pipelines) - set(PIPELINES):
+        parser.error(f'unknown pipelines {sorted(set(args.pipelines) - set(PIPELINES))}')
+
+    pipeline_stages = build_stages(args.data_directory, args.results_directory)
+    # the stages of the other pipelines are known so their outputs are recognised, only the selected ones run
+    runner = PipelineRunner([stage for stages in pipeline_stages.values() for stage in stages], args.cache_directory,
+                            args.max_workers, args.force)
+    if args.stages is not None:
+        names = args.stages.split(',')
+        unknown = sorted(set(names) - set(runner.stages))
+        if unknown:
+            parser.error(f'unknown stages {unknown}, expected some of {list(runner.stages)}')
+    else:
+        names = [stage.name for pipeline in args.pipelines or DEFAULT_PIPELINES for stage in pipeline_stages[pipeline]]
+    runner.run(names)
@@ -0,0 +1,270 @@
+"""
+Build the sparse job x skill feature matrix of the cleaned job postings from the processed predictions. \
+Date:
+    2026/10/18
+
+Every predicted span is normalized and interned into an integer vocabulary per label. The matrix has one row per
+job kept by cleaning.py, in the order of the cleaned file, and one block of columns per label, SKILL columns first.
+The raw counts and their TF-IDF weights are saved as SciPy .npz files next to a vocabulary file, and load with
+load_skill_matrix.
+
+A prediction record belongs to the job given by its job_field (an index into the cleaned rows, or a value of
+job_key_column), and otherwise to the job whose text_column equals its text. combine_prediction_results.py writes no
+job field, so by default records join on the Description column of cleaning.py. Records of jobs removed by the
+cleaning are skipped, and a prediction file of which no record joins a job is an error.
+
+Usage:
+    python build_skill_matrix.py --prediction_file processed_predictions.jsonl \
+        --job_file "freelancerresult_cleaned.tsv" --output_directory features
+"""
+import json
+import os
+import re
+import sys
+import unicodedata
+from array import array
+from argparse import ArgumentParser
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from scipy import sparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import add_arguments, count, instrument, timer
+from span_table import is_columnar, read_records
+
+WHITESPACE = re.compile(r'\s+')
+COUNTS_FILE = 'skill_counts.npz'
+TFIDF_FILE = 'skill_tfidf.npz'
+VOCABULARY_FILE = 'skill_vocabulary.json'
+
+
+def normalize_skill(text):
+    """
+    Fold the case, unicode forms, whitespace and enclosing punctuation of a skill span, '.NET' and 'C++' keep theirs.
+    """
+    text = WHITESPACE.sub(' ', unicodedata.normalize('NFKC', text).casefold())
+    return text.strip(' ,;:!?"\'*()[]{}').rstrip('. ')
+
+
+def normalize_text(text):
+    return WHITESPACE.sub(' ', str(text)).strip()
+
+
+def tfidf(counts, blocks):
+    """
+    TF-IDF weights of a count matrix, with the smoothed idf of scikit-learn and rows L2 normalized per label block.
+    """
+    n_rows = counts.shape[0]
+    document_frequency = np.bincount(counts.indices, minlength=counts.shape[1])
+    idf = np.log((1 + n_rows) / (1 + document_frequency)) + 1
+    weighted = sparse.csr_matrix(counts.multiply(idf[np.newaxis, :]), dtype=np.float64)
+    normalized = []
+    for start, end in blocks:
+        block = weighted[:, start:end]
+        norms = np.sqrt(np.asarray(block.multiply(block).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        normalized.append(sparse.diags(1 / norms) @ block)
+    return sparse.hstack(normalized, format='csr') if normalized else weighted
+
+
+def load_skill_matrix(directory, weighting='counts'):
+    """
+    Load a matrix saved by build_skill_matrix.
+
+    Parameters
+    ----------
+    directory: output directory of build_skill_matrix
+    weighting: counts or tfidf
+
+    Returns
+    -------
+    (CSR matrix, vocabulary), vocabulary['columns'] holds the (label, skill) of every column, vocabulary['blocks']
+    the column range of every label and vocabulary['jobs'] the job of every row
+    """
+    matrix = sparse.load_npz(os.path.join(directory, COUNTS_FILE if weighting == 'counts' else TFIDF_FILE))
+    with open(os.path.join(directory, VOCABULARY_FILE), encoding='utf-8') as f:
+        vocabulary = json.load(f)
+    return matrix, vocabulary
+
+
+class SkillMatrixBuilder:
+    def __init__(self, resource_directory, labels=None, job_field=None, job_key_column=None, text_column=None,
+                 min_df=None, canonical_file=None) -> None:
+        """
+        Parameters
+        ----------
+        resource_directory: directory containing the config file
+        labels: list of labels, one block of columns each
+        job_field: field of the prediction records holding their job
+        job_key_column: column of the cleaned jobs matched by job_field, None matches the row index
+        text_column: column of the cleaned jobs matched with the text of records without a job_field
+        min_df: number of jobs a skill needs to appear in to get a column
+        canonical_file: {skill: canonical skill} JSON of canonicalize_skills.py, the columns are canonical skills
+        """
+        # get configuration
+        if resource_directory is None:
+            resource_directory = os.path.dirname(__file__)
+
+        with open(os.path.join(resource_directory, 'config/build_skill_matrix.json')) as f:
+            config = json.load(f)
+        if labels is None:
+            self.labels = config['labels']
+        else:
+            self.labels = labels
+        if job_field is None:
+            self.job_field = config['job_field']
+        else:
+            self.job_field = job_field
+        if job_key_column is None:
+            self.job_key_column = config['job_key_column']
+        else:
+            self.job_key_column = job_key_column
+        if text_column is None:
+            self.text_column = config['text_column']
+        else:
+            self.text_column = text_column
+        if min_df is None:
+            self.min_df = config['min_df']
+        else:
+            self.min_df = min_df
+        if canonical_file is None:
+            canonical_file = config['canonical_file']
+        self.canonical = {}
+        if canonical_file is not None:
+            with open(canonical_file, encoding='utf-8') as f:
+                self.canonical = json.load(f)
+
+    def load_jobs(self, job_file):
+        """
+        Read the job keys and texts of the cleaned TSV, or of its Parquet copy, returns (job keys, {key: row},
+        {text: row}).
+        """
+        columns = [column for column in (self.job_key_column, self.text_column) if column is not None]
+        if job_file.endswith('.parquet'):
+            jobs = pd.read_parquet(job_file, columns=columns)
+            n_jobs = pq.ParquetFile(job_file).metadata.num_rows
+        else:
+            # the first column is read to count the jobs when neither column is needed
+            jobs = pd.read_csv(job_file, sep='\t', usecols=columns or [0], dtype=str, keep_default_na=False)
+            n_jobs = len(jobs)
+        if self.job_key_column is not None:
+            job_keys = jobs[self.job_key_column].astype(str).tolist()
+        else:
+            job_keys = list(range(n_jobs))
+        key_rows = {str(key): row for row, key in enumerate(job_keys)}
+        text_rows = {}
+        if self.text_column is not None:
+            for row, text in enumerate(jobs[self.text_column]):
+                text_rows.setdefault(normalize_text(text), row)
+        return job_keys, key_rows, text_rows
+
+    def job_row(self, record, key_rows, text_rows):
+        if self.job_field in record:
+            return key_rows.get(str(record[self.job_field]))
+        return text_rows.get(normalize_text(record['text']))
+
+    def build(self, prediction_file, job_file, output_directory):
+        """
+        Intern the predicted skills of every job and save the count and TF-IDF matrices with their vocabulary.
+        """
+        with timer('skill_matrix.load_jobs'):
+            job_keys, key_rows, text_rows = self.load_jobs(job_file)
+        if not key_rows and not text_rows:
+            raise ValueError(f'{job_file} has no jobs')
+
+        label_index = {label: i for i, label in enumerate(self.labels)}
+        vocabularies = [{} for _ in self.labels]
+        # one entry per span, the column is local to the label block until the block offsets are known
+        rows, labels, columns = array('i'), array('i'), array('i')
+        n_joined = 0
+        columns_read = None if not is_columnar(prediction_file) else ['text', 'spans']
+        with timer('skill_matrix.intern'):
+            for record in read_records(prediction_file, columns_read):
+                count('skill_matrix.records')
+                row = self.job_row(record, key_rows, text_rows)
+                if row is None:
+                    count('skill_matrix.records_without_job')
+                    continue
+                n_joined += 1
+                text = record['text']
+                for span in record.get('spans') or []:
+                    if span['label'] not in label_index:
+                        count('skill_matrix.unknown_labels')
+                        continue
+                    skill = normalize_skill(text[span['start']:span['end'] + 1])
+                    if not skill:
+                        continue
+                    skill = self.canonical.get(skill, skill)
+                    vocabulary = vocabularies[label_index[span['label']]]
+                    rows.append(row)
+                    labels.append(label_index[span['label']])
+                    columns.append(vocabulary.setdefault(skill, len(vocabulary)))
+                    count('skill_matrix.spans')
+        if n_joined == 0:
+            raise ValueError(f'no record of {prediction_file} joins a job of {job_file}, by its {self.job_field} '
+                             f'field or its text in the {self.text_column} column')
+
+        with timer('skill_matrix.build'):
+            offsets = np.cumsum([0] + [len(vocabulary) for vocabulary in vocabularies])
+            rows = np.frombuffer(rows, dtype=np.int32)
+            columns = offsets[np.frombuffer(labels, dtype=np.int32)] + np.frombuffer(columns, dtype=np.int32)
+            # duplicate (row, column) entries are summed into counts
+            counts = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, columns)),
+                                       shape=(len(job_keys), int(offsets[-1])))
+            counts.sum_duplicates()
+            vocabulary_columns = [(label, skill) for label, vocabulary in zip(self.labels, vocabularies)
+                                  for skill in vocabulary]
+            document_frequency = np.bincount(counts.indices, minlength=counts.shape[1])
+            keep = np.flatnonzero(document_frequency >= self.min_df)
+            counts = counts[:, keep]
+            vocabulary_columns = [vocabulary_columns[column] for column in keep]
+            document_frequency = document_frequency[keep]
+            blocks = {}
+            for label in self.labels:
+                in_block = [column for column, (column_label, _) in enumerate(vocabulary_columns) if column_label == label]
+                blocks[label] = [in_block[0], in_block[-1] + 1] if in_block else [len(vocabulary_columns)] * 2
+            weights = tfidf(counts, [blocks[label] for label in self.labels])
+
+        with timer('skill_matrix.save'):
+            os.makedirs(output_directory, exist_ok=True)
+            sparse.save_npz(os.path.join(output_directory, COUNTS_FILE), counts)
+            sparse.save_npz(os.path.join(output_directory, TFIDF_FILE), weights)
+            vocabulary = {
+                'job_file': job_file,
+                'job_key_column': self.job_key_column,
+                'jobs': job_keys,
+                'blocks': blocks,
+                'columns': [[label, skill] for label, skill in vocabulary_columns],
+                'document_frequency': document_frequency.tolist(),
+            }
+            with open(os.path.join(output_directory, VOCABULARY_FILE), 'w', encoding='utf-8') as f:
+                json.dump(vocabulary, f, ensure_ascii=False)
+
+        print(f'{counts.shape[0]} jobs x {counts.shape[1]} skills, {counts.nnz} non zero entries, '
+              + ', '.join(f'{label}: {end - start}' for label, (start, end) in blocks.items()) + '.')
+        print(f'Skill matrix saved to {output_directory}.')
+        return counts, vocabulary
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--resource_directory", required=False, default=None, type=str)
+    parser.add_argument("--prediction_file", required=True, type=str)
+    parser.add_argument("--job_file", required=True, type=str, help="cleaned TSV of cleaning.py, or its Parquet copy")
+    parser.add_argument("--output_directory", required=True, type=str)
+    parser.add_argument("--labels", required=False, default=None, type=str)
+    parser.add_argument("--job_field", required=False, default=None, type=str)
+    parser.add_argument("--job_key_column", required=False, default=None, type=str)
+    parser.add_argument("--text_column", required=False, default=None, type=str)
+    parser.add_argument("--min_df", required=False, default=None, type=int)
+    parser.add_argument("--canonical_file", required=False, default=None, type=str)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    with instrument('skill_matrix', args.metrics_file, args.profile, args.profile_file):
+        builder = SkillMatrixBuilder(args.resource_directory, json.loads(args.labels) if args.labels else None,
+                                     args.job_field, args.job_key_column, args.text_column, args.min_df,
+                                     args.canonical_file)
+        builder.build(args.prediction_file, args.job_file, args.output_directory)
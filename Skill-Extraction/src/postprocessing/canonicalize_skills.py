@@ -0,0 +1,246 @@
+"""
+Map the surface forms of the extracted skills, e.g. "java script" and "javascript", to canonical skills. \
+Date:
+    2026/10/18
+
+Skills are compared with their cluster representatives only, never pairwise: a MinHash of the character n-grams of
+every skill is split in bands, and only the representatives sharing a band with a skill are scored with the
+Levenshtein ratio. A skill joins the best scoring cluster above the threshold, or starts a new cluster it
+represents. The most frequent skills of a batch are processed first so they become the representatives.
+
+The mapping, the representatives and their LSH buckets are kept in SQLite. A new batch only adds the skills not
+mapped yet, existing mappings never change.
+
+Usage:
+    python canonicalize_skills.py --input_file processed_predictions.jsonl --output_file skill_canonical.json
+    python build_skill_matrix.py ... --canonical_file skill_canonical.json
+"""
+import collections
+import json
+import os
+import sqlite3
+import sys
+import zlib
+from argparse import ArgumentParser
+
+import numpy as np
+from rapidfuzz import fuzz, process
+
+from build_skill_matrix import VOCABULARY_FILE, normalize_skill
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import add_arguments, count, instrument, timer
+from span_table import read_records
+
+# Mersenne prime of the universal hashes, a * x + b stays below 2 ** 64
+PRIME = (1 << 31) - 1
+SCORERS = {'ratio': fuzz.ratio, 'token_sort_ratio': fuzz.token_sort_ratio}
+
+
+def read_skill_counts(input_file):
+    """
+    Count the normalized skills of a processed predictions file, or read them from a skill_vocabulary.json of
+    build_skill_matrix, with their document frequency as count.
+    """
+    counts = collections.Counter()
+    if os.path.basename(input_file) == VOCABULARY_FILE:
+        with open(input_file, encoding='utf-8') as f:
+            vocabulary = json.load(f)
+        for (_, skill), frequency in zip(vocabulary['columns'], vocabulary['document_frequency']):
+            counts[skill] += frequency
+        return counts
+    for record in read_records(input_file):
+        for span in record.get('spans') or []:
+            skill = normalize_skill(record['text'][span['start']:span['end'] + 1])
+            if skill:
+                counts[skill] += 1
+    return counts
+
+
+class MinHasher:
+    def __init__(self, num_perm, bands, ngram, seed) -> None:
+        """
+        MinHash signatures of character n-gram sets and their LSH band keys.
+
+        Parameters
+        ----------
+        num_perm: number of hash functions, a multiple of bands
+        bands: number of bands, two sets share a band with probability about 1 - (1 - jaccard ** rows) ** bands
+        ngram: length of the character n-grams
+        seed: seed of the hash functions, fixed so signatures stay comparable across runs
+        """
+        if num_perm % bands:
+            raise ValueError(f'num_perm {num_perm} is not a multiple of bands {bands}')
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, PRIME, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, PRIME, size=num_perm, dtype=np.uint64)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.ngram = ngram
+
+    def shingles(self, skill):
+        # spaces are dropped so "java script" and "javascript" have the same n-grams
+        compact = f"^{skill.replace(' ', '')}$"
+        if len(compact) <= self.ngram:
+            return {compact}
+        return {compact[i:i + self.ngram] for i in range(len(compact) - self.ngram + 1)}
+
+    def band_keys(self, skill):
+        hashes = np.array([zlib.crc32(shingle.encode('utf-8')) % PRIME for shingle in self.shingles(skill)],
+                          dtype=np.uint64)
+        signature = ((np.outer(hashes, self.a) + self.b) % PRIME).min(axis=0).astype(np.uint32)
+        return [band.tobytes() for band in signature.reshape(self.bands, self.rows)]
+
+
+class SkillCanonicalizer:
+    def __init__(self, resource_directory, mapping_file=None, threshold=None, scorer=None, num_perm=None, bands=None,
+                 ngram=None, seed=None) -> None:
+        """
+        Parameters
+        ----------
+        resource_directory: directory containing the config file
+        mapping_file: SQLite file of the mapping, created on the first run
+        threshold: minimum score, out of 100, of a skill and its representative
+        scorer: ratio, the Levenshtein ratio, or token_sort_ratio, the same on sorted words
+        num_perm, bands, ngram, seed: MinHash parameters, fixed by the first run of a mapping file
+        """
+        # get configuration
+        if resource_directory is None:
+            resource_directory = os.path.dirname(__file__)
+
+        with open(os.path.join(resource_directory, 'config/canonicalize_skills.json')) as f:
+            config = json.load(f)
+        if mapping_file is None:
+            self.mapping_file = config['mapping_file']
+        else:
+            self.mapping_file = mapping_file
+        if threshold is None:
+            self.threshold = config['threshold']
+        else:
+            self.threshold = threshold
+        if scorer is None:
+            self.scorer = config['scorer']
+        else:
+            self.scorer = scorer
+        minhash = {'num_perm': num_perm, 'bands': bands, 'ngram': ngram, 'seed': seed}
+        for key, value in minhash.items():
+            if value is None:
+                minhash[key] = config[key]
+
+        self.connection = sqlite3.connect(self.mapping_file)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS mapping (skill TEXT PRIMARY KEY, canonical TEXT, '
+                                'count INTEGER, score REAL)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS buckets (band INTEGER, key BLOB, canonical TEXT)')
+        stored = dict(self.connection.execute('SELECT key, value FROM meta'))
+        if 'minhash' in stored:
+            # buckets of other hash functions would never match
+            minhash = json.loads(stored['minhash'])
+        else:
+            self.connection.execute('INSERT INTO meta VALUES (?, ?)', ('minhash', json.dumps(minhash)))
+            self.connection.commit()
+        self.minhasher = MinHasher(**minhash)
+
+    def load_buckets(self):
+        buckets = collections.defaultdict(list)
+        for band, key, canonical in self.connection.execute('SELECT band, key, canonical FROM buckets'):
+            buckets[band, key].append(canonical)
+        return buckets
+
+    def update(self, skill_counts):
+        """
+        Map the skills not in the mapping yet and add the counts of the others, returns the number of new skills
+        and of new clusters.
+        """
+        known = {}
+        skills = list(skill_counts)
+        for start in range(0, len(skills), 500):
+            chunk = skills[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            known.update(self.connection.execute(
+                f'SELECT skill, canonical FROM mapping WHERE skill IN ({placeholders})', chunk))
+        self.connection.executemany('UPDATE mapping SET count = count + ? WHERE skill = ?',
+                                    [(skill_counts[skill], skill) for skill in known])
+
+        with timer('canonicalize.load_buckets'):
+            buckets = self.load_buckets()
+        scorer = SCORERS[self.scorer]
+        new_mappings, new_buckets = [], []
+        # the most frequent forms first, they represent their clusters
+        for skill in sorted(set(skills) - set(known), key=lambda skill: (-skill_counts[skill], skill)):
+            band_keys = self.minhasher.band_keys(skill)
+            candidates = {canonical for band, key in enumerate(band_keys) for canonical in buckets.get((band, key), ())}
+            count('canonicalize.skills')
+            count('canonicalize.candidates', len(candidates))
+            with timer('canonicalize.score'):
+                best = process.extractOne(skill, sorted(candidates), scorer=scorer,
+                                          score_cutoff=self.threshold) if candidates else None
+            if best is not None:
+                canonical, score, _ = best
+            else:
+                # a new cluster, represented by this skill
+                canonical, score = skill, 100.0
+                count('canonicalize.clusters')
+                for band, key in enumerate(band_keys):
+                    buckets[band, key].append(skill)
+                    new_buckets.append((band, key, skill))
+            new_mappings.append((skill, canonical, skill_counts[skill], score))
+        self.connection.executemany('INSERT INTO mapping VALUES (?, ?, ?, ?)', new_mappings)
+        self.connection.executemany('INSERT INTO buckets VALUES (?, ?, ?)', new_buckets)
+        self.connection.commit()
+        n_clusters = sum(1 for skill, canonical, _, _ in new_mappings if skill == canonical)
+        return len(new_mappings), n_clusters
+
+    def mapping(self):
+        return dict(self.connection.execute('SELECT skill, canonical FROM mapping'))
+
+    def export(self, output_file):
+        """
+        Write {skill: canonical skill} as JSON, or the whole mapping table as TSV for a .tsv file.
+        """
+        if output_file.endswith('.tsv'):
+            with open(output_file, 'w', encoding='utf-8') as f:
+                f.write('skill\tcanonical\tcount\tscore\n')
+                for row in self.connection.execute('SELECT skill, canonical, count, score FROM mapping '
+                                                   'ORDER BY canonical, count DESC, skill'):
+                    f.write('\t'.join(str(value) for value in row) + '\n')
+            return
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump(self.mapping(), f, ensure_ascii=False, indent=2)
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--resource_directory", required=False, default=None, type=str)
+    parser.add_argument("--input_file", required=True, nargs='+', type=str,
+                        help="processed predictions or skill_vocabulary.json files of the new batch")
+    parser.add_argument("--output_file", required=False, default=None, type=str,
+                        help="export of the whole mapping, JSON or .tsv")
+    parser.add_argument("--mapping_file", required=False, default=None, type=str)
+    parser.add_argument("--threshold", required=False, default=None, type=float)
+    parser.add_argument("--scorer", required=False, default=None, choices=list(SCORERS), type=str)
+    parser.add_argument("--num_perm", required=False, default=None, type=int)
+    parser.add_argument("--bands", required=False, default=None, type=int)
+    parser.add_argument("--ngram", required=False, default=None, type=int)
+    parser.add_argument("--seed", required=False, default=None, type=int)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    with instrument('canonicalize', args.metrics_file, args.profile, args.profile_file):
+        canonicalizer = SkillCanonicalizer(args.resource_directory, args.mapping_file, args.threshold, args.scorer,
+                                           args.num_perm, args.bands, args.ngram, args.seed)
+        try:
+            skill_counts = collections.Counter()
+            with timer('canonicalize.read'):
+                for input_file in args.input_file:
+                    skill_counts.update(read_skill_counts(input_file))
+            n_new, n_clusters = canonicalizer.update(skill_counts)
+            print(f'{len(skill_counts)} skills, {n_new} new ones mapped, {n_clusters} new clusters.')
+            if args.output_file is not None:
+                canonicalizer.export(args.output_file)
+                print(f'Mapping saved to {args.output_file}.')
+        finally:
+            canonicalizer.close()
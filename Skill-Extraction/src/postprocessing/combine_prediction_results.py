@@ -8,22 +8,27 @@ Author:
 Date:
     2023/02/21
 """
+import collections
+import csv
+import hashlib
 import html
+import itertools
+import multiprocessing
 import os
+import shutil
+import sys
 
 import argparse
 from argparse import ArgumentParser
 
-import pandas as pd
-from tqdm import tqdm
 import json
 
-from spacy.training import biluo_tags_to_spans, iob_to_biluo
-import spacy
-from spacy.tokens import Doc
+# spaCy, pandas, tqdm and the span locator are imported where they are used, to keep the startup fast
+from prediction_parser import FAILED_CATEGORIES, PARSE_REPAIRED, parse_prediction
 
-import re
-from fuzzywuzzy import fuzz
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import METRICS, add_arguments, count, instrument, timed, timer
+from span_table import is_columnar, read_records, write_records
 
 
 class WhitespaceTokenizer(object):
@@ -31,6 +36,7 @@ class WhitespaceTokenizer(object):
         self.vocab = vocab
 
     def __call__(self, text):
+        from spacy.tokens import Doc
         words = text.split(' ')
         # All tokens 'own' a subsequent space character in this tokenizer
         spaces = [True] * (len(words) - 1)
@@ -38,14 +44,116 @@ class WhitespaceTokenizer(object):
         return Doc(self.vocab, words=words, spaces=spaces)
 
 
+def load_nlp(tokenizer, tokenizer_only=False):
+    """
+    Load the spaCy pipeline used to tokenize the clean text.
+
+    Parameters
+    ----------
+    tokenizer: 'white_space' to split on single spaces, anything else keeps the spaCy tokenizer
+    tokenizer_only: disable every pipeline component so only the tokenizer runs
+
+    The white space tokenizer only needs a blank English vocab. Only the tokenizer sets the token offsets, so the
+    records are the same as with en_core_web_sm. The model is never downloaded here.
+    """
+    import spacy
+
+    # White space tokenizer should be used for the SkillSPAN dataset for consistency
+    if tokenizer == 'white_space':
+        nlp = spacy.blank('en')
+        nlp.tokenizer = WhitespaceTokenizer(nlp.vocab)
+    else:
+        try:
+            nlp = spacy.load("en_core_web_sm")
+        except OSError:
+            raise OSError('en_core_web_sm is not installed, install it with python -m spacy download en_core_web_sm')
+    if tokenizer_only:
+        nlp.select_pipes(disable=nlp.pipe_names)
+    return nlp
+
+
+def iter_json_records(path, chunk_size=1 << 20):
+    """
+    Yield the records of a JSON array file one at a time without loading the whole file, .jsonl files are read per line.
+    """
+    with open(path, encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        decoder = json.JSONDecoder()
+        buffer = f.read(chunk_size).lstrip()
+        if not buffer.startswith('['):
+            raise ValueError(f'{path} is not a JSON array')
+        position = 1
+        eof = False
+        while True:
+            # skip the separators between records
+            while position < len(buffer) and (buffer[position].isspace() or buffer[position] == ','):
+                position += 1
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                if position == len(buffer):
+                    raise json.JSONDecodeError('Incomplete record', buffer, position)
+                record, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # the record continues in the next chunk
+                buffer = buffer[position:]
+                position = 0
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer += chunk
+                continue
+            yield record
+
+
+# spaCy pipeline of a worker process, set once by _init_worker
+_worker_nlp = None
+
+
+def _init_worker(tokenizer):
+    global _worker_nlp
+    _worker_nlp = load_nlp(tokenizer, tokenizer_only=True)
+    # a forked worker starts with a copy of the parent metrics, only its own are sent back
+    METRICS.snapshot()
+
+
+def _process_batch(batch):
+    """
+    Tokenize and align one batch of (clean_text, prediction) rows inside a worker process, the metrics of the
+    batch are sent back with its records.
+    """
+    texts = [clean_text for clean_text, _ in batch]
+    docs = timed(_worker_nlp.pipe(texts, batch_size=len(texts)), 'combine.tokenize')
+    json_docs = [Evaluation.build_json_doc(clean_text, clean_doc, prediction)
+                 for (clean_text, prediction), clean_doc in zip(batch, docs)]
+    return json_docs, METRICS.snapshot()
+
+
 class Evaluation:
-    def __init__(self, resource_directory, base_file, input_file, prediction_file, output_file, tokenizer) -> None:
+    def __init__(self, resource_directory, base_file, input_file, prediction_file, output_file, tokenizer,
+                 batch_size=None, n_process=None, streaming=None, resume=None, checkpoint_every=None, num_shards=None,
+                 shard_index=None) -> None:
         """
         Combine evaluation data with base data for analysis.
 
         Parameters
         ----------
         resource_directory: directory containing the config file
+        base_file: annotated jsonl file of the test split, or its .parquet/.arrow columnar version
+        output_file: processed predictions, written in the columnar format of span_table for .parquet/.arrow files
+        batch_size: number of rows tokenized per nlp.pipe batch, None keeps the row by row mode
+        n_process: number of worker processes used for tokenization and span alignment in batched mode
+        streaming: read the input, prediction and base files record by record and write the outputs incrementally
+        resume: continue a streaming run from its last checkpoint instead of starting over
+        checkpoint_every: number of output records between two checkpoints of a streaming run
+        num_shards: number of shards the rows are split in, every shard is a separate streaming run
+        shard_index: shard processed by this run, the shard outputs are merged with merge_shards
         """
         # get configuration
         if resource_directory is None:
@@ -55,6 +163,7 @@ class Evaluation:
             config = json.load(f)
         if input_file is None:
             input_file = config['input_file']
+        self.input_file = input_file
         if base_file is None:
             self.base_file = config['base_file']
         else:
@@ -71,134 +180,381 @@ class Evaluation:
             self.tokenizer = config['tokenizer']
         else:
             self.tokenizer = tokenizer
-
-        self.annotation_data = pd.read_json(path_or_buf=input_file)
-
-        try:
-            self.nlp = spacy.load("en_core_web_sm")
-        except OSError:
-            spacy.cli.download("en_core_web_sm")
-            self.nlp = spacy.load("en_core_web_sm")
-
-        # White space tokenizer should be used for the SkillSPAN dataset for consistency
-        if self.tokenizer == 'white_space':
-            self.nlp.tokenizer = WhitespaceTokenizer(self.nlp.vocab)
-
-    def find_errors_eval(self, input_list):
-        try:
-            eval(input_list)
-            return False
-        except SyntaxError:
-            return True
-
-    def find_best_match(self, sentence, subphrase, subphrase_with_context):
-        try:
-            # Compile the regular expression pattern
-            pattern = re.compile(r'\b' + re.escape(subphrase) + r'\b', re.IGNORECASE)
-
-            # Find all matches of the subphrase in the sentence
-            matches = [(match.start(), match.end()) for match in re.finditer(pattern, sentence)]
-            assert len(matches) > 0
-        except AssertionError:  # with some skill spans we need to do this instead
-            # Compile the regular expression pattern
-            pattern = re.compile(re.escape(subphrase), re.IGNORECASE)
-
-            # Find all matches of the subphrase in the sentence
-            matches = [(match.start(), match.end()) for match in re.finditer(pattern, sentence)]
-
-
-        if not matches:
-            return None, None, None
-
-        best_match = None
-        best_score = -1
-        best_start = 0
-        best_end = 0
-
-        # Iterate over each match
-        for start, end in matches:
-            # Calculate the context range
-            context_start = max(0, start - (len(subphrase_with_context) - len(subphrase)))
-            context_end = min(len(sentence), end + (len(subphrase_with_context) - len(subphrase)))
-
-            # Extract the context around the match
-            context = sentence[context_start:context_end]
-
-            # Perform fuzzy matching with the context
-            score = fuzz.ratio(context, subphrase_with_context)
-
-            # Update the best match if necessary
-            if score > best_score:
-                best_match = context
-                best_score = score
-                best_start = start
-                best_end = end
-
-        return best_match, best_start, best_end
+        if batch_size is None:
+            self.batch_size = config['batch_size']
+        else:
+            self.batch_size = batch_size
+        if n_process is None:
+            self.n_process = config['n_process']
+        else:
+            self.n_process = n_process
+        if streaming is None:
+            self.streaming = config['streaming']
+        else:
+            self.streaming = streaming
+        if resume is None:
+            self.resume = config['resume']
+        else:
+            self.resume = resume
+        if checkpoint_every is None:
+            self.checkpoint_every = config['checkpoint_every']
+        else:
+            self.checkpoint_every = checkpoint_every
+        if num_shards is None:
+            self.num_shards = config['num_shards']
+        else:
+            self.num_shards = num_shards
+        self.shard_index = shard_index
+        # resumed and sharded runs are streaming runs
+        self.streaming = self.streaming or self.resume or self.shard_index is not None
+
+        # the streaming mode never loads the whole input file
+        if not self.streaming:
+            import pandas as pd
+            self.annotation_data = pd.read_json(path_or_buf=input_file)
+
+        self.nlp = load_nlp(self.tokenizer)
+
+    @staticmethod
+    def report_parse_errors(category_counts):
+        errors = sum(category_counts.get(category, 0) for category in FAILED_CATEGORIES)
+        print(f'{errors} errors found.')
+        if category_counts.get(PARSE_REPAIRED, 0):
+            print(f'{category_counts[PARSE_REPAIRED]} truncated predictions repaired.')
+
+    @staticmethod
+    def find_best_match(sentence, subphrase, subphrase_with_context):
+        """
+        Find the occurrence of subphrase in sentence whose surrounding text best matches subphrase_with_context.
+        """
+        from span_locator import SpanLocator
+        return SpanLocator(sentence).locate([(subphrase, subphrase_with_context)])[0]
 
     def parse_label_and_context_list(self):
-        predictions = pd.read_json(self.prediction_file, lines=True)
-        base_data = pd.read_json(self.base_file, lines=True)[['text']]
+        if self.streaming:
+            self.stream_label_and_context_list()
+            return
+        import pandas as pd
+        from tqdm import tqdm
+        with timer('combine.read'):
+            predictions = pd.read_json(self.prediction_file, lines=True)
+            if is_columnar(self.base_file):
+                base_data = pd.DataFrame({'text': [record['text'] for record in read_records(self.base_file, ['text'])]})
+            else:
+                base_data = pd.read_json(self.base_file, lines=True)[['text']]
         self.annotation_data = pd.concat([self.annotation_data, predictions], axis=1)
         base_data = base_data.drop_duplicates(subset=['text'])
         # Remove the leading and trailing **'s
         self.annotation_data['text'] = self.annotation_data['input'].apply(lambda x: x[3:-3] if x is not None else None)
         self.annotation_data = self.annotation_data.merge(base_data, how='left', on=['text'])
-        self.annotation_data['predict_error'] = self.annotation_data['predict'].apply(self.find_errors_eval)
+        # parse every prediction once, the parsed object replaces the string after the error split
+        with timer('combine.parse_predictions'):
+            parsed_predictions, categories = zip(*self.annotation_data['predict'].apply(parse_prediction))
+        count('combine.rows', len(categories))
+        for category, n in collections.Counter(categories).items():
+            count(f'parse_prediction.{category}', n)
+        self.annotation_data['predict_error'] = [category in FAILED_CATEGORIES for category in categories]
+        self.annotation_data['predict_error_category'] = categories
+        # position of the row in the input and prediction files, repredict_failed_rows.py merges on it
+        self.annotation_data['row_id'] = range(len(self.annotation_data))
+        # only the rows that failed to parse, the literal and repaired ones are counted in the report
         error_data = self.annotation_data[self.annotation_data['predict_error']]
         error_data.to_csv(f'{os.path.dirname(self.output_file)}/error_data.csv', index=False)
-        print(f'{len(error_data)} errors found.')
-        self.annotation_data['predict'] = self.annotation_data.apply(lambda x: '[]' if x['predict_error'] else x['predict'], axis=1)
-        self.annotation_data['label'], self.annotation_data['predict'] = zip(
-            *self.annotation_data.apply(lambda x: [eval(x['label']), eval(x['predict'])], axis=1))
-        with open(self.output_file, mode='w') as f:
-            for i, row in tqdm(self.annotation_data.iterrows(), total=len(self.annotation_data)):
-                clean_text = row['text']
-                prediction = row['predict']
-
-                clean_doc = self.nlp(clean_text)
-
-                tokens = [{'id': token.i, 'start': token.idx, 'end': token.idx + len(token.text) - 1,
-                           'ws': token.whitespace_ == ' ', 'text': token.text} for token in clean_doc]
-
-                skill_spans = []
-                for skill_type in prediction:
-                    skill_list = prediction[skill_type]
-                    for skill in skill_list:
-                        skill_span = skill['skill_span']
-                        if 'context' in skill:
-                            context = skill['context']
-                        else:
-                            context = skill['skill_span']
-
-                        best_match, best_start, best_end = self.find_best_match(clean_text, skill_span, context)
-                        if best_match is not None:
-                            span = clean_doc.char_span(best_start, best_end)
-                            if span is not None:
-                                token_start = span[0].i
-                                token_end = span[-1].i
-                                skill_spans.append(
-                                    {'start': best_start, 'end': best_end-1, 'label': skill_type,
-                                     'token_start': token_start, 'token_end': token_end}
-                                )
-                            else:
-                                skill_spans.append(
-                                    {'start': best_start, 'end': best_end-1, 'label': skill_type}
-                                )
-
-                json_doc  = {'text': clean_text, 'tokens': tokens, 'spans': skill_spans}
-
-                json.dump(json_doc, f, ensure_ascii=False)
-                f.write('\n')
+        self.report_parse_errors(collections.Counter(categories))
+        self.annotation_data['predict'] = parsed_predictions
+        self.annotation_data['label'] = [label for label, _ in self.annotation_data['label'].apply(parse_prediction)]
+        rows = list(zip(self.annotation_data['text'], self.annotation_data['predict']))
+        write_records(tqdm(self.generate_json_docs(rows), total=len(rows)), self.output_file)
 
-if __name__ == "__main__":
-    parser = ArgumentParser()
+    def build_base_index(self):
+        """
+        Hash every unique text of the base file, only the digests are kept in memory.
+        """
+        base_index = set()
+        records = read_records(self.base_file, ['text']) if is_columnar(self.base_file) else iter_json_records(self.base_file)
+        for record in records:
+            base_index.add(hashlib.blake2b(record['text'].encode('utf-8'), digest_size=16).digest())
+        return base_index
+
+    def shard_paths(self, shard_index):
+        """
+        Output, error and checkpoint files of a shard, the final files when the rows are not sharded.
+        """
+        output_file, error_file = self.output_file, f'{os.path.dirname(self.output_file)}/error_data.csv'
+        if shard_index is not None:
+            output_root, output_extension = os.path.splitext(self.output_file)
+            output_file = f'{output_root}.part-{shard_index:05d}{output_extension}'
+            error_file = f'{os.path.dirname(self.output_file)}/error_data.part-{shard_index:05d}.csv'
+        return output_file, error_file, f'{output_file}.checkpoint.json'
+
+    def shard_rows(self):
+        """
+        Range of rows processed by this run, shards are contiguous so their outputs are merged by concatenation.
+        """
+        if self.shard_index is None:
+            return 0, None
+        n_rows = sum(1 for _ in iter_json_records(self.prediction_file))
+        return self.shard_index * n_rows // self.num_shards, (self.shard_index + 1) * n_rows // self.num_shards
+
+    @staticmethod
+    def write_checkpoint(checkpoint_file, checkpoint, files):
+        """
+        Flush the outputs to disk, then atomically replace the checkpoint with their new sizes.
+        """
+        for name, f in files.items():
+            f.flush()
+            os.fsync(f.fileno())
+            checkpoint[f'{name}_bytes'] = os.fstat(f.fileno()).st_size
+        with open(f'{checkpoint_file}.tmp', mode='w') as f:
+            json.dump(checkpoint, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f'{checkpoint_file}.tmp', checkpoint_file)
+
+    def stream_label_and_context_list(self):
+        """
+        Constant memory version of parse_label_and_context_list.
+
+        The prompt file and the prediction file are read in lockstep, every row is joined on its text with the base
+        file hash index and the processed predictions and errors are written as soon as the row is aligned.
+
+        Every checkpoint_every records the row count and the sizes of the outputs are checkpointed. A resumed run
+        truncates the outputs back to the last checkpoint and continues with the next row. With a shard_index only
+        that shard of the rows is processed, into processed_predictions.part-*.jsonl.
+        """
+        from tqdm import tqdm
+        output_file, error_file_name, checkpoint_file = self.shard_paths(self.shard_index)
+        if is_columnar(output_file) and (self.resume or self.shard_index is not None):
+            raise ValueError('Resumed and sharded runs write JSONL outputs')
+        start_row, end_row = self.shard_rows()
+        checkpoint = {'rows': 0, 'output_bytes': 0, 'error_bytes': 0, 'category_counts': {}, 'missing_base': 0,
+                      'complete': False}
+        if self.resume and os.path.exists(checkpoint_file):
+            with open(checkpoint_file) as f:
+                checkpoint = json.load(f)
+            if checkpoint['complete']:
+                print(f'{output_file} is already complete.')
+                return
+            # drop everything written after the last checkpoint
+            os.truncate(output_file, checkpoint['output_bytes'])
+            os.truncate(error_file_name, checkpoint['error_bytes'])
+            print(f'Resuming from row {start_row + checkpoint["rows"]}.')
+        mode = 'a' if checkpoint['rows'] > 0 else 'w'
+
+        base_index = self.build_base_index()
+        category_counts = collections.Counter(checkpoint['category_counts'])
+        # rows whose output record is not written yet, the error file and counts follow the output
+        pending_rows = collections.deque()
+
+        def generate_rows():
+            rows = itertools.zip_longest(timed(iter_json_records(self.input_file), 'combine.read'),
+                                         timed(iter_json_records(self.prediction_file), 'combine.read'))
+            first_row = start_row + checkpoint['rows']
+            for row_id, (input_entry, prediction_entry) in enumerate(itertools.islice(rows, first_row, end_row),
+                                                                      start=first_row):
+                if input_entry is None or prediction_entry is None:
+                    raise ValueError(f'{self.input_file} and {self.prediction_file} have a different number of rows')
+                row = {**input_entry, **prediction_entry}
+                # Remove the leading and trailing **'s
+                row['text'] = row['input'][3:-3]
+                with timer('combine.parse_predictions'):
+                    prediction, category = parse_prediction(row['predict'])
+                count('combine.rows')
+                count(f'parse_prediction.{category}')
+                row['predict_error'] = category in FAILED_CATEGORIES
+                row['predict_error_category'] = category
+                row['row_id'] = row_id
+                pending_rows.append(row)
+                yield row['text'], prediction
+
+        def generate_outputs(error_file):
+            # an error file resumed after its header was written only appends rows
+            error_writer = None
+            for json_doc in self.generate_json_docs(generate_rows()):
+                row = pending_rows.popleft()
+                if hashlib.blake2b(row['text'].encode('utf-8'), digest_size=16).digest() not in base_index:
+                    checkpoint['missing_base'] += 1
+                category_counts[row['predict_error_category']] += 1
+                if error_writer is None:
+                    error_writer = csv.DictWriter(error_file, fieldnames=list(row), lineterminator='\n')
+                    if checkpoint['error_bytes'] == 0:
+                        error_writer.writeheader()
+                if row['predict_error']:
+                    error_writer.writerow(row)
+                checkpoint['rows'] += 1
+                yield json_doc
+
+        with open(error_file_name, mode=mode, newline='') as error_file:
+            outputs = tqdm(generate_outputs(error_file), initial=checkpoint['rows'],
+                           total=end_row - start_row if end_row is not None else None)
+            if is_columnar(output_file):
+                write_records(outputs, output_file)
+            else:
+                with open(output_file, mode=mode) as f:
+                    for json_doc in outputs:
+                        with timer('combine.write'):
+                            json.dump(json_doc, f, ensure_ascii=False)
+                            f.write('\n')
+                        if checkpoint['rows'] % self.checkpoint_every == 0:
+                            checkpoint['category_counts'] = dict(category_counts)
+                            self.write_checkpoint(checkpoint_file, checkpoint, {'output': f, 'error': error_file})
+                    checkpoint['category_counts'] = dict(category_counts)
+                    checkpoint['complete'] = True
+                    self.write_checkpoint(checkpoint_file, checkpoint, {'output': f, 'error': error_file})
+        self.report_parse_errors(category_counts)
+        if checkpoint['missing_base']:
+            print(f'{checkpoint["missing_base"]} rows not found in {self.base_file}.')
+
+    def merge_shards(self):
+        """
+        Concatenate the outputs of the num_shards complete shards, in order, into the output and error files.
+        """
+        category_counts = collections.Counter()
+        missing_base = 0
+        shards = [self.shard_paths(shard_index) for shard_index in range(self.num_shards)]
+        for output_file, _, checkpoint_file in shards:
+            if not os.path.exists(checkpoint_file):
+                raise ValueError(f'{output_file} was not processed')
+            with open(checkpoint_file) as f:
+                checkpoint = json.load(f)
+            if not checkpoint['complete']:
+                raise ValueError(f'{output_file} is not complete')
+            category_counts.update(checkpoint['category_counts'])
+            missing_base += checkpoint['missing_base']
+
+        output_file, error_file_name, _ = self.shard_paths(None)
+        with open(output_file, mode='wb') as output, open(error_file_name, mode='wb') as errors:
+            header_written = False
+            for shard_output_file, shard_error_file, _ in shards:
+                with open(shard_output_file, mode='rb') as f:
+                    shutil.copyfileobj(f, output)
+                with open(shard_error_file, mode='rb') as f:
+                    header = f.readline()
+                    # every shard error file repeats the header, empty shards have none
+                    if header and not header_written:
+                        errors.write(header)
+                        header_written = True
+                    shutil.copyfileobj(f, errors)
+        self.report_parse_errors(category_counts)
+        if missing_base:
+            print(f'{missing_base} rows not found in {self.base_file}.')
+
+    def generate_json_docs(self, rows):
+        """
+        Yield the output record of every (clean_text, prediction) row, in input order. Rows can be any iterable,
+        at most 2 * n_process batches are read ahead of the output.
+
+        Without a batch size every row goes through the full pipeline one at a time. In batched mode only the
+        tokenizer runs, through nlp.pipe, and with n_process > 1 the batches are tokenized and aligned by a worker
+        pool. The tagger, parser and NER do not change token offsets so all modes produce the same records.
+        """
+        if self.batch_size is None:
+            for clean_text, prediction in rows:
+                with timer('combine.tokenize'):
+                    clean_doc = self.nlp(clean_text)
+                yield self.build_json_doc(clean_text, clean_doc, prediction)
+        elif self.n_process > 1:
+            rows = iter(rows)
+            batches = iter(lambda: list(itertools.islice(rows, self.batch_size)), [])
+            def collect(result):
+                json_docs, snapshot = result.get()
+                METRICS.merge(snapshot)
+                return json_docs
+
+            with multiprocessing.Pool(self.n_process, initializer=_init_worker, initargs=(self.tokenizer,)) as pool:
+                # a bounded window of pending batches, collected in submission order
+                pending = collections.deque()
+                for batch in batches:
+                    pending.append(pool.apply_async(_process_batch, (batch,)))
+                    if len(pending) >= 2 * self.n_process:
+                        yield from collect(pending.popleft())
+                while pending:
+                    yield from collect(pending.popleft())
+        else:
+            # as_tuples carries every row along with its doc without holding on to the rows
+            # the tokenize timer includes reading the rows the pipe pulls in
+            docs = timed(self.nlp.pipe(((row[0], row) for row in rows), batch_size=self.batch_size,
+                                       disable=self.nlp.pipe_names, as_tuples=True), 'combine.tokenize')
+            for clean_doc, (clean_text, prediction) in docs:
+                yield self.build_json_doc(clean_text, clean_doc, prediction)
+
+    @staticmethod
+    def build_json_doc(clean_text, clean_doc, prediction):
+        """
+        Align the predicted skill spans of one row with the tokens of its clean text.
+        """
+        from span_locator import SpanLocator
+        tokens = [{'id': token.i, 'start': token.idx, 'end': token.idx + len(token.text) - 1,
+                   'ws': token.whitespace_ == ' ', 'text': token.text} for token in clean_doc]
+
+        skill_types = []
+        skills = []
+        for skill_type in prediction:
+            skill_list = prediction[skill_type]
+            for skill in skill_list:
+                skill_span = skill['skill_span']
+                if 'context' in skill:
+                    context = skill['context']
+                else:
+                    context = skill['skill_span']
+                skill_types.append(skill_type)
+                skills.append((skill_span, context))
+
+        # One locator per sentence finds all predicted skill spans in a single pass
+        with timer('find_best_match'):
+            best_matches = SpanLocator(clean_text).locate(skills) if skills else []
+
+        skill_spans = []
+        for skill_type, (best_match, best_start, best_end) in zip(skill_types, best_matches):
+            if best_match is not None:
+                span = clean_doc.char_span(best_start, best_end)
+                if span is not None:
+                    token_start = span[0].i
+                    token_end = span[-1].i
+                    skill_spans.append(
+                        {'start': best_start, 'end': best_end-1, 'label': skill_type,
+                         'token_start': token_start, 'token_end': token_end}
+                    )
+                else:
+                    count('combine.char_span_misses')
+                    skill_spans.append(
+                        {'start': best_start, 'end': best_end-1, 'label': skill_type}
+                    )
+
+        return {'text': clean_text, 'tokens': tokens, 'spans': skill_spans}
+
+
+def build_parser(parser=None):
+    if parser is None:
+        parser = ArgumentParser()
     parser.add_argument("--resource_directory", required=False, default=None, type=str)
     parser.add_argument("--base_file", required=False, default=None, type=str)
     parser.add_argument("--input_file", required=False, default=None, type=str)
     parser.add_argument("--prediction_file", required=False, default=None, type=str)
     parser.add_argument("--output_file", required=False, default=None, type=str)
     parser.add_argument("--tokenizer", required=False, default=None, type=str)
-    args = parser.parse_args()
-    evaluator = Evaluation(args.resource_directory, args.base_file, args.input_file, args.prediction_file, args.output_file, args.tokenizer)
-    evaluator.parse_label_and_context_list()
\ No newline at end of file
+    parser.add_argument("--batch_size", required=False, default=None, type=int)
+    parser.add_argument("--n_process", required=False, default=None, type=int)
+    parser.add_argument("--streaming", required=False, default=None, action='store_true')
+    parser.add_argument("--resume", required=False, default=None, action='store_true')
+    parser.add_argument("--checkpoint_every", required=False, default=None, type=int)
+    parser.add_argument("--num_shards", required=False, default=None, type=int)
+    parser.add_argument("--shard_index", required=False, default=None, type=int)
+    parser.add_argument("--merge_shards", required=False, default=False, action='store_true')
+    add_arguments(parser)
+    return parser
+
+
+def main(args):
+    with instrument('combine', args.metrics_file, args.profile, args.profile_file):
+        evaluator = Evaluation(args.resource_directory, args.base_file, args.input_file, args.prediction_file, args.output_file, args.tokenizer,
+                               args.batch_size, args.n_process, args.streaming, args.resume, args.checkpoint_every,
+                               args.num_shards, args.shard_index)
+        if args.merge_shards:
+            evaluator.merge_shards()
+        else:
+            evaluator.parse_label_and_context_list()
+
+
+if __name__ == "__main__":
+    main(build_parser().parse_args())
@@ -0,0 +1,111 @@
+"""
+Parse the label and predict strings of LLaMA-Factory generated predictions without eval. \
+Date:
+    2026/10/18
+"""
+import ast
+
+import orjson
+
+# categories of parse_prediction, the predictions of the failed ones are replaced by an empty list
+PARSE_OK = 'ok'
+PARSE_LITERAL = 'literal'
+PARSE_REPAIRED = 'repaired'
+PARSE_SYNTAX_ERROR = 'syntax_error'
+PARSE_SCHEMA_ERROR = 'schema_error'
+FAILED_CATEGORIES = (PARSE_SYNTAX_ERROR, PARSE_SCHEMA_ERROR)
+
+
+def repair_truncated_json(text):
+    """
+    Cut a truncated JSON document back to its last complete element and close the open brackets.
+
+    Returns None when there is nothing to keep.
+    """
+    stack = []
+    in_string = False
+    escape = False
+    # (end of the kept text, brackets still open at that point)
+    cut = None
+    for i, char in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif char == '\\':
+                escape = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+        elif char in '{[':
+            stack.append(char)
+            cut = (i + 1, tuple(stack))
+        elif char in '}]':
+            if not stack:
+                return None
+            stack.pop()
+            cut = (i + 1, tuple(stack))
+        elif char == ',':
+            cut = (i, tuple(stack))
+    if cut is None:
+        return None
+    end, open_brackets = cut
+    candidate = text[:end] + ''.join('}' if bracket == '{' else ']' for bracket in reversed(open_brackets))
+    try:
+        return orjson.loads(candidate)
+    except orjson.JSONDecodeError:
+        return None
+
+
+def is_valid_prediction(prediction):
+    """
+    Check that a parsed prediction maps every label to a list of {"skill_span", "context"} entries, an empty list
+    stands for no prediction.
+    """
+    if prediction == []:
+        return True
+    if not isinstance(prediction, dict):
+        return False
+    for skill_list in prediction.values():
+        if not isinstance(skill_list, list):
+            return False
+        for skill in skill_list:
+            if not isinstance(skill, dict) or not isinstance(skill.get('skill_span'), str):
+                return False
+            if not isinstance(skill.get('context', ''), str):
+                return False
+    return True
+
+
+def parse_prediction(text):
+    """
+    Parse one generated prediction once.
+
+    The string is read as JSON first, then as a Python literal, which covers everything the former eval based
+    parsing accepted without executing it, and finally as truncated JSON.
+
+    Returns
+    -------
+    (prediction, category), prediction is an empty list when category is in FAILED_CATEGORIES
+    """
+    if not isinstance(text, str):
+        return [], PARSE_SYNTAX_ERROR
+    try:
+        prediction, category = orjson.loads(text), PARSE_OK
+    except orjson.JSONDecodeError:
+        try:
+            prediction, category = ast.literal_eval(text.strip()), PARSE_LITERAL
+        except (SyntaxError, ValueError, TypeError, MemoryError, RecursionError):
+            prediction = repair_truncated_json(text)
+            if prediction is None:
+                return [], PARSE_SYNTAX_ERROR
+            category = PARSE_REPAIRED
+            # the last entries of a truncated list can miss their skill_span
+            if isinstance(prediction, dict):
+                prediction = {label: [skill for skill in skill_list if isinstance(skill, dict) and 'skill_span' in skill]
+                              if isinstance(skill_list, list) else skill_list
+                              for label, skill_list in prediction.items()}
+    if not is_valid_prediction(prediction):
+        return [], PARSE_SCHEMA_ERROR
+    return prediction, category
@@ -0,0 +1,162 @@
+"""
+Predict again only the rows whose generated prediction could not be parsed, and merge them back by row id. \
+Date:
+    2026/10/18
+
+combine_prediction_results.py writes the rows it could not parse to error_data.csv with their row_id, the position
+of the row in the prompt and prediction files. select writes the prompts of those rows, as prepare_data.py built
+them, to a small dataset registered in dataset_info.json, merge puts the new predictions in place of the failed ones.
+Run combine_prediction_results.py again afterwards, its new error_data.csv holds the rows that still fail.
+
+With the greedy decoding of skill_span_evaluate.yaml the same prompt gives the same prediction, the repair
+predictions use train/config/skill_span_repair.yaml, which samples and allows longer outputs.
+
+Usage:
+    python repredict_failed_rows.py select --error_file results/error_data.csv --input_file data/test.json \
+        --output_file data/test_repair.json --dataset_info data/dataset_info.json --dataset_name skillspan_test_repair
+    (predict skillspan_test_repair)
+    python repredict_failed_rows.py merge --input_file data/test_repair.json \
+        --prediction_file results/generated_predictions.jsonl \
+        --repair_prediction_file results_repair/generated_predictions.jsonl \
+        --output_file results/generated_predictions.jsonl
+"""
+import csv
+import json
+import os
+import sys
+from argparse import ArgumentParser
+
+from prediction_parser import FAILED_CATEGORIES, parse_prediction
+
+# error_data.csv holds the whole prediction strings
+csv.field_size_limit(sys.maxsize)
+
+
+class PredictionRepair:
+    def __init__(self, resource_directory, categories=None) -> None:
+        """
+        Parameters
+        ----------
+        resource_directory: directory containing the config file
+        categories: parse_prediction categories of the rows predicted again, syntax_error and schema_error by default
+        """
+        # get configuration
+        if resource_directory is None:
+            resource_directory = os.path.dirname(__file__)
+
+        with open(os.path.join(resource_directory, 'config/repredict_failed_rows.json')) as f:
+            config = json.load(f)
+        if categories is None:
+            self.categories = config['categories']
+        else:
+            self.categories = categories
+
+    def select(self, error_file, input_file, output_file, dataset_info=None, dataset_name=None):
+        """
+        Write the prompts of the failed rows of error_file, taken from input_file with their row_id, to output_file.
+        The output file is registered as dataset_name in dataset_info when given.
+        """
+        row_ids = []
+        with open(error_file, newline='', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            if reader.fieldnames is not None and 'row_id' not in reader.fieldnames:
+                raise ValueError(f'{error_file} has no row_id column, run combine_prediction_results.py again')
+            error_inputs = {}
+            for error_row in reader:
+                if error_row['predict_error_category'] in self.categories:
+                    row_id = int(error_row['row_id'])
+                    row_ids.append(row_id)
+                    error_inputs[row_id] = error_row['input']
+        with open(input_file, encoding='utf-8') as f:
+            prompts = json.load(f)
+
+        repair_prompts = []
+        for row_id in row_ids:
+            if row_id >= len(prompts) or prompts[row_id]['input'] != error_inputs[row_id]:
+                raise ValueError(f'Row {row_id} of {error_file} is not row {row_id} of {input_file}')
+            prompt_entry = prompts[row_id]
+            # the other columns are dropped by LLaMA-Factory, row_id stays in the file for merge
+            repair_prompts.append({'row_id': row_id, 'instruction': prompt_entry['instruction'],
+                                   'input': prompt_entry['input'], 'output': prompt_entry['output']})
+
+        with open(output_file, 'w') as f:
+            f.write(json.dumps(repair_prompts, indent=2, ensure_ascii=False))
+        if dataset_info is not None and dataset_name is not None:
+            with open(dataset_info, encoding='utf-8') as f:
+                datasets = json.load(f)
+            datasets[dataset_name] = {
+                'file_name': os.path.relpath(output_file, os.path.dirname(dataset_info)),
+                'columns': {'prompt': 'instruction', 'query': 'input', 'response': 'output'},
+            }
+            with open(dataset_info, 'w', encoding='utf-8') as f:
+                json.dump(datasets, f, indent=4, ensure_ascii=False)
+
+        print(f'{len(prompts)} rows, {len(repair_prompts)} to predict again written to {output_file}.')
+
+    @staticmethod
+    def merge(input_file, prediction_file, repair_prediction_file, output_file):
+        """
+        Replace the predictions of the rows of the repair dataset input_file in prediction_file by the rows of
+        repair_prediction_file, in order. output_file can be prediction_file, it is replaced once complete.
+        """
+        with open(input_file, encoding='utf-8') as f:
+            row_ids = [prompt_entry['row_id'] for prompt_entry in json.load(f)]
+        with open(repair_prediction_file, encoding='utf-8') as f:
+            repair_predictions = [json.loads(line) for line in f if line.strip()]
+        if len(repair_predictions) != len(row_ids):
+            raise ValueError(f'{repair_prediction_file} has {len(repair_predictions)} rows, {len(row_ids)} expected')
+        repairs = dict(zip(row_ids, repair_predictions))
+
+        n_rows = 0
+        n_fixed = 0
+        with open(prediction_file, encoding='utf-8') as f, open(f'{output_file}.tmp', 'w', encoding='utf-8') as output:
+            for row_id, line in enumerate(f):
+                n_rows += 1
+                if row_id in repairs:
+                    record = json.loads(line)
+                    repair = repairs[row_id]
+                    # the same gold label tells the row was not shifted
+                    if 'label' in record and 'label' in repair and record['label'] != repair['label']:
+                        raise ValueError(f'The label of row {row_id} differs in {repair_prediction_file}')
+                    n_fixed += parse_prediction(repair['predict'])[1] not in FAILED_CATEGORIES
+                    line = json.dumps(repair, ensure_ascii=False) + '\n'
+                output.write(line)
+        if row_ids and max(row_ids) >= n_rows:
+            os.remove(f'{output_file}.tmp')
+            raise ValueError(f'{prediction_file} has {n_rows} rows, row {max(row_ids)} is out of range')
+        os.replace(f'{output_file}.tmp', output_file)
+        print(f'{len(row_ids)} predictions replaced in {output_file}, {n_fixed} parse now, '
+              f'{len(row_ids) - n_fixed} still fail.')
+
+
+def build_parser(parser=None):
+    if parser is None:
+        parser = ArgumentParser()
+    parser.add_argument("command", choices=['select', 'merge'])
+    parser.add_argument("--resource_directory", required=False, default=None, type=str)
+    parser.add_argument("--input_file", required=True, type=str,
+                        help="prompts of prepare_data.py for select, the repair dataset for merge")
+    parser.add_argument("--output_file", required=True, type=str)
+    parser.add_argument("--error_file", required=False, default=None, type=str)
+    parser.add_argument("--prediction_file", required=False, default=None, type=str)
+    parser.add_argument("--repair_prediction_file", required=False, default=None, type=str)
+    parser.add_argument("--dataset_info", required=False, default=None, type=str)
+    parser.add_argument("--dataset_name", required=False, default=None, type=str)
+    parser.add_argument("--categories", required=False, default=None, type=str)
+    return parser
+
+
+def main(args):
+    repair = PredictionRepair(args.resource_directory, json.loads(args.categories) if args.categories else None)
+    if args.command == 'select':
+        if args.error_file is None:
+            raise ValueError('select needs --error_file')
+        repair.select(args.error_file, args.input_file, args.output_file, args.dataset_info, args.dataset_name)
+    else:
+        if args.prediction_file is None or args.repair_prediction_file is None:
+            raise ValueError('merge needs --prediction_file and --repair_prediction_file')
+        repair.merge(args.input_file, args.prediction_file, args.repair_prediction_file, args.output_file)
+
+
+if __name__ == "__main__":
+    main(build_parser().parse_args())
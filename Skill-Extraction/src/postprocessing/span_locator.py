@@ -0,0 +1,169 @@
+"""
+Locate predicted skill spans in a sentence with a single multi-pattern pass. \
+Date:
+    2026/10/18
+"""
+import os
+import re
+import sys
+
+import ahocorasick
+import numpy as np
+from rapidfuzz import process
+from rapidfuzz.distance import Indel
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import count
+
+
+def is_word_char(char):
+    return char.isalnum() or char == '_'
+
+
+def regex_matches(sentence, subphrase):
+    """
+    Find the matches of a subphrase with the word boundary regex, falling back to a plain case insensitive search.
+    """
+    # Compile the regular expression pattern
+    pattern = re.compile(r'\b' + re.escape(subphrase) + r'\b', re.IGNORECASE)
+
+    # Find all matches of the subphrase in the sentence
+    matches = [(match.start(), match.end()) for match in re.finditer(pattern, sentence)]
+    if not matches:  # with some skill spans we need to do this instead
+        count('span_locator.regex_fallbacks')
+        pattern = re.compile(re.escape(subphrase), re.IGNORECASE)
+        matches = [(match.start(), match.end()) for match in re.finditer(pattern, sentence)]
+    return matches
+
+
+def fuzz_ratio_scores(contexts, subphrases_with_context):
+    """
+    Score context pairs exactly like fuzzywuzzy's fuzz.ratio, in one batched rapidfuzz call.
+    """
+    similarity = process.cpdist(contexts, subphrases_with_context, scorer=Indel.normalized_similarity, dtype=np.float64)
+    # fuzz.ratio rounds 100 * ratio half to even, gives 100 to equal strings and 0 when one of them is empty
+    scores = np.rint(100 * similarity).astype(np.int64)
+    for i, (context, subphrase_with_context) in enumerate(zip(contexts, subphrases_with_context)):
+        if context == subphrase_with_context:
+            scores[i] = 100
+        elif len(context) == 0 or len(subphrase_with_context) == 0:
+            scores[i] = 0
+    return scores
+
+
+class SpanLocator:
+    def __init__(self, sentence) -> None:
+        """
+        Find every predicted skill span of one sentence in a single Aho-Corasick pass over the lower cased sentence.
+
+        The automaton is only used on ASCII text, where lower casing matches re.IGNORECASE character for character.
+        Other sentences and spans go through the original regex search so the offsets never change.
+
+        Parameters
+        ----------
+        sentence: clean text the skill spans are searched in
+        """
+        self.sentence = sentence
+        self.lowered_sentence = sentence.lower()
+        self.use_automaton = sentence.isascii()
+
+    def occurrences(self, patterns):
+        """
+        Return the start offsets of all, possibly overlapping, occurrences of each lower cased pattern.
+        """
+        starts = {pattern: [] for pattern in patterns}
+        if not starts:
+            return starts
+        automaton = ahocorasick.Automaton()
+        for pattern in starts:
+            automaton.add_word(pattern, pattern)
+        automaton.make_automaton()
+        # matches come out ordered by end offset, so the starts of one pattern are sorted
+        for end_index, pattern in automaton.iter(self.lowered_sentence):
+            starts[pattern].append(end_index - len(pattern) + 1)
+        return starts
+
+    def is_boundary(self, position):
+        left = position > 0 and is_word_char(self.sentence[position - 1])
+        right = position < len(self.sentence) and is_word_char(self.sentence[position])
+        return left != right
+
+    def select_matches(self, starts, length, word_boundary):
+        """
+        Keep the leftmost non overlapping occurrences, the same ones re.finditer returns.
+        """
+        matches = []
+        position = 0
+        for start in starts:
+            end = start + length
+            if start < position:
+                continue
+            if word_boundary and not (self.is_boundary(start) and self.is_boundary(end)):
+                continue
+            matches.append((start, end))
+            position = end
+        return matches
+
+    def find_matches(self, subphrases):
+        """
+        Return the candidate (start, end) matches of every subphrase.
+        """
+        def uses_automaton(subphrase):
+            return self.use_automaton and subphrase.isascii() and len(subphrase) > 0
+
+        starts = self.occurrences({subphrase.lower() for subphrase in subphrases if uses_automaton(subphrase)})
+        matches = []
+        for subphrase in subphrases:
+            if not uses_automaton(subphrase):
+                count('span_locator.regex_searches')
+                matches.append(regex_matches(self.sentence, subphrase))
+                continue
+            pattern_starts = starts[subphrase.lower()]
+            subphrase_matches = self.select_matches(pattern_starts, len(subphrase), word_boundary=True)
+            if not subphrase_matches:
+                count('span_locator.regex_fallbacks')
+                subphrase_matches = self.select_matches(pattern_starts, len(subphrase), word_boundary=False)
+            matches.append(subphrase_matches)
+        return matches
+
+    def locate(self, skills):
+        """
+        Find the best match of every (subphrase, subphrase_with_context) pair.
+
+        Every candidate match is scored by the fuzzy ratio between the text around it and the predicted context,
+        and the first candidate with the highest score wins.
+
+        Returns
+        -------
+        list of (best_match, best_start, best_end) tuples, (None, None, None) when the subphrase is not found
+        """
+        count('find_best_match.calls', len(skills))
+        matches = self.find_matches([subphrase for subphrase, _ in skills])
+
+        contexts = []
+        subphrases_with_context = []
+        for (subphrase, subphrase_with_context), subphrase_matches in zip(skills, matches):
+            # Calculate the context range
+            padding = len(subphrase_with_context) - len(subphrase)
+            for start, end in subphrase_matches:
+                context_start = max(0, start - padding)
+                context_end = min(len(self.sentence), end + padding)
+                contexts.append(self.sentence[context_start:context_end])
+                subphrases_with_context.append(subphrase_with_context)
+        if not contexts:
+            count('find_best_match.not_found', len(skills))
+            return [(None, None, None)] * len(skills)
+        scores = fuzz_ratio_scores(contexts, subphrases_with_context)
+
+        results = []
+        offset = 0
+        for subphrase_matches in matches:
+            if not subphrase_matches:
+                count('find_best_match.not_found')
+                results.append((None, None, None))
+                continue
+            best = int(np.argmax(scores[offset:offset + len(subphrase_matches)]))
+            best_start, best_end = subphrase_matches[best]
+            results.append((contexts[offset + best], best_start, best_end))
+            offset += len(subphrase_matches)
+        return results
@@ -0,0 +1,236 @@
+"""
+Concurrent prediction client for an OpenAI compatible server, such as llamafactory-cli api with the LoRA adapter. \
+Date:
+    2026/10/18
+
+Prompts in the prepare_data.py output format are sent with bounded concurrency, retried with exponential backoff
+and written to {output_file}.partial as they complete, out of order with the row id. A restarted run skips the ids
+already there. Once every row is predicted, output_file is written in row order in the generated_predictions.jsonl
+format of combine_prediction_results.py.
+
+The chat api, e.g. llamafactory-cli api, applies the chat template of the model on the server. The completions api,
+e.g. vllm serve with the LoRA adapter, takes raw text: the prompts are formatted with the llama3 template the adapter
+was trained with by LLaMA-Factory, so the generations match the do_predict ones.
+
+stub_completion_server.py check runs the client against a local stub server failing and delaying its answers.
+
+Usage:
+    python prediction_client.py --input_file data/test.json --output_file results/generated_predictions.jsonl \
+        --base_url http://localhost:8000/v1 --model skill-extraction
+"""
+import asyncio
+import json
+import os
+import random
+import time
+from argparse import ArgumentParser
+
+import aiohttp
+import numpy as np
+
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+# LLaMA-Factory's llama3 template without a system turn, the server adds <|begin_of_text|> when tokenizing
+LLAMA3_TEMPLATE = ('<|start_header_id|>user<|end_header_id|>\n\n{content}<|eot_id|>'
+                   '<|start_header_id|>assistant<|end_header_id|>\n\n')
+LLAMA3_STOP = ['<|eot_id|>']
+
+
+def read_prompts(input_file):
+    with open(input_file, encoding='utf-8') as f:
+        if input_file.endswith('.jsonl'):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+
+def build_content(prompt_entry):
+    # same as LLaMA-Factory's alpaca format, the instruction and the input on separate lines
+    return f"{prompt_entry['instruction']}\n{prompt_entry['input']}"
+
+
+def read_completed_ids(partial_file):
+    completed = set()
+    if os.path.exists(partial_file):
+        with open(partial_file, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    completed.add(json.loads(line)['id'])
+                except (json.JSONDecodeError, KeyError):
+                    # a line cut by a crash, the row is predicted again
+                    continue
+    return completed
+
+
+def latency_summary(latencies):
+    if not latencies:
+        return 'no requests'
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    return f'latency p50 {p50:.2f}s, p90 {p90:.2f}s, p99 {p99:.2f}s'
+
+
+class PredictionClient:
+    def __init__(self, base_url, model, api='chat', api_key=None, concurrency=16, max_retries=5, backoff=1.0,
+                 timeout=600, max_tokens=1000, temperature=0.01, top_p=0.95) -> None:
+        """
+        Parameters
+        ----------
+        base_url: base url of the OpenAI compatible api, e.g. http://localhost:8000/v1
+        model: model name sent with every request
+        api: chat for /chat/completions, completions for /completions
+        api_key: bearer token, OPENAI_API_KEY by default
+        concurrency: number of requests in flight
+        max_retries: retries of a request failing with a connection error, a timeout or a retryable status
+        backoff: base delay in seconds, doubled at every retry and jittered
+        timeout: timeout of one request in seconds
+        max_tokens, temperature, top_p: generation parameters, the defaults are the ones of skill_span_evaluate.yaml
+        """
+        self.url = base_url.rstrip('/') + ('/chat/completions' if api == 'chat' else '/completions')
+        self.model = model
+        self.api = api
+        self.api_key = api_key if api_key is not None else os.environ.get('OPENAI_API_KEY', '0')
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.generation = {'max_tokens': max_tokens, 'temperature': temperature, 'top_p': top_p}
+        self.latencies = []
+
+    def build_payload(self, content):
+        """
+        Request of one prompt, or of a list of prompts for the completions api.
+        """
+        if self.api == 'chat':
+            return {'model': self.model, 'messages': [{'role': 'user', 'content': content}], **self.generation}
+        if isinstance(content, str):
+            prompt = LLAMA3_TEMPLATE.format(content=content)
+        else:
+            prompt = [LLAMA3_TEMPLATE.format(content=item) for item in content]
+        return {'model': self.model, 'prompt': prompt, 'stop': LLAMA3_STOP, **self.generation}
+
+    def parse_response(self, response):
+        choice = response['choices'][0]
+        return choice['message']['content'] if self.api == 'chat' else choice['text']
+
+    async def post(self, session, payload):
+        """
+        Send one request, retrying transient failures. Returns the decoded response.
+        """
+        for attempt in range(self.max_retries + 1):
+            start_time = time.perf_counter()
+            try:
+                async with session.post(self.url, json=payload) as response:
+                    if response.status in RETRY_STATUSES and attempt < self.max_retries:
+                        raise aiohttp.ClientResponseError(response.request_info, response.history,
+                                                          status=response.status)
+                    response.raise_for_status()
+                    result = await response.json()
+                self.latencies.append(time.perf_counter() - start_time)
+                return result
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                retryable = not isinstance(error, aiohttp.ClientResponseError) or error.status in RETRY_STATUSES
+                if not retryable or attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    async def predict(self, session, content):
+        """
+        Send one prompt, retrying transient failures. Returns the generated text.
+        """
+        return self.parse_response(await self.post(session, self.build_payload(content)))
+
+    async def predict_many(self, session, contents):
+        """
+        Generate the texts of several prompts, in their order. The completions api takes them in one request, the
+        chat api gets one concurrent request per prompt.
+        """
+        if self.api == 'chat':
+            return await asyncio.gather(*(self.predict(session, content) for content in contents))
+        response = await self.post(session, self.build_payload(list(contents)))
+        # one choice per prompt, the index tells which
+        return [choice['text'] for choice in sorted(response['choices'], key=lambda choice: choice['index'])]
+
+    async def run(self, prompts, partial_file, log_every=100):
+        """
+        Predict every prompt whose id is not in partial_file yet, appending the results as they complete.
+        """
+        completed = read_completed_ids(partial_file)
+        queue = asyncio.Queue(maxsize=2 * self.concurrency)
+        n_done = 0
+        start_time = time.perf_counter()
+
+        async def produce():
+            for row_id, prompt_entry in enumerate(prompts):
+                if row_id not in completed:
+                    await queue.put((row_id, prompt_entry))
+            for _ in range(self.concurrency):
+                await queue.put(None)
+
+        async def work(session, f):
+            nonlocal n_done
+            while (item := await queue.get()) is not None:
+                row_id, prompt_entry = item
+                content = build_content(prompt_entry)
+                predict = await self.predict(session, content)
+                f.write(json.dumps({'id': row_id, 'prompt': content, 'label': prompt_entry.get('output', ''),
+                                    'predict': predict}, ensure_ascii=False) + '\n')
+                f.flush()
+                n_done += 1
+                if n_done % log_every == 0:
+                    elapsed = time.perf_counter() - start_time
+                    print(f'{n_done} predictions, {n_done / elapsed:.2f} rows/sec, {latency_summary(self.latencies)}')
+
+        print(f'{len(completed)} rows already predicted, {len(prompts) - len(completed)} to go.')
+        headers = {'Authorization': f'Bearer {self.api_key}'}
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        with open(partial_file, 'a', encoding='utf-8') as f:
+            async with aiohttp.ClientSession(headers=headers, timeout=timeout, connector=connector) as session:
+                await asyncio.gather(produce(), *(work(session, f) for _ in range(self.concurrency)))
+        elapsed = time.perf_counter() - start_time
+        print(f'{n_done} predictions in {elapsed:.2f}s, {n_done / max(elapsed, 1e-9):.2f} rows/sec, '
+              f'{latency_summary(self.latencies)}')
+
+
+def write_ordered(partial_file, output_file, n_rows):
+    """
+    Write the predictions of partial_file in row order, without their ids.
+    """
+    predictions = {}
+    with open(partial_file, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            predictions[record.pop('id')] = record
+    missing = n_rows - len(predictions)
+    if missing:
+        raise ValueError(f'{missing} rows are not predicted yet, run the client again to complete {partial_file}')
+    with open(output_file, 'w', encoding='utf-8') as f:
+        for row_id in range(n_rows):
+            f.write(json.dumps(predictions[row_id], ensure_ascii=False) + '\n')
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--input_file", required=True, type=str)
+    parser.add_argument("--output_file", required=True, type=str)
+    parser.add_argument("--base_url", required=False, default='http://localhost:8000/v1', type=str)
+    parser.add_argument("--model", required=False, default='skill-extraction', type=str)
+    parser.add_argument("--api", required=False, default='chat', choices=['chat', 'completions'], type=str)
+    parser.add_argument("--api_key", required=False, default=None, type=str)
+    parser.add_argument("--concurrency", required=False, default=16, type=int)
+    parser.add_argument("--max_retries", required=False, default=5, type=int)
+    parser.add_argument("--backoff", required=False, default=1.0, type=float)
+    parser.add_argument("--timeout", required=False, default=600, type=float)
+    parser.add_argument("--max_tokens", required=False, default=1000, type=int)
+    parser.add_argument("--temperature", required=False, default=0.01, type=float)
+    parser.add_argument("--top_p", required=False, default=0.95, type=float)
+    parser.add_argument("--log_every", required=False, default=100, type=int)
+    args = parser.parse_args()
+
+    prompts = read_prompts(args.input_file)
+    client = PredictionClient(args.base_url, args.model, args.api, args.api_key, args.concurrency, args.max_retries,
+                              args.backoff, args.timeout, args.max_tokens, args.temperature, args.top_p)
+    partial_file = f'{args.output_file}.partial'
+    asyncio.run(client.run(prompts, partial_file, args.log_every))
+    write_ordered(partial_file, args.output_file, len(prompts))
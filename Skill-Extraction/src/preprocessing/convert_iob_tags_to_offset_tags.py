@@ -6,26 +6,90 @@ Date:
     2023/02/20
 """
 import os
+import sys
 
 from argparse import ArgumentParser
-import itertools
 
 import html
-import pandas as pd
-from tqdm import tqdm
 import json
 
-import spacy
-from spacy.training import biluo_tags_to_spans, iob_to_biluo
-from spacy.tokens import Doc
-
-from datasets import load_dataset
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import add_arguments, count, instrument, timer
+from span_table import write_records
 
 DEFAULT_SAVE_UNTAGGED = False
 
 
+def iob_tags_to_token_spans(tags):
+    """
+    Convert the IOB tags of one label to (token_start, token_end) pairs, the same entities spaCy's iob_to_biluo and
+    biluo_tags_to_spans produce: an entity starts at a B tag or at an I tag following an O tag and runs over the
+    following I tags.
+    """
+    token_spans = []
+    start = None
+    for i, tag in enumerate(tags):
+        if tag == 'O':
+            if start is not None:
+                token_spans.append((start, i - 1))
+                start = None
+        elif start is None or not tag.startswith('I'):
+            if start is not None:
+                token_spans.append((start, i - 1))
+            start = i
+    if start is not None:
+        token_spans.append((start, len(tags) - 1))
+    return token_spans
+
+
+def convert_iob_batch(batch, labels):
+    """
+    Convert a batch of IOB tagged examples to serialized offset tagged json lines.
+
+    Tokens are joined by single spaces, so the character offsets come from a running sum of the token lengths.
+    The span count and the examples dropping their spans are returned along, for the metrics of map workers.
+    """
+    json_lines = []
+    n_spans = []
+    span_overruns = []
+    for index, tokens in enumerate(batch['tokens']):
+        json_tokens = []
+        starts = []
+        ends = []
+        position = 0
+        for i, word in enumerate(tokens):
+            starts.append(position)
+            ends.append(position + len(word))
+            json_tokens.append({'id': i, 'start': position, 'end': position + len(word) - 1,
+                                'ws': i < len(tokens) - 1, 'text': word})
+            position += len(word) + 1
+
+        json_spans = []
+        span_overrun = False
+        for label in labels:
+            for token_start, token_end in iob_tags_to_token_spans(batch[f'tags_{label.lower()}'][index]):
+                # tags running past the tokens make spaCy raise an IndexError, the example is then kept without spans
+                if token_end >= len(tokens):
+                    span_overrun = True
+                    json_spans = None
+                    break
+                json_spans.append({'start': starts[token_start], 'end': ends[token_end] - 1, 'label': label,
+                                   'token_start': token_start, 'token_end': token_end})
+            if json_spans is None:
+                json_spans = []
+                break
+        n_spans.append(len(json_spans))
+        span_overruns.append(span_overrun)
+
+        text = html.unescape(' '.join(tokens).strip())
+
+        prodigy_element = {'text': text, 'tokens': json_tokens, 'spans': json_spans}
+        json_lines.append(json.dumps(prodigy_element, ensure_ascii=False))
+    return {'json_line': json_lines, 'n_spans': n_spans, 'span_overrun': span_overruns}
+
+
 class data_post_processing:
-    def __init__(self, resource_directory, output_directory, dataset_name) -> None:
+    def __init__(self, resource_directory, output_directory, dataset_name, num_proc=None, output_format=None) -> None:
         """
         The data post processing class takes in input of tagging file, and post processes data of different format for NER.
 
@@ -34,6 +98,8 @@ class data_post_processing:
         resource_directory: directory containing the config file
         output_directory: directory to save the output files
         dataset_name: name of the dataset
+        num_proc: number of processes used to convert each split
+        output_format: jsonl, or parquet/arrow for the columnar format of span_table
         """
         # get configuration
         if resource_directory is None:
@@ -47,68 +113,66 @@ class data_post_processing:
             self.output_directory = output_directory
         if dataset_name is None:
             dataset_name = config['dataset']
-        self.dataset = load_dataset(dataset_name)
-
-        try:
-            self.nlp = spacy.load("en_core_web_sm")
-        except OSError:
-            spacy.cli.download("en_core_web_sm")
-            self.nlp = spacy.load("en_core_web_sm")
+        if num_proc is None:
+            self.num_proc = config['num_proc']
+        else:
+            self.num_proc = num_proc
+        if output_format is None:
+            self.output_format = config['output_format']
+        else:
+            self.output_format = output_format
+        with timer('convert.load_dataset'):
+            # datasets takes seconds to import, only the conversion needs it
+            from datasets import load_dataset
+            self.dataset = load_dataset(dataset_name)
 
-    def convert_iob_tags_to_jsonl(self):
-        
+    def convert_iob_tags_to_jsonl(self, batch_size=1000):
+        """
+        Convert every split of the dataset to {split}.jsonl, or {split}.parquet/.arrow, one buffered writer per split.
+        """
         for data_split in self.dataset.keys():
-            
-            with open(os.path.join(self.output_directory, f'{data_split}.jsonl'), 'w') as f:
-                annotation_data = self.dataset[data_split].to_pandas()
-                labels = [column.split('_')[-1].upper() for column in annotation_data.columns if 'tags_' in column]
-                for index in range(annotation_data.shape[0]):
-                    data_entry = annotation_data.iloc[index]
-                    tokens = data_entry.tokens
-                    tags = {label: [tag if tag == 'O' else f'{tag}-{label}' for tag in data_entry[f'tags_{label.lower()}']] for label in labels}
-
-                    doc = Doc(self.nlp.vocab, words=tokens)
-                    json_doc = doc.to_json()
-                    text = json_doc['text'].strip()
-                    json_tokens = json_doc['tokens']
-
-                    for i, (word, token) in enumerate(zip(tokens, json_tokens)):
-                        if i < len(tokens) - 1:
-                            token['ws'] = True
-                        else:
-                            token['ws'] = False
-                        token['text'] = word
-                        token['end'] = token['end'] - 1
-
-                    biluo_tags = {label: iob_to_biluo(individual_tags) for label, individual_tags in tags.items()}
-                    # mismatch can sometimes cause this part to crash (Some cases will still work mostly correctly so
-                    # instead of a check we will just use a try except clause)
-                    try:
-                        spans = list(itertools.chain.from_iterable([biluo_tags_to_spans(doc, individual_tags) for individual_tags in biluo_tags.values()]))
-
-                        json_spans = []
-                        for span in spans:
-                            json_spans.append({'start': span.start_char, 'end': span.end_char-1, 'label': span.label_,
-                                               'token_start': span.start, 'token_end': span.end-1})
-                    except IndexError:
-                        json_spans = []
-
-                    text = html.unescape(text)
-
-                    prodigy_element = {'text': text, 'tokens': json_tokens, 'spans': json_spans}
-                    
-                    for split in ['train', 'validation', 'test']:
-                        with open(os.path.join(self.output_directory, f"{split}.jsonl"), "w", encoding="utf-8") as f:
-                            json.dump(prodigy_element, f, ensure_ascii=False)
-                            f.write('\n')
-
-
-if __name__ == "__main__":
-    parser = ArgumentParser()
+            split_data = self.dataset[data_split]
+            labels = [column.split('_')[-1].upper() for column in split_data.column_names if 'tags_' in column]
+            with timer('convert.map'):
+                json_lines = split_data.map(convert_iob_batch, fn_kwargs={'labels': labels}, batched=True,
+                                            batch_size=batch_size, num_proc=self.num_proc,
+                                            remove_columns=split_data.column_names)
+            count('convert.examples', len(json_lines))
+            count('convert.spans', sum(json_lines['n_spans']))
+            count('convert.span_overruns', sum(json_lines['span_overrun']))
+
+            with timer('convert.write'):
+                if self.output_format != 'jsonl':
+                    records = (json.loads(json_line) for batch in json_lines.iter(batch_size=batch_size)
+                               for json_line in batch['json_line'])
+                    write_records(records, os.path.join(self.output_directory, f'{data_split}.{self.output_format}'),
+                                  batch_size=batch_size)
+                    continue
+                with open(os.path.join(self.output_directory, f'{data_split}.jsonl'), 'w', encoding='utf-8',
+                          buffering=1 << 20) as f:
+                    for batch in json_lines.iter(batch_size=batch_size):
+                        f.write('\n'.join(batch['json_line']))
+                        f.write('\n')
+
+
+def build_parser(parser=None):
+    if parser is None:
+        parser = ArgumentParser()
     parser.add_argument("--resource_directory", required=False, default=None, type=str)
     parser.add_argument("--output_directory", required=False, default=None, type=str)
     parser.add_argument("--dataset", required=False, default=None, type=str)
-    args = parser.parse_args()
+    parser.add_argument("--num_proc", required=False, default=None, type=int)
+    parser.add_argument("--output_format", required=False, default=None, choices=['jsonl', 'parquet', 'arrow'], type=str)
+    add_arguments(parser)
+    return parser
+
 
-    post_processer = data_post_processing(args.resource_directory, args.output_directory, args.dataset)
-    post_processer.convert_iob_tags_to_jsonl()
\ No newline at end of file
+def main(args):
+    with instrument('convert', args.metrics_file, args.profile, args.profile_file):
+        post_processer = data_post_processing(args.resource_directory, args.output_directory, args.dataset, args.num_proc,
+                                              args.output_format)
+        post_processer.convert_iob_tags_to_jsonl()
+
+
+if __name__ == "__main__":
+    main(build_parser().parse_args())
@@ -0,0 +1,265 @@
+"""
+Deduplicate the prepared prompts before prediction and expand the predictions back to every row. \
+Date:
+    2026/10/18
+
+Usage:
+    python deduplicate_prompts.py deduplicate --input_file data/test.json --output_file data/test_unique.json \
+        --index_file data/test_unique_index.json --dataset_name skillspan_test_unique
+    (predict skillspan_test_unique)
+    python deduplicate_prompts.py expand --input_file data/test.json --index_file data/test_unique_index.json \
+        --prediction_file results/generated_predictions.jsonl --output_file results/generated_predictions_all.jsonl
+
+The memo is keyed on the contents of the adapter, not on its directory: training again into the same directory
+gives new keys, so the predictions of the previous adapter are never served for the new one.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from argparse import ArgumentParser
+
+WHITESPACE = re.compile(r'\s+')
+# files of a LoRA adapter written by LLaMA-Factory, adapter_config.json names the base model
+ADAPTER_FILES = ['adapter_config.json', 'adapter_model.safetensors', 'adapter_model.bin']
+
+
+def normalize_input(text):
+    """
+    Unicode composition and runs of whitespace are normalized, so inputs differing only by them share the prediction
+    of the first one. They are tokenized differently and the model could predict differently for them, the cost of
+    predicting each boilerplate line once.
+    """
+    return WHITESPACE.sub(' ', unicodedata.normalize('NFC', text)).strip()
+
+
+def model_fingerprint(model_path):
+    """
+    Hash of the adapter files of model_path. A path that is not a local directory, e.g. a hub model name, is its own
+    fingerprint.
+    """
+    if not os.path.isdir(model_path):
+        return model_path
+    files = [file for file in ADAPTER_FILES if os.path.isfile(os.path.join(model_path, file))]
+    if not files:
+        raise ValueError(f'{model_path} has none of the adapter files {ADAPTER_FILES}')
+    digest = hashlib.blake2b(digest_size=16)
+    for file in files:
+        digest.update(file.encode('utf-8'))
+        with open(os.path.join(model_path, file), 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def prompt_key(prompt_entry, fingerprint):
+    """
+    Hash of the input of one prompt and of the model fingerprint. The instruction is left out: prepare_data.py picks
+    one of two paraphrases of it at random, and keeping it would predict the same line once per paraphrase.
+    """
+    key = json.dumps([fingerprint, normalize_input(prompt_entry['input'])], ensure_ascii=False)
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class PredictionMemo:
+    def __init__(self, memo_file, max_bytes) -> None:
+        """
+        Predictions of previously seen prompts, kept in SQLite and evicted least recently used first.
+
+        Parameters
+        ----------
+        memo_file: SQLite database file
+        max_bytes: total size of the stored prediction records above which the oldest ones are evicted
+        """
+        self.max_bytes = max_bytes
+        self.connection = sqlite3.connect(memo_file)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS memo (key TEXT PRIMARY KEY, record TEXT, size INTEGER, last_used INTEGER)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS memo_last_used ON memo (last_used)')
+
+    def get_many(self, keys):
+        """
+        Return {key: prediction record} for the keys found, and mark them as used.
+        """
+        records = {}
+        keys = list(keys)
+        # stay under SQLite's limit of variables per statement
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            for key, record in self.connection.execute(
+                    f'SELECT key, record FROM memo WHERE key IN ({placeholders})', chunk):
+                records[key] = json.loads(record)
+            self.connection.execute(f'UPDATE memo SET last_used = ? WHERE key IN ({placeholders})',
+                                    [time.time_ns()] + chunk)
+        self.connection.commit()
+        return records
+
+    def put_many(self, records):
+        """
+        Store {key: prediction record}, then evict the least recently used records above max_bytes.
+        """
+        now = time.time_ns()
+        rows = []
+        for key, record in records.items():
+            record = json.dumps(record, ensure_ascii=False)
+            rows.append((key, record, len(record.encode('utf-8')), now))
+        self.connection.executemany('INSERT OR REPLACE INTO memo VALUES (?, ?, ?, ?)', rows)
+        total_bytes = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM memo').fetchone()[0]
+        n_evicted = 0
+        if total_bytes > self.max_bytes:
+            cursor = self.connection.execute('SELECT key, size FROM memo ORDER BY last_used, key')
+            evicted = []
+            for key, size in cursor:
+                if total_bytes <= self.max_bytes:
+                    break
+                evicted.append((key,))
+                total_bytes -= size
+            self.connection.executemany('DELETE FROM memo WHERE key = ?', evicted)
+            n_evicted = len(evicted)
+        self.connection.commit()
+        return n_evicted
+
+    def close(self):
+        self.connection.close()
+
+
+class prompt_deduplication:
+    def __init__(self, resource_directory, memo_file, max_memo_bytes, model_path) -> None:
+        """
+        Send every distinct prompt to the model once, and the prompts already predicted not at all.
+
+        Parameters
+        ----------
+        resource_directory: directory containing the config file
+        memo_file: SQLite file of the prediction memo
+        max_memo_bytes: size bound of the prediction memo
+        model_path: adapter directory making the predictions, the memo only serves the same adapter contents
+        """
+        # get configuration
+        if resource_directory is None:
+            resource_directory = os.path.dirname(__file__)
+
+        with open(os.path.join(resource_directory, 'config/deduplicate_prompts.json')) as f:
+            config = json.load(f)
+        if memo_file is None:
+            self.memo_file = config['memo_file']
+        else:
+            self.memo_file = memo_file
+        if max_memo_bytes is None:
+            self.max_memo_bytes = config['max_memo_bytes']
+        else:
+            self.max_memo_bytes = max_memo_bytes
+        if model_path is None:
+            self.model_path = config['model_path']
+        else:
+            self.model_path = model_path
+
+    def deduplicate(self, input_file, output_file, index_file, dataset_info=None, dataset_name=None):
+        """
+        Write the prompts of input_file that are neither repeated nor in the memo to output_file, and the key of
+        every row to index_file. The output file is registered as dataset_name in dataset_info when given.
+        """
+        with open(input_file, encoding='utf-8') as f:
+            prompts = json.load(f)
+        fingerprint = model_fingerprint(self.model_path)
+        keys = [prompt_key(prompt_entry, fingerprint) for prompt_entry in prompts]
+
+        memo = PredictionMemo(self.memo_file, self.max_memo_bytes)
+        try:
+            memo_keys = set(memo.get_many(set(keys)))
+        finally:
+            memo.close()
+        unique_keys = []
+        unique_prompts = []
+        seen = set(memo_keys)
+        for key, prompt_entry in zip(keys, prompts):
+            if key not in seen:
+                seen.add(key)
+                unique_keys.append(key)
+                unique_prompts.append(prompt_entry)
+
+        with open(output_file, 'w') as f:
+            f.write(json.dumps(unique_prompts, indent=2, ensure_ascii=False))
+        with open(index_file, 'w') as f:
+            json.dump({'model_path': self.model_path, 'fingerprint': fingerprint, 'keys': keys,
+                       'unique_keys': unique_keys}, f)
+        if dataset_info is not None and dataset_name is not None:
+            with open(dataset_info, encoding='utf-8') as f:
+                datasets = json.load(f)
+            datasets[dataset_name] = {
+                'file_name': os.path.relpath(output_file, os.path.dirname(dataset_info)),
+                'columns': {'prompt': 'instruction', 'query': 'input', 'response': 'output'},
+            }
+            with open(dataset_info, 'w', encoding='utf-8') as f:
+                json.dump(datasets, f, indent=4, ensure_ascii=False)
+
+        print(f'{len(prompts)} rows, {len(set(keys))} distinct prompts, {len(memo_keys)} found in the memo.')
+        print(f'{len(unique_prompts)} prompts to predict written to {output_file}.')
+
+    def expand(self, input_file, index_file, prediction_file, output_file):
+        """
+        Store the predictions of the deduplicated prompts in the memo and write one prediction per row of
+        input_file, in its order, in the generated_predictions.jsonl format combine_prediction_results reads.
+        """
+        with open(input_file, encoding='utf-8') as f:
+            prompts = json.load(f)
+        with open(index_file) as f:
+            index = json.load(f)
+        if len(index['keys']) != len(prompts):
+            raise ValueError(f'{index_file} does not index {input_file}')
+        # an adapter trained again between deduplicate and expand made predictions the keys do not describe
+        if model_fingerprint(index['model_path']) != index['fingerprint']:
+            raise ValueError(f'{index["model_path"]} changed since {index_file} was written, deduplicate again')
+        with open(prediction_file, encoding='utf-8') as f:
+            predictions = [json.loads(line) for line in f if line.strip()]
+        if len(predictions) != len(index['unique_keys']):
+            raise ValueError(f'{prediction_file} has {len(predictions)} rows, {len(index["unique_keys"])} expected')
+
+        records = dict(zip(index['unique_keys'], predictions))
+        memo = PredictionMemo(self.memo_file, self.max_memo_bytes)
+        try:
+            records.update(memo.get_many(set(index['keys']) - set(records)))
+            missing = set(index['keys']) - set(records)
+            if missing:
+                raise ValueError(f'{len(missing)} predictions are neither in {prediction_file} nor in the memo')
+            n_evicted = memo.put_many(dict(zip(index['unique_keys'], predictions)))
+        finally:
+            memo.close()
+
+        with open(output_file, 'w', encoding='utf-8') as f:
+            for key, prompt_entry in zip(index['keys'], prompts):
+                # the gold label belongs to the row, the prediction to its prompt
+                record = dict(records[key])
+                if 'label' in record:
+                    record['label'] = prompt_entry['output']
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        print(f'{len(prompts)} predictions written to {output_file}, {n_evicted} memo entries evicted.')
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("command", choices=['deduplicate', 'expand'])
+    parser.add_argument("--resource_directory", required=False, default=None, type=str)
+    parser.add_argument("--input_file", required=True, type=str)
+    parser.add_argument("--output_file", required=True, type=str)
+    parser.add_argument("--index_file", required=True, type=str)
+    parser.add_argument("--prediction_file", required=False, default=None, type=str)
+    parser.add_argument("--dataset_info", required=False, default=None, type=str)
+    parser.add_argument("--dataset_name", required=False, default=None, type=str)
+    parser.add_argument("--memo_file", required=False, default=None, type=str)
+    parser.add_argument("--max_memo_bytes", required=False, default=None, type=int)
+    parser.add_argument("--model_path", required=False, default=None, type=str)
+    args = parser.parse_args()
+
+    deduplication = prompt_deduplication(args.resource_directory, args.memo_file, args.max_memo_bytes, args.model_path)
+    if args.command == 'deduplicate':
+        deduplication.deduplicate(args.input_file, args.output_file, args.index_file, args.dataset_info,
+                                  args.dataset_name)
+    else:
+        if args.prediction_file is None:
+            parser.error('expand needs --prediction_file')
+        deduplication.expand(args.input_file, args.index_file, args.prediction_file, args.output_file)
@@ -7,13 +7,17 @@ Date:
     2023/02/07
 """
 import json
+import math
 import os
 import random
+import sys
+import textwrap
 from argparse import ArgumentParser
 import html
 
-import pandas as pd
-from tqdm import tqdm
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import add_arguments, count, instrument, timed, timer
+from span_table import is_columnar, read_records
 
 INSTRUCTION_PROMPT = [
     "You are a helpful information extraction system. Your job is to extract skill entities and knowledge entities from the given sentence.",
@@ -22,16 +26,17 @@ INSTRUCTION_PROMPT = [
 
 
 class data_preparation:
-    def __init__(self, resource_directory, annotation_file, output_file, labels) -> None:
+    def __init__(self, resource_directory, annotation_file, output_file, labels, streaming=None) -> None:
         """
         The data preparation class takes in input of annotation file, and prepare data of different format for fine-tuning purpose.
 
         Parameters
         ----------
         resource_directory: directory containing the config file
-        annotation_file: input jsonl file
+        annotation_file: input jsonl file, or its .parquet/.arrow columnar version
         output_file: output json file used by llama factory
         labels: list of labels
+        streaming: read the annotation file record by record and write the prompts as they are built
         """
         # get configuration
         if resource_directory is None:
@@ -41,6 +46,7 @@ class data_preparation:
             config = json.load(f)
         if annotation_file is None:
             annotation_file = config['annotation_file']
+        self.annotation_file = annotation_file
         if output_file is None:
             self.output_file = config['output_file']
         else:
@@ -50,7 +56,19 @@ class data_preparation:
         else:
             self.labels = labels
         self.labels = eval(self.labels)
-        self.annotation_data = pd.read_json(path_or_buf=annotation_file, lines=True, encoding='utf-8', encoding_errors='replace')
+        if streaming is None:
+            self.streaming = config['streaming']
+        else:
+            self.streaming = streaming
+        # the streaming mode never loads the whole annotation file
+        with timer('prepare.read'):
+            if not self.streaming:
+                # pandas is only needed, and imported, when the whole file is loaded
+                import pandas as pd
+                if is_columnar(annotation_file):
+                    self.annotation_data = pd.DataFrame.from_records(list(read_records(annotation_file)))
+                else:
+                    self.annotation_data = pd.read_json(path_or_buf=annotation_file, lines=True, encoding='utf-8', encoding_errors='replace')
         self.instruction_prompt = INSTRUCTION_PROMPT
 
     def label_and_context_list_data(self):
@@ -65,47 +83,73 @@ class data_preparation:
                 },
             ]
         """
+        if self.streaming:
+            # the build timer covers reading the annotation file, the rest of the time is spent writing
+            self.write_file_incrementally(timed(self.generate_prompts(), 'prepare.build_prompts'), self.output_file)
+            return
+        from tqdm import tqdm
         prompt = []
-        for index in tqdm(range(self.annotation_data.shape[0])):
-            data_entry = self.annotation_data.iloc[index]
-            text, spans, tokens = data_entry.text, data_entry.spans, data_entry.tokens
-            prompt_entry = {
-                "instruction": random.choice(self.instruction_prompt),
-                "input": "** " + text + " **",
-            }
-            response_entry = {label: [] for label in self.labels}
-            if (isinstance(spans, float)) or (spans is None):
-                if pd.isnull(spans):
-                    spans = []
-            for span in spans:
-                span_type = span["label"]
-                token_start_index, token_end_index = span["token_start"], span["token_end"]
-                span_tokens = tokens[token_start_index:token_end_index+1]
-                context = ""
-                skill_span = ""
-                if token_start_index == 0:
-                    context += "** "
-                else:
-                    context += tokens[token_start_index-1]['text']
-                    if tokens[token_start_index-1]['ws']:
-                        context += " "
-                for i, token in enumerate(span_tokens):
-                    skill_span += token['text']
-                    context += token['text']
-                    if token['ws']:
-                        if i < len(span_tokens)-1:
-                            skill_span += " "
-                        context += " "
-                if token_end_index >= len(tokens) - 1:
-                    context += " **"
-                else:
-                    context += tokens[token_end_index+1]['text']
-                skill_span = html.unescape(skill_span)
-                context = html.unescape(context)
-                response_entry[span_type].append({"skill_span": skill_span, "context": context})
-            prompt_entry["output"] = json.dumps(response_entry, ensure_ascii=False)
-            prompt.append(prompt_entry)
-        self.write_file(prompt, self.output_file)
+        with timer('prepare.build_prompts'):
+            for index in tqdm(range(self.annotation_data.shape[0])):
+                data_entry = self.annotation_data.iloc[index]
+                prompt.append(self.build_prompt_entry(data_entry.text, data_entry.spans, data_entry.tokens))
+        with timer('prepare.write'):
+            self.write_file(prompt, self.output_file)
+
+    def generate_prompts(self):
+        """
+        Yield the prompt of every record of the annotation file, reading one line at a time.
+        """
+        from tqdm import tqdm
+        if is_columnar(self.annotation_file):
+            for data_entry in tqdm(read_records(self.annotation_file)):
+                yield self.build_prompt_entry(data_entry['text'], data_entry.get('spans'), data_entry['tokens'])
+            return
+        with open(self.annotation_file, encoding='utf-8', errors='replace') as f:
+            for line in tqdm(f):
+                if not line.strip():
+                    continue
+                data_entry = json.loads(line)
+                yield self.build_prompt_entry(data_entry['text'], data_entry.get('spans'), data_entry['tokens'])
+
+    def build_prompt_entry(self, text, spans, tokens):
+        """
+        Build the prompt of one annotated sentence, skill spans and contexts are joined from token slices.
+        """
+        prompt_entry = {
+            "instruction": random.choice(self.instruction_prompt),
+            "input": "** " + text + " **",
+        }
+        response_entry = {label: [] for label in self.labels}
+        # missing spans are None, or NaN in a DataFrame
+        if spans is None or (isinstance(spans, float) and math.isnan(spans)):
+            spans = []
+        count('prepare.records')
+        count('prepare.spans', len(spans))
+        if len(spans) == 0:
+            count('prepare.records_without_spans')
+        for span in spans:
+            span_type = span["label"]
+            token_start_index, token_end_index = span["token_start"], span["token_end"]
+            span_tokens = tokens[token_start_index:token_end_index+1]
+            # every token followed by its whitespace, the skill span drops the one after the last token
+            span_pieces = [token['text'] + " " if token['ws'] else token['text'] for token in span_tokens]
+            skill_span = "".join(span_pieces[:-1]) + span_tokens[-1]['text'] if len(span_tokens) > 0 else ""
+            if token_start_index == 0:
+                context = "** "
+            else:
+                previous_token = tokens[token_start_index-1]
+                context = previous_token['text'] + " " if previous_token['ws'] else previous_token['text']
+            context += "".join(span_pieces)
+            if token_end_index >= len(tokens) - 1:
+                context += " **"
+            else:
+                context += tokens[token_end_index+1]['text']
+            skill_span = html.unescape(skill_span)
+            context = html.unescape(context)
+            response_entry[span_type].append({"skill_span": skill_span, "context": context})
+        prompt_entry["output"] = json.dumps(response_entry, ensure_ascii=False)
+        return prompt_entry
 
     def write_file(self, prompt, output_file):
         """
@@ -115,14 +159,129 @@ class data_preparation:
         with open(output_file, "w") as json_file:
             json_file.write(prompt)
 
+    def write_file_incrementally(self, prompts, output_file):
+        """
+        Write prompts one at a time, as the same indented JSON array as write_file or as JSON lines for a .jsonl file
+        """
+        with open(output_file, "w", encoding="utf-8") as json_file:
+            if output_file.endswith(".jsonl"):
+                for prompt_entry in prompts:
+                    json_file.write(json.dumps(prompt_entry, ensure_ascii=False))
+                    json_file.write("\n")
+                return
+
+            separator = "[\n"
+            for prompt_entry in prompts:
+                json_file.write(separator)
+                json_file.write(textwrap.indent(json.dumps(prompt_entry, indent=2, ensure_ascii=False), "  "))
+                separator = ",\n"
+            json_file.write("[]" if separator == "[\n" else "\n]")
 
-if __name__ == "__main__":
-    parser = ArgumentParser()
+    @staticmethod
+    def save_tokenized_dataset(train_config, tokenized_path, cutoff_len=None):
+        """
+        Tokenize the dataset of a LLaMA-Factory config with its template and cutoff_len, and save it where
+        `tokenized_path` makes LLaMA-Factory load it instead of tokenizing at every launch.
+
+        The tokenization is LLaMA-Factory's own, the dataset and eval_dataset of the config are saved as the train
+        and validation splits of a DatasetDict. Next to them are the token length of every example
+        ({split}_lengths.npy), the example indices sorted by length ({split}_length_sorted_index.npy), both loadable
+        with mmap_mode='r', and length statistics (length_stats.json).
+
+        With packing, LLaMA-Factory saves packed sequences padded to cutoff_len, whose lengths are all the same. The
+        lengths, the sorted index and the statistics are then those of the examples before packing, in the order of
+        the dataset files, from a second tokenization without packing.
+
+        Parameters
+        ----------
+        train_config: LLaMA-Factory yaml config, e.g. train/config/skill_span_train.yaml
+        tokenized_path: directory of the tokenized dataset
+        cutoff_len: overrides the cutoff_len of the config
+        """
+        import numpy as np
+        import pyarrow.compute as pc
+        import yaml
+        from datasets import DatasetDict
+        from llamafactory.data import get_dataset
+        from llamafactory.hparams import get_train_args
+        from llamafactory.model import load_tokenizer
+
+        with open(train_config) as f:
+            args = yaml.safe_load(f)
+        # without a tokenized_path LLaMA-Factory returns the datasets instead of saving them and exiting
+        args.pop('tokenized_path', None)
+        if cutoff_len is not None:
+            args['cutoff_len'] = cutoff_len
+        model_args, data_args, training_args, _, _ = get_train_args(args)
+        tokenizer_module = load_tokenizer(model_args)
+        dataset_module = get_dataset(model_args, data_args, training_args, stage=args.get('stage', 'sft'),
+                                     **tokenizer_module)
+        splits = [('train', 'train_dataset'), ('validation', 'eval_dataset')]
+        dataset_dict = DatasetDict({split: dataset_module[key] for split, key in splits if key in dataset_module})
+        dataset_dict.save_to_disk(tokenized_path)
+
+        packing = bool(data_args.packing)
+        unpacked_dict = dataset_dict
+        if packing:
+            model_args, data_args, training_args, _, _ = get_train_args({**args, 'packing': False,
+                                                                         'neat_packing': False})
+            dataset_module = get_dataset(model_args, data_args, training_args, stage=args.get('stage', 'sft'),
+                                         **tokenizer_module)
+            unpacked_dict = {split: dataset_module[key] for split, key in splits if key in dataset_module}
+
+        length_stats = {}
+        for split, dataset in unpacked_dict.items():
+            lengths = np.concatenate([pc.list_value_length(batch['input_ids']).to_numpy(zero_copy_only=False)
+                                      for batch in dataset.with_format('arrow').iter(batch_size=10000)])
+            np.save(os.path.join(tokenized_path, f'{split}_lengths.npy'), lengths)
+            np.save(os.path.join(tokenized_path, f'{split}_length_sorted_index.npy'), np.argsort(lengths, kind='stable'))
+            length_stats[split] = {
+                'examples': int(len(lengths)),
+                'tokens': int(lengths.sum()),
+                'min': int(lengths.min()),
+                'max': int(lengths.max()),
+                'mean': float(lengths.mean()),
+                'p50': float(np.percentile(lengths, 50)),
+                'p90': float(np.percentile(lengths, 90)),
+                'p99': float(np.percentile(lengths, 99)),
+                'at_cutoff_len': int((lengths >= data_args.cutoff_len).sum()),
+                'sequences': len(dataset_dict[split]),
+            }
+        length_stats['template'] = data_args.template
+        length_stats['cutoff_len'] = data_args.cutoff_len
+        length_stats['packing'] = packing
+        with open(os.path.join(tokenized_path, 'length_stats.json'), 'w') as f:
+            json.dump(length_stats, f, indent=2)
+        print(f'Tokenized dataset saved at {tokenized_path}: {json.dumps(length_stats)}')
+
+
+def build_parser(parser=None):
+    if parser is None:
+        parser = ArgumentParser()
     parser.add_argument("--resource_directory", required=False, default=None, type=str)
     parser.add_argument("--annotation_file", required=False, default=None, type=str)
     parser.add_argument("--output_file", required=False, default=None, type=str)
     parser.add_argument("--labels", required=False, default=None, type=str)
-    args = parser.parse_args()
+    parser.add_argument("--streaming", required=False, default=None, action='store_true')
+    parser.add_argument("--tokenize_config", required=False, default=None, type=str,
+                        help="LLaMA-Factory config whose datasets are tokenized once the prompts are written")
+    parser.add_argument("--tokenized_path", required=False, default=None, type=str)
+    parser.add_argument("--cutoff_len", required=False, default=None, type=int)
+    add_arguments(parser)
+    return parser
+
 
-    data_processer = data_preparation(args.resource_directory, args.annotation_file, args.output_file, args.labels)
-    data_processer.label_and_context_list_data()
+def main(args):
+    if args.tokenize_config is not None and args.tokenized_path is None:
+        raise ValueError('--tokenize_config needs --tokenized_path')
+
+    with instrument('prepare', args.metrics_file, args.profile, args.profile_file):
+        data_processer = data_preparation(args.resource_directory, args.annotation_file, args.output_file, args.labels, args.streaming)
+        data_processer.label_and_context_list_data()
+        if args.tokenize_config is not None:
+            with timer('prepare.tokenize'):
+                data_processer.save_tokenized_dataset(args.tokenize_config, args.tokenized_path, args.cutoff_len)
+
+
+if __name__ == "__main__":
+    main(build_parser().parse_args())
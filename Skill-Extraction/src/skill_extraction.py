@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Single entry point of the pipeline scripts, e.g. skill-extraction combine --streaming. \
+Date:
+    2026/10/18
+
+Only the script of the subcommand is imported, and the scripts import their heavy dependencies (spaCy, pandas,
+datasets, pyarrow) where they use them, so --help and small runs start in a fraction of a second. The Hugging Face
+libraries are kept offline, datasets are read from a local path or the local cache, unless HF_HUB_OFFLINE or
+HF_DATASETS_OFFLINE is set to 0.
+
+Usage:
+    python skill_extraction.py prepare --annotation_file data/test.jsonl --output_file data/test.json
+    python skill_extraction.py combine --streaming --batch_size 256
+    python skill_extraction.py evaluate --prediction_file processed_predictions.jsonl --label_file data/test.jsonl
+    python skill_extraction.py serve --backend llm --base_url http://localhost:8000/v1
+"""
+import importlib
+import os
+import sys
+from argparse import ArgumentParser
+
+SRC_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+CLEANING_DIRECTORY = os.path.join(SRC_DIRECTORY, '..', '..', 'Data-Cleaning-Freelancer-Dataset')
+
+# subcommand: (directory of the script, module, description)
+COMMANDS = {
+    'prepare': (os.path.join(SRC_DIRECTORY, 'preprocessing'), 'prepare_data',
+                'build the fine-tuning prompts of a span annotated file'),
+    'convert': (os.path.join(SRC_DIRECTORY, 'preprocessing'), 'convert_iob_tags_to_offset_tags',
+                'convert an IOB tagged dataset to span annotated files'),
+    'combine': (os.path.join(SRC_DIRECTORY, 'postprocessing'), 'combine_prediction_results',
+                'align the generated predictions with the tokens of their sentences'),
+    'repair': (os.path.join(SRC_DIRECTORY, 'postprocessing'), 'repredict_failed_rows',
+               'select the rows whose prediction failed to parse, or merge their new predictions'),
+    'evaluate': (os.path.join(SRC_DIRECTORY, 'evaluation'), 'evaluate_token_based_results',
+                 'score processed predictions against the labels'),
+    'serve': (SRC_DIRECTORY, 'extraction_service',
+              'serve the GLiNER model or the LLM over HTTP, batching concurrent requests'),
+    'clean': (CLEANING_DIRECTORY, 'cleaning', 'clean the freelancer job postings CSV'),
+}
+
+
+def load_command(command):
+    """
+    Import the script of a subcommand, with its directory on sys.path for its sibling imports.
+    """
+    directory, module, _ = COMMANDS[command]
+    directory = os.path.abspath(directory)
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    return importlib.import_module(module)
+
+
+def build_parser():
+    parser = ArgumentParser(prog='skill-extraction', description='Skill extraction pipeline.')
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    for command, (_, _, description) in COMMANDS.items():
+        # the arguments of a subcommand are only known once its script is imported
+        subparsers.add_parser(command, help=description, add_help=False)
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] not in COMMANDS:
+        build_parser().parse_args(argv)
+        build_parser().print_help()
+        return 2
+    # no network calls, the model and the datasets must be available locally
+    os.environ.setdefault('HF_HUB_OFFLINE', '1')
+    os.environ.setdefault('HF_DATASETS_OFFLINE', '1')
+    command = argv[0]
+    module = load_command(command)
+    _, _, description = COMMANDS[command]
+    parser = module.build_parser(ArgumentParser(prog=f'skill-extraction {command}', description=description))
+    module.main(parser.parse_args(argv[1:]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+"""
+Columnar Arrow/Parquet format of the span annotated JSONL files exchanged by the pipeline scripts. \
+Date:
+    2026/10/18
+
+Every record {"text", "tokens", "spans"} is one row: the tokens are stored as parallel list columns (text,
+whitespace flag, offsets and id) and the spans as a list of structs. Files ending in .parquet or .arrow use this
+format, every other file is read and written as JSONL. Converting JSONL to either format and back gives the same
+records.
+
+Usage:
+    python span_table.py --input_file test.jsonl --output_file test.parquet
+"""
+import functools
+import itertools
+import json
+import os
+from argparse import ArgumentParser
+
+COLUMNAR_EXTENSIONS = ('.parquet', '.arrow')
+TOKEN_FIELDS = ['id', 'start', 'end', 'ws', 'text']
+# span fields in output order, the last ones are optional
+SPAN_FIELDS = ['start', 'end', 'label', 'token_start', 'token_end', 'score']
+REQUIRED_SPAN_FIELDS = {'start', 'end', 'label'}
+
+COLUMNS = ['text', 'token_id', 'token_start', 'token_end', 'token_ws', 'token_text', 'spans']
+
+
+@functools.lru_cache(maxsize=None)
+def table_schema():
+    """
+    Arrow schema of the columnar files, pyarrow is only imported once a columnar file is read or written.
+    """
+    import pyarrow as pa
+    return pa.schema([
+        ('text', pa.string()),
+        ('token_id', pa.list_(pa.int32())),
+        ('token_start', pa.list_(pa.int64())),
+        ('token_end', pa.list_(pa.int64())),
+        ('token_ws', pa.list_(pa.bool_())),
+        ('token_text', pa.list_(pa.string())),
+        ('spans', pa.list_(pa.struct([
+            ('start', pa.int64()),
+            ('end', pa.int64()),
+            ('label', pa.string()),
+            ('token_start', pa.int64()),
+            ('token_end', pa.int64()),
+            ('score', pa.float64()),
+        ]))),
+    ])
+
+
+def is_columnar(path):
+    return path.endswith(COLUMNAR_EXTENSIONS)
+
+
+def check_record(record):
+    """
+    Refuse records the columnar format cannot store exactly.
+    """
+    extra_keys = set(record) - {'text', 'tokens', 'spans'}
+    if extra_keys:
+        raise ValueError(f'Unsupported record fields {sorted(extra_keys)}')
+    for token in record.get('tokens') or []:
+        if set(token) != set(TOKEN_FIELDS):
+            raise ValueError(f'Unsupported token fields {sorted(token)}')
+    for span in record.get('spans') or []:
+        if not REQUIRED_SPAN_FIELDS <= set(span) or not set(span) <= set(SPAN_FIELDS):
+            raise ValueError(f'Unsupported span fields {sorted(span)}')
+
+
+def records_to_table(records):
+    """
+    Build the columnar table of a list of records, missing tokens or spans are stored as nulls.
+    """
+    import pyarrow as pa
+    columns = {name: [] for name in COLUMNS}
+    for record in records:
+        check_record(record)
+        columns['text'].append(record['text'])
+        tokens = record.get('tokens')
+        for field in TOKEN_FIELDS:
+            columns[f'token_{field}'].append(None if tokens is None else [token[field] for token in tokens])
+        columns['spans'].append(record.get('spans'))
+    return pa.Table.from_pydict(columns, schema=table_schema())
+
+
+def batch_to_records(batch):
+    """
+    Yield the records of a record batch or table, with the fields of the JSONL records in their original order.
+    """
+    columns = batch.to_pydict()
+    n_rows = batch.num_rows
+    texts = columns.get('text', [None] * n_rows)
+    token_columns = [columns.get(f'token_{field}') for field in TOKEN_FIELDS]
+    spans = columns.get('spans')
+    for i in range(n_rows):
+        record = {}
+        if 'text' in columns:
+            record['text'] = texts[i]
+        if all(column is not None for column in token_columns) and token_columns[0][i] is not None:
+            record['tokens'] = [dict(zip(TOKEN_FIELDS, token)) for token in zip(*(column[i] for column in token_columns))]
+        if spans is not None and spans[i] is not None:
+            record['spans'] = [{field: value for field, value in span.items() if value is not None} for span in spans[i]]
+        yield record
+
+
+def iter_record_batches(path, columns=None, batch_size=10000):
+    """
+    Yield the record batches of a columnar file. Arrow files are memory mapped, so only the columns read are paged in.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    if path.endswith('.arrow'):
+        with pa.memory_map(path) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                yield batch.select(columns) if columns is not None else batch
+    else:
+        parquet_file = pq.ParquetFile(path, memory_map=True)
+        yield from parquet_file.iter_batches(batch_size=batch_size, columns=columns)
+
+
+def read_records(path, columns=None):
+    """
+    Yield the records of a JSONL or columnar file one by one.
+
+    Parameters
+    ----------
+    path: .jsonl, .parquet or .arrow file
+    columns: columns of a columnar file to read, None reads them all (JSONL records are always read whole)
+    """
+    if is_columnar(path):
+        for batch in iter_record_batches(path, columns):
+            yield from batch_to_records(batch)
+    else:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def read_spans(path):
+    """
+    Return the span list of every record, an empty list where there are none. Columnar files only read the spans.
+    """
+    return [record.get('spans') or [] for record in read_records(path, columns=['spans'])]
+
+
+def write_records(records, path, batch_size=10000):
+    """
+    Write records to a JSONL or columnar file as they are generated.
+    """
+    if not is_columnar(path):
+        with open(path, mode='w') as f:
+            for record in records:
+                json.dump(record, f, ensure_ascii=False)
+                f.write('\n')
+        return
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    records = iter(records)
+    if path.endswith('.arrow'):
+        writer = pa.ipc.new_file(path, table_schema())
+    else:
+        writer = pq.ParquetWriter(path, table_schema())
+    try:
+        for batch in iter(lambda: list(itertools.islice(records, batch_size)), []):
+            writer.write_table(records_to_table(batch))
+    finally:
+        writer.close()
+
+
+def convert(input_file, output_file):
+    write_records(read_records(input_file), output_file)
+    print(f'{input_file} ({os.path.getsize(input_file)} bytes) -> {output_file} ({os.path.getsize(output_file)} bytes)')
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--input_file", required=True, type=str)
+    parser.add_argument("--output_file", required=True, type=str)
+    args = parser.parse_args()
+    convert(args.input_file, args.output_file)
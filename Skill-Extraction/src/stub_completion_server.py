@@ -0,0 +1,198 @@
+"""
+Stub of an OpenAI compatible server answering canned generations, to check prediction_client.py without a model. \
+Date:
+    2026/10/18
+
+The stub answers /v1/completions and /v1/chat/completions with the gold output of the prompt, taken from a prompt
+file of prepare_data.py, and an empty prediction for unknown prompts. The first --failures attempts of every prompt
+get a 503 and every answer is delayed by a random time, so the client retries and its requests complete out of order.
+
+check runs PredictionClient against a stub started in the same process and verifies that:
+    - every failed attempt was retried until it succeeded
+    - every row was written once to the partial file with its row id, in completion order
+    - the output file has one record per row, in row order, in the generated_predictions.jsonl schema read by
+      combine_prediction_results.py, with the generation of its own prompt
+    - every prediction parses into the category of the generation served for its prompt, some gold outputs of
+      data/test.json are lists of strings that parse_prediction classes as schema errors, and repeated inputs are
+      served the output of their last row
+It exits with 1 when a check fails.
+
+Usage:
+    python stub_completion_server.py serve --input_file data/test.json --port 8000
+    python stub_completion_server.py check --input_file data/test.json --api completions
+"""
+import asyncio
+import collections
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+from argparse import ArgumentParser
+
+from aiohttp import web
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'postprocessing'))
+from combine_prediction_results import iter_json_records
+from prediction_client import LLAMA3_TEMPLATE, PredictionClient, build_content, read_prompts, write_ordered
+from prediction_parser import parse_prediction
+
+EMPTY_PREDICTION = '{"SKILL": [], "KNOWLEDGE": []}'
+# fields of LLaMA-Factory's generated_predictions.jsonl
+PREDICTION_FIELDS = {'prompt', 'label', 'predict'}
+
+
+def strip_template(prompt):
+    """
+    The user content of a completions prompt formatted with LLAMA3_TEMPLATE, prompts without it are returned as is.
+    """
+    prefix, suffix = LLAMA3_TEMPLATE.split('{content}')
+    if prompt.startswith(prefix) and prompt.endswith(suffix):
+        return prompt[len(prefix):len(prompt) - len(suffix)]
+    return prompt
+
+
+class StubCompletionServer:
+    def __init__(self, prompts=(), failures=1, max_delay=0.05, seed=0) -> None:
+        """
+        Parameters
+        ----------
+        prompts: prompt records of prepare_data.py, their output is the generation of their input
+        failures: number of attempts of every prompt answered with a 503 before it succeeds
+        max_delay: largest delay of an answer in seconds
+        seed: seed of the delays
+        """
+        self.generations = {prompt_entry['input']: prompt_entry['output'] for prompt_entry in prompts}
+        self.failures = failures
+        self.max_delay = max_delay
+        self.random = random.Random(seed)
+        self.attempts = collections.Counter()
+
+    def generation(self, content):
+        # build_content puts the input on the last line, after the instruction
+        return self.generations.get(content.rsplit('\n', 1)[-1], EMPTY_PREDICTION)
+
+    async def respond(self, content):
+        """
+        The generation of one user content, None for an attempt that fails.
+        """
+        self.attempts[content] += 1
+        if self.attempts[content] <= self.failures:
+            return None
+        await asyncio.sleep(self.random.uniform(0, self.max_delay))
+        return self.generation(content)
+
+    async def chat(self, request):
+        body = await request.json()
+        generation = await self.respond(body['messages'][-1]['content'])
+        if generation is None:
+            raise web.HTTPServiceUnavailable()
+        return web.json_response({'object': 'chat.completion', 'model': body.get('model'), 'choices': [
+            {'index': 0, 'message': {'role': 'assistant', 'content': generation}, 'finish_reason': 'stop'}]})
+
+    async def completions(self, request):
+        body = await request.json()
+        prompts = body['prompt'] if isinstance(body['prompt'], list) else [body['prompt']]
+        generations = await asyncio.gather(*(self.respond(strip_template(prompt)) for prompt in prompts))
+        if any(generation is None for generation in generations):
+            raise web.HTTPServiceUnavailable()
+        choices = [{'index': index, 'text': generation, 'finish_reason': 'stop'}
+                   for index, generation in enumerate(generations)]
+        # the index of a choice tells its prompt, not its position
+        self.random.shuffle(choices)
+        return web.json_response({'object': 'text_completion', 'model': body.get('model'), 'choices': choices})
+
+    def build_app(self):
+        app = web.Application()
+        app.add_routes([web.post('/v1/chat/completions', self.chat), web.post('/v1/completions', self.completions)])
+        return app
+
+
+async def check_client(prompts, output_file, api='chat', concurrency=16, failures=1, max_delay=0.05, seed=0):
+    """
+    Predict prompts with PredictionClient against a stub on a free local port.
+
+    Returns
+    -------
+    (report, passed), report maps every check to whether it passed
+    """
+    stub = StubCompletionServer(prompts, failures, max_delay, seed)
+    runner = web.AppRunner(stub.build_app())
+    await runner.setup()
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    site = web.SockSite(runner, sock)
+    await site.start()
+    try:
+        client = PredictionClient(f'http://127.0.0.1:{sock.getsockname()[1]}/v1', 'stub', api,
+                                  concurrency=concurrency, max_retries=failures, backoff=0.01)
+        partial_file = f'{output_file}.partial'
+        if os.path.exists(partial_file):
+            os.remove(partial_file)
+        await client.run(prompts, partial_file)
+    finally:
+        await runner.cleanup()
+
+    with open(partial_file, encoding='utf-8') as f:
+        completed_ids = [json.loads(line)['id'] for line in f]
+    write_ordered(partial_file, output_file, len(prompts))
+    records = list(iter_json_records(output_file))
+
+    # repeated prompts only fail on their first attempts
+    expected_attempts = {content: failures + n for content, n in
+                         collections.Counter(build_content(prompt_entry) for prompt_entry in prompts).items()}
+    report = {
+        'retried': dict(stub.attempts) == expected_attempts,
+        'ids_written_once': sorted(completed_ids) == list(range(len(prompts))),
+        'completed_out_of_order': completed_ids != sorted(completed_ids) or concurrency == 1,
+        'rows_in_order': len(records) == len(prompts) and all(
+            record['label'] == prompt_entry['output'] and record['predict'] == stub.generation(prompt_entry['input'])
+            for record, prompt_entry in zip(records, prompts)),
+        'combine_schema': all(set(record) == PREDICTION_FIELDS for record in records),
+        'predictions_parse': len(records) == len(prompts) and all(
+            parse_prediction(record['predict'])[1] == parse_prediction(stub.generation(prompt_entry['input']))[1]
+            for record, prompt_entry in zip(records, prompts)),
+    }
+    return report, all(report.values())
+
+
+def build_parser(parser=None):
+    if parser is None:
+        parser = ArgumentParser()
+    parser.add_argument("command", choices=['serve', 'check'])
+    parser.add_argument("--input_file", required=False, default=None, type=str,
+                        help="prompts of prepare_data.py, their outputs are the canned generations")
+    parser.add_argument("--output_file", required=False, default=None, type=str,
+                        help="predictions written by check, a temporary file by default")
+    parser.add_argument("--host", required=False, default='127.0.0.1', type=str)
+    parser.add_argument("--port", required=False, default=8000, type=int)
+    parser.add_argument("--api", required=False, default='chat', choices=['chat', 'completions'], type=str)
+    parser.add_argument("--concurrency", required=False, default=16, type=int)
+    parser.add_argument("--failures", required=False, default=1, type=int)
+    parser.add_argument("--max_delay", required=False, default=0.05, type=float)
+    parser.add_argument("--limit", required=False, default=500, type=int, help="rows predicted by check")
+    parser.add_argument("--seed", required=False, default=0, type=int)
+    return parser
+
+
+def main(args):
+    prompts = read_prompts(args.input_file) if args.input_file is not None else []
+    if args.command == 'serve':
+        stub = StubCompletionServer(prompts, args.failures, args.max_delay, args.seed)
+        web.run_app(stub.build_app(), host=args.host, port=args.port)
+        return
+    if not prompts:
+        raise ValueError('check needs the prompts of --input_file')
+    prompts = prompts[:args.limit]
+    with tempfile.TemporaryDirectory() as directory:
+        output_file = args.output_file or os.path.join(directory, 'generated_predictions.jsonl')
+        report, passed = asyncio.run(check_client(prompts, output_file, args.api, args.concurrency, args.failures,
+                                                  args.max_delay, args.seed))
+    print(json.dumps(report, indent=2))
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(build_parser().parse_args())
@@ -9,4 +9,9 @@ python Skill-Extraction/src/postprocessing/combine_prediction_results.py --base_
 # This organizes the model’s answers into a file.
 
 python Skill-Extraction/src/evaluation/evaluate_token_based_results.py --prediction_file saves/Meta-Llama-3-8B-Instruct/lora/results/processed_predictions.jsonl --label_file Skill-Extraction/data/test.jsonl
-# This checks if the model’s answers are correct.
\ No newline at end of file
+# This checks if the model’s answers are correct.
+
+python Skill-Extraction/src/postprocessing/repredict_failed_rows.py select --error_file saves/Meta-Llama-3-8B-Instruct/lora/results/error_data.csv --input_file Skill-Extraction/data/test.json --output_file Skill-Extraction/data/test_repair.json --dataset_info Skill-Extraction/data/dataset_info.json --dataset_name skillspan_test_repair
+python -c 'from llamafactory.train.tuner import run_exp; run_exp()' Skill-Extraction/src/train/config/skill_span_repair.yaml
+python Skill-Extraction/src/postprocessing/repredict_failed_rows.py merge --input_file Skill-Extraction/data/test_repair.json --prediction_file saves/Meta-Llama-3-8B-Instruct/lora/results/generated_predictions.jsonl --repair_prediction_file saves/Meta-Llama-3-8B-Instruct/lora/results_repair/generated_predictions.jsonl --output_file saves/Meta-Llama-3-8B-Instruct/lora/results/generated_predictions.jsonl
+# Optional: predicts again only the rows whose prediction could not be parsed and puts them back in place. Run the combine and evaluation steps again afterwards, and repeat while error_data.csv still has failed rows.